@@ -22,9 +22,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-gl)=-aosqw=cg-j5sd4m4)*k*e3-%+k)^=vmb&m3y)4!kxm-*6'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', 'true').lower() == 'true'
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',') if host]
 
 # Application definition
 
@@ -35,6 +35,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'drf_spectacular',
@@ -42,9 +43,11 @@ INSTALLED_APPS = [
     'core',
     'user',
     'loan',
+    'benchmarks',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,10 +86,22 @@ DATABASES = {
         'HOST': os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
-        'PASSWORD': os.environ.get('DB_PASS')
+        'PASSWORD': os.environ.get('DB_PASS'),
+        # keep connections open between requests, 0 closes them after every request
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'OPTIONS': {
+            # abort queries running longer than this many milliseconds, 0 disables the limit
+            'options': f"-c statement_timeout={int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))}",
+        },
     }
 }
 
+# Worker threads, each with its own database connection, running the queries of the async views in loan/async_views.py
+ASYNC_READ_THREADS = int(os.environ.get('ASYNC_READ_THREADS', 10))
+
+# Check persistent connections are still alive at the start of each request, see core/db.py
+DB_CONN_HEALTH_CHECKS = os.environ.get('DB_CONN_HEALTH_CHECKS', 'true').lower() == 'true'
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -133,3 +148,73 @@ AUTH_USER_MODEL = 'core.User'
 REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": 'drf_spectacular.openapi.AutoSchema',
 }
+
+# The default cache is shared by every worker process when MEMCACHED_LOCATION (host:port) is set, as
+# docker-compose.prod.yml does, and local to each process otherwise
+MEMCACHED_LOCATION = os.environ.get('MEMCACHED_LOCATION')
+if MEMCACHED_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': MEMCACHED_LOCATION,
+        },
+    }
+
+# Cached token authentication, see user/authentication.py
+TOKEN_AUTH_CACHE = {
+    'TIMEOUT': int(os.environ.get('TOKEN_AUTH_CACHE_TIMEOUT', 60)),
+    'MAX_ENTRIES': 10000,
+    'SHARED_CACHE': os.environ.get('TOKEN_AUTH_SHARED_CACHE') or ('default' if MEMCACHED_LOCATION else None),
+}
+
+# Response cache of the agency and solicitor lists, see loan/cache.py
+LIST_RESPONSE_CACHE = {
+    'TIMEOUT': int(os.environ.get('LIST_RESPONSE_CACHE_TIMEOUT', 300)),
+    'CACHE': os.environ.get('LIST_RESPONSE_CACHE') or 'default',
+}
+
+# Who may scrape /metrics, see core/metrics.py: the peer addresses of METRICS_ALLOWED_IPS (comma separated
+# addresses or networks) and requests with "Authorization: Bearer <METRICS_TOKEN>"
+METRICS = {
+    'ALLOWED_IPS': [network for network in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+                    if network],
+    'TOKEN': os.environ.get('METRICS_TOKEN') or None,
+}
+
+# In-process copies of the reference tables, see loan/fields.py
+REFERENCE_CACHE = {
+    'CACHE': os.environ.get('REFERENCE_CACHE') or 'default',
+    'MISS_TIMEOUT': int(os.environ.get('REFERENCE_CACHE_MISS_TIMEOUT', 5)),
+    'VERSION_CHECK_INTERVAL': 1,
+}
+
+# Cache of the serialized applications and estates, keyed on their row versions, see loan/fragments.py
+FRAGMENT_CACHE = {
+    'ENABLED': os.environ.get('FRAGMENT_CACHE', 'true').lower() == 'true',
+    'TIMEOUT': int(os.environ.get('FRAGMENT_CACHE_TIMEOUT', 24 * 60 * 60)),
+    'CACHE': os.environ.get('FRAGMENT_CACHE_ALIAS') or 'default',
+}
+
+# Insert the audit entries of the estate writes and imports in batches at the end of their transaction,
+# see core/audit.py
+AUDITLOG_BUFFERED = os.environ.get('AUDITLOG_BUFFERED', 'true').lower() == 'true'
+
+# Report the wall, database and serializer time of every request in a Server-Timing header and a JSON log line,
+# see core/timing.py. The Prometheus request metrics of /metrics are recorded either way
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'true').lower() == 'true'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # one JSON line per request at INFO
+        'core.timing': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
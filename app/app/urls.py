@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.urls import (path, include)
+from core.metrics import metrics_view
 from drf_spectacular.views import (
     SpectacularAPIView,
     SpectacularSwaggerView
@@ -13,5 +14,6 @@ urlpatterns = [
          name='api-docs'),
     path('api/user/', include('user.urls')),
     path('api/', include('loan.urls', namespace='loan')),
+    path('metrics', metrics_view, name='metrics'),
 
 ]
@@ -0,0 +1,3 @@
+"""
+Reproducible benchmarks of the loan API, run with `python manage.py benchmark`
+"""
@@ -0,0 +1,76 @@
+"""Django command to run the loan API benchmarks against a freshly seeded throwaway database"""
+import json
+import platform
+import subprocess
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from benchmarks import runner, seed
+from benchmarks.scenarios import SCENARIOS
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Seeds a test database and measures latency, queries and memory of the key loan API requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='benchmark-results.json', help='JSON file the results are written to')
+        parser.add_argument('--scale', type=int, default=1, help='Multiplies the number of agencies and applications')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the generated data')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per scenario before timing')
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help='Only run the named scenario, can be repeated')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the benchmark database for inspection')
+
+    def handle(self, *args, **options):
+        scenarios = SCENARIOS
+        if options['scenarios']:
+            scenarios = [scenario for scenario in SCENARIOS if scenario.name in options['scenarios']]
+            unknown = set(options['scenarios']) - {scenario.name for scenario in scenarios}
+            if unknown:
+                raise CommandError(f"Unknown scenario: {', '.join(sorted(unknown))}")
+
+        setup_test_environment()
+        # the test database is created from scratch, a kept one would already hold the seeded rows
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+        try:
+            self.stdout.write(f"Seeding scale {options['scale']}...")
+            seeded = seed.seed(scale=options['scale'], seed=options['seed'])
+            results = {}
+            for scenario in scenarios:
+                self.stdout.write(f'Running {scenario.name}...')
+                results.update(runner.run([scenario], seeded, options['iterations'], options['warmup']))
+        finally:
+            if not options['keepdb']:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'environment': {
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'parameters': {key: options[key] for key in ('scale', 'seed', 'iterations', 'warmup')},
+            'dataset': seeded['counts'],
+            'scenarios': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+            output.write('\n')
+
+        for name, figures in results.items():
+            latency = figures['latency_ms']
+            self.stdout.write(f"{name:20} p50 {latency['p50']:9.2f} ms  p99 {latency['p99']:9.2f} ms  "
+                              f"{figures['queries']:4} queries  {figures['peak_allocated_kib']:10.1f} KiB")
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
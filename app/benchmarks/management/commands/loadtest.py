@@ -0,0 +1,87 @@
+"""Django command to measure the throughput of a running server with concurrent keep-alive clients"""
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.runner import percentile
+
+
+class Client:
+    """One keep-alive connection requesting the URL until the deadline"""
+
+    def __init__(self, url, headers):
+        self.url = url
+        self.headers = headers
+        self.latencies = []
+        self.errors = 0
+        self.connection = None
+
+    def connect(self):
+        connection_class = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(self.url.hostname, self.url.port, timeout=60)
+
+    def run(self, deadline):
+        path = self.url.path + (f'?{self.url.query}' if self.url.query else '')
+        self.connect()
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                self.connection.request('GET', path, headers=self.headers)
+                response = self.connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                self.connection.close()
+                self.connect()
+                continue
+            if response.status == 200:
+                self.latencies.append(time.perf_counter() - started)
+            else:
+                self.errors += 1
+            if response.will_close:
+                self.connection.close()
+                self.connect()
+        self.connection.close()
+
+
+def run(url, token=None, concurrency=16, duration=20.0):
+    """Request the URL from concurrency clients for duration seconds, return the throughput and latencies"""
+    url = urlsplit(url)
+    headers = {'Authorization': f'Token {token}'} if token else {}
+    clients = [Client(url, headers) for _ in range(concurrency)]
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=client.run, args=(deadline,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = [latency for client in clients for latency in client.latencies]
+    return {
+        'requests_per_second': len(latencies) / duration,
+        'p50_ms': percentile(latencies, 0.5) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'errors': sum(client.errors for client in clients),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Requests a URL of a running server from concurrent keep-alive clients and reports the throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Full URL to request, e.g. http://app:8000/api/applications/?page_size=50')
+        parser.add_argument('--token', help='API token sent in the Authorization header')
+        parser.add_argument('--concurrency', type=int, default=16, help='Clients requesting at the same time')
+        parser.add_argument('--duration', type=float, default=20.0, help='Seconds to run for')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['duration'] <= 0:
+            raise CommandError('--concurrency and --duration have to be positive')
+        result = run(options['url'], options['token'], options['concurrency'], options['duration'])
+        if result['p50_ms'] is None:
+            raise CommandError(f"No request succeeded, {result['errors']} errors")
+        self.stdout.write(f"{result['requests_per_second']:.1f} req/s  p50 {result['p50_ms']:.0f} ms  "
+                          f"p99 {result['p99_ms']:.0f} ms  errors {result['errors']}")
@@ -0,0 +1,89 @@
+"""
+Runs the benchmark scenarios through the Django test client and collects their figures
+"""
+import statistics
+import time
+import tracemalloc
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from loan.cache import list_cache
+
+
+def percentile(samples, fraction):
+    """Nearest rank percentile of the samples"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def make_client(user):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get_or_create(user=user)[0].key}')
+    return client
+
+
+def send(client, scenario, ids):
+    """Send the scenario's request, in a rolled back transaction when it writes"""
+    arguments = {'format': 'json', 'data': scenario.payload(ids)} if scenario.payload else {}
+    if scenario.cold_cache:
+        list_cache.clear()
+    if not scenario.writes:
+        response = getattr(client, scenario.method)(scenario.path(ids), **arguments)
+    else:
+        with transaction.atomic():
+            response = getattr(client, scenario.method)(scenario.path(ids), **arguments)
+            transaction.set_rollback(True)
+    if response.status_code >= 400:
+        raise RuntimeError(f'{scenario.name} answered {response.status_code}: {response.content[:500]!r}')
+    return response
+
+
+def run_scenario(client, scenario, ids, iterations=50, warmup=5, profile_iterations=3):
+    """
+    Time the scenario, then run it again counting queries and tracing allocations.
+    The second pass is separate because tracemalloc slows everything it traces.
+    """
+    for _ in range(warmup):
+        send(client, scenario, ids)
+
+    durations = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        response = send(client, scenario, ids)
+        durations.append((time.perf_counter() - started) * 1000)
+
+    queries, peaks = [], []
+    for _ in range(profile_iterations):
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as captured:
+            send(client, scenario, ids)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        queries.append(len(captured.captured_queries))
+
+    return {
+        'iterations': iterations,
+        'latency_ms': {
+            'p50': round(percentile(durations, 0.50), 3),
+            'p90': round(percentile(durations, 0.90), 3),
+            'p99': round(percentile(durations, 0.99), 3),
+            'mean': round(statistics.fmean(durations), 3),
+            'min': round(min(durations), 3),
+            'max': round(max(durations), 3),
+        },
+        'queries': max(queries),
+        'peak_allocated_kib': round(max(peaks) / 1024, 1),
+        'response_bytes': len(response.content),
+    }
+
+
+def run(scenarios, seeded, iterations=50, warmup=5, profile_iterations=3):
+    """Run every scenario against the seeded data, returns {scenario name: figures}"""
+    client = make_client(seeded['user'])
+    return {
+        scenario.name: run_scenario(client, scenario, seeded['ids'], iterations, warmup, profile_iterations)
+        for scenario in scenarios
+    }
@@ -0,0 +1,42 @@
+"""
+The requests the benchmark measures
+"""
+from django.urls import reverse
+
+
+class Scenario:
+    """
+    A request to measure.
+    path and payload are functions of the ids seed() returned, writes are rolled back after each run.
+    With cold_cache the list response cache is emptied before each run, to measure a miss.
+    """
+
+    def __init__(self, name, path, method='get', payload=None, writes=False, cold_cache=False):
+        self.name = name
+        self.path = path
+        self.method = method
+        self.payload = payload
+        self.writes = writes
+        self.cold_cache = cold_cache
+
+
+def estate_payload(ids, assets=100, expenses=50, disputes=5):
+    return {
+        'application': ids['application_without_estate'],
+        'asset_set': [{'section': 'Property', 'title': f'Asset {i}', 'description': f'Asset {i} of estate',
+                       'value': f'{1000 + i}.00'} for i in range(assets)],
+        'expense_set': [{'section': 'Costs', 'title': f'Expense {i}', 'description': f'Expense {i} of estate',
+                         'value': f'{100 + i}.00'} for i in range(expenses)],
+        'dispute_set': [{'description': f'Dispute {i} of estate'} for i in range(disputes)],
+    }
+
+
+SCENARIOS = [
+    Scenario('application-list', lambda ids: reverse('loan:application-list') + '?page_size=50'),
+    Scenario('application-detail', lambda ids: reverse('loan:application-detail', args=[ids['large_application']])),
+    Scenario('estate-list', lambda ids: reverse('loan:estate-list') + '?page_size=50'),
+    Scenario('agency-list', lambda ids: reverse('loan:agency-list') + '?page_size=50'),
+    Scenario('agency-list-uncached', lambda ids: reverse('loan:agency-list') + '?page_size=50', cold_cache=True),
+    Scenario('estate-create', lambda ids: reverse('loan:estate-list'), method='post', payload=estate_payload,
+             writes=True),
+]
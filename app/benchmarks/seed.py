@@ -0,0 +1,108 @@
+"""
+Deterministic benchmark data: agencies with many solicitors, and applications whose estates hold hundreds of
+line items
+"""
+import random
+from datetime import datetime, timezone
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+
+from core.models import (Agency, Solicitor, Application, ApplicationStatus, Estate, Asset, Expense, Dispute,
+                         PortfolioSummary)
+from loan.cache import list_cache
+
+AGENCIES = 20
+SOLICITORS_PER_AGENCY = 25
+APPLICATIONS = 1000
+USERS = 10
+# every LARGE_ESTATE_EVERY-th application has a large estate, the last APPLICATIONS_WITHOUT_ESTATE have none
+LARGE_ESTATE_EVERY = 20
+APPLICATIONS_WITHOUT_ESTATE = 10
+LARGE_ESTATE = {'assets': 300, 'expenses': 200, 'disputes': 5}
+SMALL_ESTATE = {'assets': 8, 'expenses': 5, 'disputes': 1}
+BATCH_SIZE = 2000
+# date_submitted is spread over the two years before this, not before today, so reruns see the same data
+BASE_DATE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def money(rng, low, high):
+    return Decimal(rng.randrange(low * 100, high * 100)) / 100
+
+
+def seed(scale=1, seed=0):
+    """
+    Insert the benchmark data set, scale multiplies the number of agencies and applications.
+    Returns the row counts and the ids the scenarios request.
+    """
+    rng = random.Random(seed)
+    call_command('populate_application_status_id', stdout=StringIO())
+    statuses = list(ApplicationStatus.objects.order_by('id'))
+
+    users = [get_user_model().objects.create_user(email=f'bench{i}@example.com', password='benchpass')
+             for i in range(USERS)]
+    agencies = Agency.objects.bulk_create([
+        Agency(name=f'Agency {i:04d}', house_number=str(i), street='Main Street', town='Cork', county='Cork',
+               eircode=f'T12{i:04d}')
+        for i in range(AGENCIES * scale)
+    ])
+    solicitors = Solicitor.objects.bulk_create([
+        Solicitor(title='Mr', first_name=f'First{i}', last_name=f'Last{i:05d}', email=f'solicitor{i}@example.com',
+                  phone_number=f'021{i:07d}', agency=agency)
+        for agency in agencies for i in range(SOLICITORS_PER_AGENCY)
+    ], batch_size=BATCH_SIZE)
+
+    applications = Application.objects.bulk_create([
+        Application(amount=money(rng, 5000, 500000), term=rng.randint(1, 36), user=rng.choice(users),
+                    application_status=rng.choice(statuses), agency=solicitor.agency, lead_solicitor=solicitor,
+                    created_by=users[0], last_updated_by=users[0])
+        for solicitor in (rng.choice(solicitors) for _ in range(APPLICATIONS * scale))
+    ], batch_size=BATCH_SIZE)
+    # auto_now_add ignores the value given, so the submission dates are set afterwards
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {Application._meta.db_table} SET date_submitted = %s - (id %% 730) * interval '1 day'",
+            [BASE_DATE],
+        )
+
+    with_estate = applications[:-APPLICATIONS_WITHOUT_ESTATE]
+    estates = Estate.objects.bulk_create([Estate(application=application) for application in with_estate],
+                                         batch_size=BATCH_SIZE)
+    assets, expenses, disputes = [], [], []
+    for index, estate in enumerate(estates):
+        size = LARGE_ESTATE if index % LARGE_ESTATE_EVERY == 0 else SMALL_ESTATE
+        assets += [Asset(estate=estate, section='Property', title=f'Asset {i}', description=f'Asset {i} of estate',
+                         value=money(rng, 100, 100000)) for i in range(size['assets'])]
+        expenses += [Expense(estate=estate, section='Costs', title=f'Expense {i}',
+                             description=f'Expense {i} of estate', value=money(rng, 10, 5000))
+                     for i in range(size['expenses'])]
+        disputes += [Dispute(estate=estate, description=f'Dispute {i} of estate') for i in range(size['disputes'])]
+    for model, rows in ((Asset, assets), (Expense, expenses), (Dispute, disputes)):
+        model.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+    # bulk inserts send no signals, so the stored totals and the summary are computed once at the end
+    Estate.objects.rebuild_totals([estate.id for estate in estates])
+    PortfolioSummary.objects.rebuild()
+    list_cache.bump(Agency)
+    list_cache.bump(Solicitor)
+
+    return {
+        'counts': {
+            'agencies': len(agencies),
+            'solicitors': len(solicitors),
+            'applications': len(applications),
+            'estates': len(estates),
+            'assets': len(assets),
+            'expenses': len(expenses),
+            'disputes': len(disputes),
+        },
+        'ids': {
+            'large_application': with_estate[0].id,
+            'large_estate': estates[0].id,
+            'application_without_estate': applications[-1].id,
+        },
+        'user': users[0],
+    }
@@ -0,0 +1,102 @@
+"""
+Tests for the benchmark seeding and runner
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase
+
+from benchmarks import runner, seed
+from benchmarks.management.commands import loadtest
+from benchmarks.scenarios import SCENARIOS
+from core.models import Estate
+
+SMALL_DATA_SET = {
+    'AGENCIES': 2, 'SOLICITORS_PER_AGENCY': 3, 'APPLICATIONS': 12, 'USERS': 2, 'LARGE_ESTATE_EVERY': 5,
+    'APPLICATIONS_WITHOUT_ESTATE': 2, 'LARGE_ESTATE': {'assets': 6, 'expenses': 4, 'disputes': 1},
+}
+
+
+@mock.patch.multiple(seed, **SMALL_DATA_SET)
+class BenchmarkTestCase(TestCase):
+    """Test the benchmark on a small data set"""
+
+    def test_seed_is_consistent(self):
+        """Test the seeded estates have their totals computed and the reported counts"""
+        seeded = seed.seed()
+
+        self.assertEqual(seeded['counts']['applications'], 12)
+        self.assertEqual(seeded['counts']['estates'], 10)
+        large_estate = Estate.objects.get(id=seeded['ids']['large_estate'])
+        self.assertEqual(large_estate.asset_count, 6)
+        self.assertEqual(large_estate.net_value, large_estate.total_assets - large_estate.total_expenses)
+
+    def test_every_scenario_runs(self):
+        """Test every scenario succeeds and reports its figures"""
+        seeded = seed.seed()
+
+        results = runner.run(SCENARIOS, seeded, iterations=3, warmup=1, profile_iterations=1)
+
+        self.assertEqual(set(results), {scenario.name for scenario in SCENARIOS})
+        for name, figures in results.items():
+            self.assertLessEqual(figures['latency_ms']['p50'], figures['latency_ms']['max'])
+            self.assertGreater(figures['peak_allocated_kib'], 0)
+            if name != 'agency-list':
+                self.assertGreater(figures['queries'], 0)
+        # after the warmup the agency list is served from the list response cache
+        self.assertEqual(results['agency-list']['queries'], 0)
+        self.assertFalse(Estate.objects.filter(application_id=seeded['ids']['application_without_estate']).exists())
+
+    def test_percentile(self):
+        """Test percentiles use the nearest rank"""
+        samples = list(range(1, 101))
+        self.assertEqual(runner.percentile(samples, 0.5), 50)
+        self.assertEqual(runner.percentile(samples, 0.99), 99)
+        self.assertEqual(runner.percentile([7], 0.9), 7)
+
+
+class TokenHandler(BaseHTTPRequestHandler):
+    """Answers 200 to requests carrying the test token and 401 to the others, over keep-alive connections"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{}'
+        self.send_response(200 if self.headers.get('Authorization') == 'Token secret' else 401)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LoadTestTestCase(SimpleTestCase):
+    """Test the load test against a local server"""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), TokenHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/api/user/me/'
+
+    def test_successful_requests_give_the_throughput(self):
+        """Test the 200 responses are counted and timed"""
+        result = loadtest.run(self.url, 'secret', concurrency=2, duration=0.3)
+
+        self.assertGreater(result['requests_per_second'], 0)
+        self.assertEqual(result['errors'], 0)
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_failed_requests_are_errors(self):
+        """Test other statuses count as errors and the command fails when none succeeded"""
+        result = loadtest.run(self.url, 'wrong', concurrency=1, duration=0.2)
+
+        self.assertIsNone(result['p50_ms'])
+        self.assertGreater(result['errors'], 0)
+        with self.assertRaises(CommandError):
+            call_command('loadtest', self.url, '--duration', '0.2', stdout=StringIO())
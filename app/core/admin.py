@@ -84,6 +84,7 @@ class DisputeInline(admin.StackedInline):
 class EstateAdmin(admin.ModelAdmin):
     search_fields = ['application__id']
     inlines = (AssetInline, ExpensesInline, DisputeInline)
+    readonly_fields = ('total_assets', 'total_expenses', 'net_value', 'asset_count', 'expense_count', 'dispute_count')
 
 
 admin.site.register(models.User, UserAdmin)
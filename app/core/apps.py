@@ -4,3 +4,19 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.conf import settings
+        from django.core.signals import request_started
+        from django.db.backends.signals import connection_created
+        from auditlog.signals import pre_log
+        from core import audit, db, signals, timing  # noqa: F401
+
+        if getattr(settings, 'AUDITLOG_BUFFERED', False):
+            pre_log.connect(audit.buffer_log_entry, dispatch_uid='core-buffered-audit')
+        if getattr(settings, 'DB_CONN_HEALTH_CHECKS', False):
+            request_started.connect(db.close_unusable_connections, dispatch_uid='core-db-health-checks')
+        # the queries are counted for the metrics whether or not SERVER_TIMING reports them
+        connection_created.connect(timing.install_query_recorder, dispatch_uid='core-timing-queries')
+        if getattr(settings, 'SERVER_TIMING', False):
+            timing.instrument_serializers()
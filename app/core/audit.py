@@ -0,0 +1,145 @@
+"""
+Audit log helpers: batched entries for bulk writes, and a buffered mode for auditlog's entries.
+
+buffered_audit() runs a block in a transaction. The entries of its bulk writes, and with AUDITLOG_BUFFERED those
+auditlog writes for its creations and deletions, are collected in memory and inserted with batched INSERTs at the
+end of the block, inside its transaction. They commit with the writes they describe, or roll back with them.
+Outside it auditlog logs every save on its own.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from auditlog.cid import get_cid
+from auditlog.diff import model_instance_diff
+from auditlog.models import LogEntry
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.db.models.signals import pre_save
+from django.utils.encoding import smart_str
+
+from core import metrics
+
+BULK_BATCH_SIZE = 500
+
+_buffer = ContextVar('audit_buffer', default=None)
+
+
+def build_log_entry(instance, action, changes):
+    """Return an unsaved LogEntry filled in the way LogEntry.objects.log_create() fills it"""
+    pk = instance.pk
+    return LogEntry(
+        content_type=ContentType.objects.get_for_model(instance),
+        object_pk=smart_str(pk),
+        object_id=pk if isinstance(pk, int) else None,
+        object_repr=smart_str(instance),
+        serialized_data=LogEntry.objects._get_serialized_data_or_none(instance),
+        action=action,
+        changes=changes,
+        cid=get_cid(),
+    )
+
+
+def write_log_entries(entries, using=DEFAULT_DB_ALIAS):
+    """Insert log entries in batches, or add them to the active buffer"""
+    batch = _current_batch(using)
+    if batch is not None:
+        batch.add(entries)
+        return entries
+    for entry in entries:
+        # lets auditlog's set_actor() fill in the actor and remote address, as it does for single saves
+        pre_save.send(sender=LogEntry, instance=entry, raw=False, using=using, update_fields=None)
+    entries = LogEntry.objects.using(using).bulk_create(entries, batch_size=BULK_BATCH_SIZE)
+    metrics.audit_entries_written.inc(len(entries))
+    return entries
+
+
+def log_bulk_create(instances):
+    """Write the creation log entries of bulk inserted rows"""
+    return write_log_entries([
+        build_log_entry(instance, LogEntry.Action.CREATE, model_instance_diff(None, instance))
+        for instance in instances
+    ])
+
+
+def log_bulk_update(changes):
+    """Write the update log entries of bulk updated rows, changes holds (old, new) copies of each row"""
+    entries = []
+    for old, new in changes:
+        diff = model_instance_diff(old, new)
+        if diff:
+            entries.append(build_log_entry(new, LogEntry.Action.UPDATE, diff))
+    return write_log_entries(entries)
+
+
+def log_bulk_delete(instances):
+    """Write the deletion log entries of rows about to be bulk deleted"""
+    return write_log_entries([
+        build_log_entry(instance, LogEntry.Action.DELETE, model_instance_diff(instance, None))
+        for instance in instances
+    ])
+
+
+def savepoint_depth(using=DEFAULT_DB_ALIAS):
+    """Return how many savepoints are open, blocks with savepoint=False have none and roll back with their parent"""
+    return sum(1 for sid in transaction.get_connection(using).savepoint_ids if sid is not None)
+
+
+class AuditBatch(list):
+    """Log entries waiting for the end of the transaction of a buffered_audit() block"""
+
+    def __init__(self, using, depth):
+        super().__init__()
+        self.using = using
+        # savepoints open when the block started, the writes of a savepoint opened inside it may be rolled back on
+        # their own, so their entries are not batched
+        self.depth = depth
+
+    def covers(self, using):
+        return using == self.using and savepoint_depth(using) == self.depth
+
+    def add(self, entries):
+        self.extend(entries)
+        metrics.audit_buffered_entries.inc(len(entries))
+
+
+@contextmanager
+def buffered_audit(using=DEFAULT_DB_ALIAS):
+    """Run the block in a transaction and insert the audit entries of its writes in batches just before it ends"""
+    with transaction.atomic(using=using):
+        batch = AuditBatch(using, savepoint_depth(using))
+        token = _buffer.set(batch)
+        try:
+            yield
+        finally:
+            _buffer.reset(token)
+            metrics.audit_buffered_entries.dec(len(batch))
+        # still inside the transaction, the entries commit or roll back with the writes they describe
+        if not transaction.get_rollback(using):
+            write_log_entries(batch, using=using)
+
+
+def _current_batch(using=DEFAULT_DB_ALIAS):
+    batch = _buffer.get()
+    if batch is not None and batch.covers(using):
+        return batch
+    return None
+
+
+def buffer_log_entry(sender, instance, action, **kwargs):
+    """
+    auditlog pre_log receiver adding the creation and deletion entries of a buffered_audit() block to its batch.
+    Returning False stops auditlog inserting the entry itself. Updates are left to auditlog, which diffs them against
+    the row it reads before the save.
+    """
+    batch = _current_batch()
+    if batch is None:
+        return None
+    if action == LogEntry.Action.CREATE:
+        changes = model_instance_diff(None, instance)
+    elif action == LogEntry.Action.DELETE:
+        changes = model_instance_diff(instance, None)
+    else:
+        return None
+    if changes:
+        batch.add([build_log_entry(instance, action, changes)])
+    return False
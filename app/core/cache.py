@@ -0,0 +1,27 @@
+"""
+Checks for the caches whose invalidations have to reach every worker process
+"""
+import os
+
+from django.conf import settings
+
+# backends that keep their entries in the process using them
+LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def worker_processes():
+    """Return how many processes serve requests, gunicorn.conf.py exports its worker count to them"""
+    return int(os.environ.get('GUNICORN_WORKERS', 1))
+
+
+def is_shared(alias):
+    """Return whether the Django cache of the alias is seen by every worker process"""
+    return alias in settings.CACHES and settings.CACHES[alias]['BACKEND'] not in LOCAL_BACKENDS
+
+
+def invalidations_reach_every_worker(alias):
+    """Return whether a cache invalidated through the alias is invalidated in every process serving requests"""
+    return worker_processes() == 1 or (alias is not None and is_shared(alias))
@@ -0,0 +1,96 @@
+"""
+Database connection helpers, bulk loading with Postgres COPY and bulk deletes
+"""
+from itertools import islice
+
+from django.db import connection, connections
+
+# rows formatted at a time by a CopySource, and the bytes COPY asks it for per read
+COPY_CHUNK_ROWS = 1000
+COPY_BUFFER_SIZE = 1 << 20
+
+
+def close_unusable_connections(**kwargs):
+    """
+    Close persistent connections the database dropped while they sat idle between requests,
+    so the request opens a new one instead of failing on its first query.
+    Django 3.2 has no CONN_HEALTH_CHECKS setting, this request_started receiver does the same check.
+    """
+    for conn in connections.all():
+        if conn.connection is not None and not conn.in_atomic_block and not conn.is_usable():
+            conn.close()
+
+
+def copy_value(value):
+    """Format a value for the COPY text format, the value must not hold tabs, newlines or backslashes"""
+    if value is None:
+        return '\\N'
+    if value is True or value is False:
+        return 't' if value else 'f'
+    return str(value)
+
+
+class CopySource:
+    """
+    File-like object that COPY ... FROM STDIN reads rows from.
+    Rows are formatted as they are read, so a generator of millions of rows is never held in memory.
+    """
+
+    def __init__(self, rows):
+        self.lines = ('\t'.join(map(copy_value, row)) + '\n' for row in rows)
+        self.buffer = ''
+        self.rows = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            lines = list(islice(self.lines, COPY_CHUNK_ROWS))
+            if not lines:
+                break
+            self.rows += len(lines)
+            self.buffer += ''.join(lines)
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def copy_rows(model, columns, rows):
+    """Load rows, tuples of the given column values, into the table of model with COPY. Returns the row count."""
+    quote = connection.ops.quote_name
+    source = CopySource(rows)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {quote(model._meta.db_table)} ({', '.join(map(quote, columns))}) FROM STDIN", source,
+            COPY_BUFFER_SIZE)
+    return source.rows
+
+
+def reserve_ids(model, count):
+    """
+    Return the first of count consecutive ids nothing else will use, for rows loaded with their ids set.
+    Must be called in a transaction, the table stays locked against other writers until it ends.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    pk = model._meta.pk.column
+    with connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE')
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [model._meta.db_table, pk])
+        sequence = cursor.fetchone()[0]
+        cursor.execute(f'SELECT GREATEST((SELECT COALESCE(MAX({pk}), 0) FROM {table}), last_value) FROM {sequence}')
+        first = cursor.fetchone()[0] + 1
+        if count:
+            cursor.execute('SELECT setval(%s, %s)', [sequence, first + count - 1])
+    return first
+
+
+def delete_rows(model, ids):
+    """
+    Delete the rows with the given ids in one statement, without QuerySet.delete()'s cascade collection and per row
+    signals. Only for rows no foreign key refers to, the caller applies what the signals would have done.
+    """
+    if not ids:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)} WHERE id = ANY(%s)',
+                       [list(ids)])
+        return cursor.rowcount
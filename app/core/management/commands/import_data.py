@@ -0,0 +1,78 @@
+"""Django command to import applications or estates from a CSV or JSON lines file, in chunks and resumably"""
+import json
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from loan import importer
+
+
+class Command(BaseCommand):
+    help = ('Imports applications or estates from a CSV or JSON lines file, validated by the API serializers and '
+            'bulk inserted a chunk at a time. Invalid records are reported and skipped. With --progress-file the '
+            'number of records committed is kept in the file, and a rerun resumes after them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(importer.IMPORTERS))
+        parser.add_argument('path', help='File to import, .csv or .jsonl')
+        parser.add_argument('--format', choices=(importer.CSV, importer.JSONL),
+                            help='Format of the file, taken from its extension by default')
+        parser.add_argument('--user', help='Email of the user the applications are created by')
+        parser.add_argument('--chunk-size', type=int, default=importer.CHUNK_SIZE)
+        parser.add_argument('--skip', type=int, help='Number of records to skip, by default read from --progress-file')
+        parser.add_argument('--progress-file', help='File keeping the number of records committed so far')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if file_format not in (importer.CSV, importer.JSONL):
+            raise CommandError('Can not tell the format from the file name, use --format')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        user = None
+        if options['user']:
+            user = get_user_model().objects.filter(email=options['user']).first()
+            if user is None:
+                raise CommandError(f'No user with email {options["user"]}')
+
+        skip = options['skip']
+        progress_file = options['progress_file']
+        if skip is None:
+            skip = self.read_progress(progress_file)
+        if skip:
+            self.stdout.write(f'Resuming after {skip} records')
+
+        records_importer = importer.IMPORTERS[options['kind']](user, chunk_size=options['chunk_size'])
+        created = failed = 0
+        with open(options['path'], 'rb') as lines:
+            try:
+                checked = records_importer.check_header(importer.decode_lines(lines), file_format)
+            except ValidationError as exc:
+                raise CommandError(f"Invalid header: {'; '.join(exc.detail['header'])}")
+            records = records_importer.parse(checked, file_format)
+            for report in records_importer.run(records, skip=skip):
+                if 'errors' in report:
+                    self.stderr.write(json.dumps(report))
+                    continue
+                created += report['created']
+                failed += report['failed']
+                if progress_file:
+                    self.write_progress(progress_file, report['committed'])
+                self.stdout.write(f'{report["committed"]} records committed')
+        self.stdout.write(self.style.SUCCESS(f'Imported {created} {options["kind"]}, {failed} records failed'))
+
+    @staticmethod
+    def read_progress(path):
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path) as progress:
+            return int(progress.read().strip() or 0)
+
+    @staticmethod
+    def write_progress(path, committed):
+        # replaced in one step, so a run stopped while writing never leaves a partial number behind
+        with open(f'{path}.tmp', 'w') as progress:
+            progress.write(str(committed))
+        os.replace(f'{path}.tmp', path)
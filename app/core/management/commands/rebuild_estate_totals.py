@@ -0,0 +1,32 @@
+"""Django command to recompute the stored estate totals from the line items"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Estate
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored asset, expense and dispute totals of every estate in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of estates recomputed per transaction')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = 0
+        rebuilt = 0
+
+        while True:
+            estate_ids = list(Estate.objects.filter(id__gt=last_id).order_by('id')
+                              .values_list('id', flat=True)[:chunk_size])
+            if not estate_ids:
+                break
+            with transaction.atomic():
+                Estate.objects.rebuild_totals(estate_ids)
+            last_id = estate_ids[-1]
+            rebuilt += len(estate_ids)
+            self.stdout.write(f'Rebuilt totals for {rebuilt} estates...')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt totals for {rebuilt} estates'))
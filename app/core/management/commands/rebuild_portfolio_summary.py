@@ -0,0 +1,16 @@
+"""Django command to recompute the portfolio summary from the applications and estates"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import PortfolioSummary
+
+
+class Command(BaseCommand):
+    help = 'Replaces the portfolio summary rows with ones recomputed from the applications and estates'
+
+    def handle(self, *args, **options):
+        # one transaction, readers keep seeing the old rows until the new ones are complete
+        with transaction.atomic():
+            rows = PortfolioSummary.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} portfolio summary rows'))
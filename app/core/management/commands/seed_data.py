@@ -0,0 +1,216 @@
+"""Django command to generate synthetic agencies, users, applications and estates quickly, for performance testing"""
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core.db import copy_rows, reserve_ids
+from core.models import (Agency, Solicitor, User, Application, ApplicationStatus, Estate, Asset, Expense, Dispute,
+                         PortfolioSummary)
+from loan.cache import list_cache
+
+# submission dates are spread over the two years before this, not before today, so a seed always gives the same data
+BASE_DATE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+SUBMISSION_SPREAD = int(timedelta(days=730).total_seconds())
+# share of the line items of an estate that are assets, expenses and disputes
+ASSET_SHARE, EXPENSE_SHARE, DISPUTE_SHARE = 0.6, 0.35, 0.05
+# share of the applications that have an estate, and that are assigned to a user
+ESTATE_SHARE = 0.95
+ASSIGNED_SHARE = 0.9
+
+FIRST_NAMES = ('Aoife', 'Ciara', 'Emma', 'Niamh', 'Sarah', 'Conor', 'Darragh', 'Jack', 'Sean', 'Patrick')
+LAST_NAMES = ('Murphy', 'Kelly', "O'Sullivan", 'Walsh', 'Smith', "O'Brien", 'Byrne', 'Ryan', "O'Connor", 'Doyle')
+TITLES = ('Mr', 'Ms', 'Mrs', 'Dr')
+STREETS = ('Main Street', 'Church Street', 'Bridge Street', 'Patrick Street', 'Market Square', 'Mill Road')
+TOWNS = (('Cork', 'Cork'), ('Kinsale', 'Cork'), ('Galway', 'Galway'), ('Limerick', 'Limerick'),
+         ('Dublin', 'Dublin'), ('Tralee', 'Kerry'), ('Ennis', 'Clare'), ('Sligo', 'Sligo'))
+ASSETS = (('Property', 'House'), ('Property', 'Site'), ('Savings', 'Bank account'), ('Savings', 'Credit union'),
+          ('Investments', 'Shares'), ('Vehicles', 'Car'), ('Contents', 'Furniture'), ('Contents', 'Jewellery'))
+EXPENSES = (('Funeral', 'Funeral costs'), ('Legal', 'Solicitor fees'), ('Legal', 'Probate fees'),
+            ('Tax', 'Capital acquisitions tax'), ('Debts', 'Credit card'), ('Debts', 'Mortgage'))
+DISPUTES = ('Will contested by a beneficiary', 'Claim by a creditor', 'Boundary dispute over a site',
+            'Valuation disputed')
+
+USER_COLUMNS = ('id', 'password', 'is_superuser', 'email', 'name', 'is_active', 'is_staff')
+AGENCY_COLUMNS = ('id', 'name', 'house_number', 'street', 'town', 'county', 'eircode')
+SOLICITOR_COLUMNS = ('id', 'title', 'first_name', 'last_name', 'email', 'phone_number', 'agency_id')
+APPLICATION_COLUMNS = ('id', 'amount', 'term', 'user_id', 'application_status_id', 'agency_id', 'created_by_id',
+                       'last_updated_by_id', 'date_submitted', 'lead_solicitor_id')
+ESTATE_COLUMNS = ('id', 'application_id', 'total_assets', 'total_expenses', 'net_value', 'asset_count',
+                  'expense_count', 'dispute_count')
+# nothing refers to the line items, so their ids are left to the table's sequence
+ASSET_COLUMNS = ('section', 'title', 'description', 'value', 'estate_id')
+EXPENSE_COLUMNS = ASSET_COLUMNS
+DISPUTE_COLUMNS = ('description', 'estate_id')
+
+
+def money(cents):
+    sign = '-' if cents < 0 else ''
+    return f'{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}'
+
+
+class EstateItems:
+    """
+    The line items of one estate. Each kind has its own random generator seeded from the estate, so any one of
+    them can be generated again without the others, to compute the estate totals and then to load the rows.
+    """
+
+    def __init__(self, seed, index, mean):
+        self.seed = seed
+        self.index = index
+        self.mean = mean
+
+    def random(self, kind):
+        return random.Random((self.seed * 1_000_003 + self.index) * 4 + kind)
+
+    def count(self, rng, share):
+        return rng.randint(0, round(2 * self.mean * share))
+
+    def assets(self):
+        rng = self.random(0)
+        return [(*rng.choice(ASSETS), rng.randrange(10_000, 50_000_000)) for _ in range(self.count(rng, ASSET_SHARE))]
+
+    def expenses(self):
+        rng = self.random(1)
+        return [(*rng.choice(EXPENSES), rng.randrange(1_000, 2_000_000))
+                for _ in range(self.count(rng, EXPENSE_SHARE))]
+
+    def disputes(self):
+        rng = self.random(2)
+        return [rng.choice(DISPUTES) for _ in range(self.count(rng, DISPUTE_SHARE))]
+
+    def dispute_count(self):
+        return self.count(self.random(2), DISPUTE_SHARE)
+
+
+class Command(BaseCommand):
+    help = ('Generates consistent agencies, solicitors, users, applications, estates and line items, loaded with '
+            'COPY, for performance testing. The same seed gives the same data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the generated data')
+        parser.add_argument('--agencies', type=int, default=200)
+        parser.add_argument('--solicitors-per-agency', type=int, default=20)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--applications', type=int, default=10000)
+        parser.add_argument('--line-items-per-estate', type=int, default=100,
+                            help='Average number of assets, expenses and disputes of an estate')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('seed_data loads rows with COPY, it needs a PostgreSQL database')
+        if min(options['agencies'], options['solicitors_per_agency'], options['users']) < 1:
+            raise CommandError('--agencies, --solicitors-per-agency and --users must be at least 1')
+
+        call_command('populate_application_status_id', stdout=self.stdout)
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        started = time.monotonic()
+        # one transaction: the ids are reserved under table locks, and a failed run leaves nothing behind
+        with transaction.atomic():
+            self.load_people()
+            self.load_applications()
+            self.load_estates()
+            rows = PortfolioSummary.objects.rebuild()
+            self.stdout.write(f'Rebuilt {rows} portfolio summary rows')
+        # COPY sends no signals, cached agency and solicitor lists are dropped by hand
+        list_cache.bump(Agency)
+        list_cache.bump(Solicitor)
+        with connection.cursor() as cursor:
+            for model in (User, Agency, Solicitor, Application, Estate, Asset, Expense, Dispute):
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+        self.stdout.write(self.style.SUCCESS(f'Seeded in {time.monotonic() - started:.1f}s'))
+
+    def load(self, model, columns, rows):
+        started = time.monotonic()
+        count = copy_rows(model, columns, rows)
+        self.stdout.write(f'{model._meta.db_table}: {count} rows in {time.monotonic() - started:.1f}s')
+
+    def load_people(self):
+        rng, options = self.rng, self.options
+        # every user gets the same password, hashing one per user would take longer than the whole load
+        password = make_password('seedpass', salt=f'seed{options["seed"]}')
+        self.first_user = reserve_ids(User, options['users'])
+        self.load(User, USER_COLUMNS, (
+            (self.first_user + i, password, False, f'user{self.first_user + i}@seed.example.com',
+             f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}', True, False)
+            for i in range(options['users'])
+        ))
+
+        agencies = options['agencies']
+        self.first_agency = reserve_ids(Agency, agencies)
+        self.load(Agency, AGENCY_COLUMNS, (
+            (self.first_agency + i, f'{rng.choice(LAST_NAMES)} & {rng.choice(LAST_NAMES)} Solicitors',
+             str(rng.randint(1, 200)), rng.choice(STREETS), *rng.choice(TOWNS),
+             f'{rng.choice("ACDEFHKNPRTVWXY")}{rng.randint(10, 99)} {rng.randrange(16 ** 4):04X}')
+            for i in range(agencies)
+        ))
+
+        per_agency = options['solicitors_per_agency']
+        self.first_solicitor = reserve_ids(Solicitor, agencies * per_agency)
+        self.load(Solicitor, SOLICITOR_COLUMNS, self.solicitor_rows(agencies * per_agency, per_agency))
+
+    def solicitor_rows(self, count, per_agency):
+        rng = self.rng
+        for i in range(count):
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            email = f"{first_name}.{last_name.replace(chr(39), '')}{self.first_solicitor + i}@example.com".lower()
+            yield (self.first_solicitor + i, rng.choice(TITLES), first_name, last_name, email,
+                   f'0{rng.randint(21, 99)} {rng.randint(1000000, 9999999)}', self.first_agency + i // per_agency)
+
+    def load_applications(self):
+        options = self.options
+        self.status_ids = list(ApplicationStatus.objects.order_by('id').values_list('id', flat=True))
+        self.first_application = reserve_ids(Application, options['applications'])
+        # indexes of the applications with an estate, decided while generating the applications
+        self.with_estate = []
+        self.load(Application, APPLICATION_COLUMNS, self.application_rows(options['applications']))
+
+    def application_rows(self, count):
+        rng, options = self.rng, self.options
+        solicitors = options['agencies'] * options['solicitors_per_agency']
+        for i in range(count):
+            solicitor = rng.randrange(solicitors)
+            user = self.first_user + rng.randrange(options['users']) if rng.random() < ASSIGNED_SHARE else None
+            staff = self.first_user + rng.randrange(options['users'])
+            submitted = BASE_DATE - timedelta(seconds=rng.randrange(SUBMISSION_SPREAD))
+            if rng.random() < ESTATE_SHARE:
+                self.with_estate.append(i)
+            yield (self.first_application + i, money(rng.randrange(500_000, 50_000_000)), rng.randint(1, 36), user,
+                   rng.choice(self.status_ids), self.first_agency + solicitor // options['solicitors_per_agency'],
+                   staff, staff, submitted.isoformat(), self.first_solicitor + solicitor)
+
+    def load_estates(self):
+        seed, mean = self.options['seed'], self.options['line_items_per_estate']
+        estates = [EstateItems(seed, index, mean) for index in self.with_estate]
+        self.first_estate = reserve_ids(Estate, len(estates))
+        # the totals are computed from the line items up front, and the items generated again as they are loaded
+        self.load(Estate, ESTATE_COLUMNS, self.estate_rows(estates))
+
+        for model, columns, items in ((Asset, ASSET_COLUMNS, EstateItems.assets),
+                                      (Expense, EXPENSE_COLUMNS, EstateItems.expenses),
+                                      (Dispute, DISPUTE_COLUMNS, EstateItems.disputes)):
+            self.load(model, columns, self.line_item_rows(model, estates, items))
+
+    def estate_rows(self, estates):
+        for number, estate in enumerate(estates):
+            assets, expenses = estate.assets(), estate.expenses()
+            total_assets = sum(value for section, title, value in assets)
+            total_expenses = sum(value for section, title, value in expenses)
+            yield (self.first_estate + number, self.first_application + estate.index, money(total_assets),
+                   money(total_expenses), money(total_assets - total_expenses), len(assets), len(expenses),
+                   estate.dispute_count())
+
+    def line_item_rows(self, model, estates, items):
+        for number, estate in enumerate(estates):
+            estate_id = self.first_estate + number
+            for item in items(estate):
+                if model is Dispute:
+                    yield item, estate_id
+                else:
+                    section, title, value = item
+                    yield section, title, f'{title} of estate {estate_id}', money(value), estate_id
@@ -0,0 +1,79 @@
+"""
+Prometheus metrics of the API, served by the /metrics view
+
+With PROMETHEUS_MULTIPROC_DIR set, as gunicorn.conf.py does for its workers, every process writes its samples to
+files in that directory and /metrics adds up the files of all of them, so counters cover the whole server.
+The view answers the addresses of METRICS ALLOWED_IPS and requests carrying the METRICS TOKEN as a bearer token.
+"""
+import hmac
+import ipaddress
+import os
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY,
+                               generate_latest, multiprocess)
+
+DEFAULT_SETTINGS = {
+    # networks allowed to scrape without a token, the peer address of the connection, X-Forwarded-For is not read
+    'ALLOWED_IPS': ['127.0.0.1/32', '::1/128'],
+    # bearer token allowed to scrape from anywhere, none by default
+    'TOKEN': None,
+}
+
+# request durations in seconds, from a cached read to a slow export
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+request_duration = Histogram(
+    'http_request_duration_seconds', 'Time to serve a request, by route name',
+    ['route', 'method'], buckets=LATENCY_BUCKETS,
+)
+requests = Counter('http_requests', 'Requests served, by route name and status', ['route', 'method', 'status'])
+requests_in_flight = Gauge('http_requests_in_flight', 'Requests being served', multiprocess_mode='livesum')
+db_queries = Counter('db_queries', 'Database queries run by requests, by route name', ['route'])
+db_query_duration = Counter('db_query_duration_seconds', 'Time spent in database queries by requests, by route name',
+                            ['route'])
+token_cache_lookups = Counter('token_auth_cache_lookups', 'Token authentication cache lookups, by result', ['result'])
+list_cache_lookups = Counter('list_response_cache_lookups', 'List response cache lookups, by view and result',
+                             ['view', 'result'])
+fragment_cache_lookups = Counter('fragment_cache_lookups', 'Serialized fragment cache lookups, by kind and result',
+                                 ['kind', 'result'])
+audit_buffered_entries = Gauge('auditlog_buffered_entries',
+                               'Audit log entries waiting to be inserted at the end of their transaction',
+                               multiprocess_mode='livesum')
+audit_entries_written = Counter('auditlog_entries_written', 'Audit log entries inserted in batches')
+
+
+def observe_request(route, method, status, timing):
+    """Record a finished request, timing is its core.timing.RequestTiming"""
+    request_duration.labels(route, method).observe(timing.wall)
+    requests.labels(route, method, str(status)).inc()
+    if timing.queries:
+        db_queries.labels(route).inc(timing.queries)
+        db_query_duration.labels(route).inc(timing.db_time)
+
+
+def scrape_allowed(request):
+    """Return whether the request comes from an allowed address or carries the metrics token"""
+    options = {**DEFAULT_SETTINGS, **getattr(settings, 'METRICS', {})}
+    token = options['TOKEN']
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if token and scheme.lower() == 'bearer' and hmac.compare_digest(credentials.strip().encode(), token.encode()):
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in options['ALLOWED_IPS'])
+
+
+def metrics_view(request):
+    """Serve the metrics of every process in the Prometheus text format"""
+    if not scrape_allowed(request):
+        return HttpResponseForbidden()
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
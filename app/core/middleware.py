@@ -0,0 +1,51 @@
+"""
+Middleware for the API
+"""
+import asyncio
+
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+from core import metrics, timing
+
+
+class ServerTimingMiddleware(MiddlewareMixin):
+    """
+    Time each request into the Prometheus metrics of core.metrics and, while SERVER_TIMING is on, a Server-Timing
+    header and a JSON log line of its wall, database and serializer time.
+    First in MIDDLEWARE, so the time spent in the other middleware is part of the wall time.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.server_timing = getattr(settings, 'SERVER_TIMING', False)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = timing.start()
+        metrics.requests_in_flight.inc()
+        try:
+            return self.report(request, self.get_response(request))
+        finally:
+            metrics.requests_in_flight.dec()
+            timing.stop(token)
+
+    async def __acall__(self, request):
+        token = timing.start()
+        metrics.requests_in_flight.inc()
+        try:
+            return self.report(request, await self.get_response(request))
+        finally:
+            metrics.requests_in_flight.dec()
+            timing.stop(token)
+
+    def report(self, request, response):
+        request_timing = timing.current()
+        request_timing.finish()
+        route = timing.route_name(request)
+        metrics.observe_request(route, request.method, response.status_code, request_timing)
+        if self.server_timing:
+            response['Server-Timing'] = request_timing.server_timing()
+            timing.log_request(request, response, request_timing, route)
+        return response
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:49
+
+from django.db import migrations, models
+
+BACKFILL_TOTALS = """
+UPDATE core_estate SET
+    total_assets = COALESCE((SELECT SUM(value) FROM core_asset WHERE estate_id = core_estate.id), 0),
+    total_expenses = COALESCE((SELECT SUM(value) FROM core_expense WHERE estate_id = core_estate.id), 0),
+    asset_count = (SELECT COUNT(*) FROM core_asset WHERE estate_id = core_estate.id),
+    expense_count = (SELECT COUNT(*) FROM core_expense WHERE estate_id = core_estate.id),
+    dispute_count = (SELECT COUNT(*) FROM core_dispute WHERE estate_id = core_estate.id);
+UPDATE core_estate SET net_value = total_assets - total_expenses;
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_application_last_updated_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estate',
+            name='asset_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='estate',
+            name='dispute_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='estate',
+            name='expense_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='estate',
+            name='net_value',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='estate',
+            name='total_assets',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='estate',
+            name='total_expenses',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.RunSQL(BACKFILL_TOTALS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_estate_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['application_status', '-date_submitted'], name='application_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['user', 'application_status'], name='application_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['agency', '-date_submitted'], name='application_agency_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['lead_solicitor', '-date_submitted'], name='application_solicitor_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['created_by', '-date_submitted'], name='application_creator_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['-date_submitted'], name='application_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['amount'], name='application_amount_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:53
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+LINE_ITEM_TABLES = {
+    'core_asset': 'title, description',
+    'core_expense': 'title, description',
+    'core_dispute': 'description',
+}
+
+CREATE_TRIGGERS = ''.join(
+    f"""
+    CREATE TRIGGER {table}_search_vector_update BEFORE INSERT OR UPDATE ON {table}
+        FOR EACH ROW EXECUTE FUNCTION tsvector_update_trigger(search_vector, 'pg_catalog.english', {columns});
+    UPDATE {table} SET search_vector = NULL;
+    """
+    for table, columns in LINE_ITEM_TABLES.items()
+)
+
+DROP_TRIGGERS = ''.join(
+    f"DROP TRIGGER IF EXISTS {table}_search_vector_update ON {table};" for table in LINE_ITEM_TABLES
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_application_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asset',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='dispute',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # the trigger fills search_vector on every write, the UPDATE backfills existing rows
+        migrations.RunSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+        migrations.AddIndex(
+            model_name='asset',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='asset_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dispute',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='dispute_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='expense_search_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:02
+
+from django.db import migrations, models
+
+BACKFILL_SUMMARY = """
+INSERT INTO core_portfoliosummary (status_key, agency_key, user_key, month,
+                                   application_count, total_amount, total_term, total_estate_value)
+SELECT COALESCE(a.application_status_id, -1), COALESCE(a.agency_id, -1), COALESCE(a.user_id, -1),
+       date_trunc('month', a.date_submitted AT TIME ZONE 'UTC')::date,
+       COUNT(*), SUM(a.amount), SUM(a.term), COALESCE(SUM(estates.value), 0)
+FROM core_application a
+LEFT JOIN (SELECT application_id, SUM(net_value) AS value FROM core_estate GROUP BY application_id) estates
+    ON estates.application_id = a.id
+GROUP BY 1, 2, 3, 4;
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_line_item_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status_key', models.BigIntegerField()),
+                ('agency_key', models.BigIntegerField()),
+                ('user_key', models.BigIntegerField()),
+                ('month', models.DateField()),
+                ('application_count', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('total_term', models.BigIntegerField(default=0)),
+                ('total_estate_value', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='portfoliosummary',
+            constraint=models.UniqueConstraint(fields=('status_key', 'agency_key', 'user_key', 'month'), name='portfolio_summary_key'),
+        ),
+        migrations.RunSQL(BACKFILL_SUMMARY, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:50
+
+from django.db import migrations
+
+# the estates of an application after its first one are merged into the first: their line items move over and
+# their stored totals are added to its totals, so the estate value of the application does not change
+MERGE_DUPLICATE_ESTATES = """
+CREATE TEMPORARY TABLE estate_merge ON COMMIT DROP AS
+SELECT e.id AS duplicate_id, kept.id AS kept_id
+FROM core_estate e
+JOIN (SELECT application_id, MIN(id) AS id FROM core_estate
+      WHERE application_id IS NOT NULL GROUP BY application_id HAVING COUNT(*) > 1) kept
+    ON kept.application_id = e.application_id AND e.id <> kept.id;
+
+UPDATE core_asset SET estate_id = m.kept_id FROM estate_merge m WHERE core_asset.estate_id = m.duplicate_id;
+UPDATE core_expense SET estate_id = m.kept_id FROM estate_merge m WHERE core_expense.estate_id = m.duplicate_id;
+UPDATE core_dispute SET estate_id = m.kept_id FROM estate_merge m WHERE core_dispute.estate_id = m.duplicate_id;
+
+UPDATE core_estate SET total_assets = core_estate.total_assets + d.total_assets,
+                       total_expenses = core_estate.total_expenses + d.total_expenses,
+                       net_value = core_estate.net_value + d.net_value,
+                       asset_count = core_estate.asset_count + d.asset_count,
+                       expense_count = core_estate.expense_count + d.expense_count,
+                       dispute_count = core_estate.dispute_count + d.dispute_count
+FROM (SELECT m.kept_id, SUM(e.total_assets) AS total_assets, SUM(e.total_expenses) AS total_expenses,
+             SUM(e.net_value) AS net_value, SUM(e.asset_count) AS asset_count,
+             SUM(e.expense_count) AS expense_count, SUM(e.dispute_count) AS dispute_count
+      FROM estate_merge m JOIN core_estate e ON e.id = m.duplicate_id
+      GROUP BY m.kept_id) d
+WHERE core_estate.id = d.kept_id;
+
+DELETE FROM core_estate USING estate_merge m WHERE core_estate.id = m.duplicate_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_portfolio_summary'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_DUPLICATE_ESTATES, migrations.RunSQL.noop),
+    ]
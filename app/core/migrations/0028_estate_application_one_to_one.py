@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_merge_duplicate_estates'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='estate',
+            name='application',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.application'),
+        ),
+    ]
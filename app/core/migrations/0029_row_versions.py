@@ -0,0 +1,92 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:06
+
+from django.db import migrations, models
+
+LINE_ITEM_TABLES = ('core_asset', 'core_expense', 'core_dispute')
+
+# an update of an application or an estate row bumps its version, whatever the statement sets it to; the column
+# default is kept in the database too, for rows loaded with COPY or raw SQL that do not list it
+CREATE_ROW_TRIGGERS = """
+ALTER TABLE core_application ALTER COLUMN version SET DEFAULT 0;
+ALTER TABLE core_estate ALTER COLUMN version SET DEFAULT 0;
+
+CREATE FUNCTION core_bump_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_application_version BEFORE UPDATE ON core_application
+    FOR EACH ROW EXECUTE FUNCTION core_bump_version();
+CREATE TRIGGER core_estate_version BEFORE UPDATE ON core_estate
+    FOR EACH ROW EXECUTE FUNCTION core_bump_version();
+"""
+
+DROP_ROW_TRIGGERS = """
+DROP TRIGGER IF EXISTS core_application_version ON core_application;
+DROP TRIGGER IF EXISTS core_estate_version ON core_estate;
+DROP FUNCTION IF EXISTS core_bump_version();
+ALTER TABLE core_application ALTER COLUMN version DROP DEFAULT;
+ALTER TABLE core_estate ALTER COLUMN version DROP DEFAULT;
+"""
+
+# a write to line items touches their estates once per statement, so a bulk insert of thousands of items costs one
+# UPDATE; transition tables can only be declared for a single event, hence a trigger per event
+CREATE_LINE_ITEM_TRIGGERS = """
+CREATE FUNCTION core_bump_estate_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE core_estate SET version = version + 1 WHERE id IN (SELECT estate_id FROM new_rows);
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE core_estate SET version = version + 1
+        WHERE id IN (SELECT estate_id FROM new_rows UNION SELECT estate_id FROM old_rows);
+    ELSE
+        UPDATE core_estate SET version = version + 1 WHERE id IN (SELECT estate_id FROM old_rows);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+""" + ''.join(
+    f"""
+    CREATE TRIGGER {table}_estate_version_insert AFTER INSERT ON {table}
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION core_bump_estate_version();
+    CREATE TRIGGER {table}_estate_version_update AFTER UPDATE ON {table}
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION core_bump_estate_version();
+    CREATE TRIGGER {table}_estate_version_delete AFTER DELETE ON {table}
+        REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION core_bump_estate_version();
+    """
+    for table in LINE_ITEM_TABLES
+)
+
+DROP_LINE_ITEM_TRIGGERS = ''.join(
+    f"""
+    DROP TRIGGER IF EXISTS {table}_estate_version_insert ON {table};
+    DROP TRIGGER IF EXISTS {table}_estate_version_update ON {table};
+    DROP TRIGGER IF EXISTS {table}_estate_version_delete ON {table};
+    """
+    for table in LINE_ITEM_TABLES
+) + "DROP FUNCTION IF EXISTS core_bump_estate_version();"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_estate_application_one_to_one'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='application',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='estate',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(CREATE_ROW_TRIGGERS, DROP_ROW_TRIGGERS),
+        migrations.RunSQL(CREATE_LINE_ITEM_TRIGGERS, DROP_LINE_ITEM_TRIGGERS),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 3.2.25 on 2026-10-18 03:10
+
+from django.db import migrations, models
+
+# the rollups, one scan of the applications grouped by status, agency and user each with the month
+BACKFILL_ROLLUPS = """
+INSERT INTO core_portfoliosummary (dimension, key, month,
+                                   application_count, total_amount, total_term, total_estate_value)
+SELECT CASE WHEN GROUPING(application_status_key) = 0 THEN 'application_status'
+            WHEN GROUPING(agency_key) = 0 THEN 'agency'
+            WHEN GROUPING(user_key) = 0 THEN 'user' END,
+       COALESCE(application_status_key, agency_key, user_key), month,
+       COUNT(*), SUM(amount), SUM(term), SUM(estate_value)
+FROM (SELECT COALESCE(a.application_status_id, -1) AS application_status_key,
+             COALESCE(a.agency_id, -1) AS agency_key, COALESCE(a.user_id, -1) AS user_key,
+             date_trunc('month', a.date_submitted AT TIME ZONE 'UTC')::date AS month,
+             a.amount, a.term, COALESCE(e.net_value, 0) AS estate_value
+      FROM core_application a LEFT JOIN core_estate e ON e.application_id = a.id) applications
+GROUP BY GROUPING SETS ((application_status_key, month), (agency_key, month), (user_key, month));
+"""
+
+# the cube of migration 0026, for going back
+BACKFILL_CUBE = """
+INSERT INTO core_portfoliosummary (status_key, agency_key, user_key, month,
+                                   application_count, total_amount, total_term, total_estate_value)
+SELECT COALESCE(a.application_status_id, -1), COALESCE(a.agency_id, -1), COALESCE(a.user_id, -1),
+       date_trunc('month', a.date_submitted AT TIME ZONE 'UTC')::date,
+       COUNT(*), SUM(a.amount), SUM(a.term), COALESCE(SUM(e.net_value), 0)
+FROM core_application a LEFT JOIN core_estate e ON e.application_id = a.id
+GROUP BY 1, 2, 3, 4;
+"""
+
+CLEAR_SUMMARY = "DELETE FROM core_portfoliosummary;"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_row_versions'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='portfoliosummary',
+            name='portfolio_summary_key',
+        ),
+        migrations.RunSQL(CLEAR_SUMMARY, BACKFILL_CUBE),
+        migrations.RemoveField(
+            model_name='portfoliosummary',
+            name='status_key',
+        ),
+        migrations.RemoveField(
+            model_name='portfoliosummary',
+            name='agency_key',
+        ),
+        migrations.RemoveField(
+            model_name='portfoliosummary',
+            name='user_key',
+        ),
+        migrations.AddField(
+            model_name='portfoliosummary',
+            name='dimension',
+            field=models.CharField(choices=[('application_status', 'application_status'), ('agency', 'agency'), ('user', 'user')], max_length=20),
+        ),
+        migrations.AddField(
+            model_name='portfoliosummary',
+            name='key',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AddConstraint(
+            model_name='portfoliosummary',
+            constraint=models.UniqueConstraint(fields=('dimension', 'key', 'month'), name='portfolio_summary_rollup_key'),
+        ),
+        migrations.RunSQL(BACKFILL_ROLLUPS, CLEAR_SUMMARY),
+    ]
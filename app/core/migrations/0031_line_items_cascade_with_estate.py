@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:35
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_portfolio_summary_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='asset',
+            name='estate',
+            field=models.ForeignKey(blank=True, null=True, on_delete=core.models.cascade_with_estate, to='core.estate'),
+        ),
+        migrations.AlterField(
+            model_name='dispute',
+            name='estate',
+            field=models.ForeignKey(blank=True, null=True, on_delete=core.models.cascade_with_estate, to='core.estate'),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='estate',
+            field=models.ForeignKey(blank=True, null=True, on_delete=core.models.cascade_with_estate, to='core.estate'),
+        ),
+    ]
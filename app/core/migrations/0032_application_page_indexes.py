@@ -0,0 +1,101 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# the indexes django gave the foreign keys, each now leads an index of Meta.indexes
+FK_INDEXES = {
+    'agency_id': 'core_application_agency_id_8b87213b',
+    'application_status_id': 'core_application_application_status_id_a762bf37',
+    'created_by_id': 'core_application_created_by_id_a6e2b36a',
+    'lead_solicitor_id': 'core_application_lead_solicitor_id_03b469f0',
+    'user_id': 'core_application_user_id_caec82ae',
+}
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_line_items_cascade_with_estate'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='application',
+            name='application_status_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='application',
+            name='application_user_status_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='application',
+            name='application_agency_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='application',
+            name='application_solicitor_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='application',
+            name='application_creator_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['application_status', '-id'], name='application_status_page_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['user', 'application_status', '-id'], name='application_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['agency', '-id'], name='application_agency_page_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['lead_solicitor', '-id'], name='application_solicitor_page_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['created_by', '-id'], name='application_creator_page_idx'),
+        ),
+        # their own indexes are dropped without touching the foreign key constraints, which an AlterField would
+        # drop and validate again against the whole table
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(f'DROP INDEX IF EXISTS "{name}"',
+                                  f'CREATE INDEX "{name}" ON "core_application" ("{column}")')
+                for column, name in FK_INDEXES.items()
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='application',
+                    name='agency',
+                    field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='core.agency'),
+                ),
+                migrations.AlterField(
+                    model_name='application',
+                    name='application_status',
+                    field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='core.applicationstatus'),
+                ),
+                migrations.AlterField(
+                    model_name='application',
+                    name='created_by',
+                    field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='created_applications_set', to=settings.AUTH_USER_MODEL),
+                ),
+                migrations.AlterField(
+                    model_name='application',
+                    name='lead_solicitor',
+                    field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='core.solicitor'),
+                ),
+                migrations.AlterField(
+                    model_name='application',
+                    name='user',
+                    field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='assigned_applications_set', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+    ]
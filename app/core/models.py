@@ -1,9 +1,11 @@
 """
 Database models
 """
-from datetime import datetime
+from datetime import datetime, timezone as dt_timezone
 
-from django.db import models
+from django.db import models, connection
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
@@ -15,7 +17,8 @@ from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 from auditlog.registry import auditlog
-from django.db.models import ForeignKey
+from django.db.models import ForeignKey, F, OuterRef, Subquery, Sum, Count, Value, DecimalField
+from django.db.models.functions import Coalesce
 
 
 # region <Creating custom user model in django with extra fields name and team>
@@ -66,6 +69,27 @@ class User(AbstractBaseUser, PermissionsMixin):
 
 # region < models>
 
+class LoadedValuesMixin:
+    """
+    Remembers the values of tracked_fields a row was loaded or last saved with,
+    so the handlers in core.signals can apply the difference a save makes.
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_loaded_values()
+        return instance
+
+    def remember_loaded_values(self):
+        # a row loaded with deferred tracked fields is treated like one that was never loaded
+        if all(name in self.__dict__ for name in self.tracked_fields):
+            self.loaded_values = {name: self.__dict__[name] for name in self.tracked_fields}
+        else:
+            self.__dict__.pop('loaded_values', None)
+
+
 class Agency(models.Model):
     """Agency model"""
     name = models.CharField(max_length=255)
@@ -100,53 +124,350 @@ class ApplicationStatus(models.Model):
         return f"{self.pk}: {self.name}"
 
 
-class Application(models.Model):
+class Application(LoadedValuesMixin, models.Model):
     """Application model"""
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     term = models.IntegerField(validators=[MinValueValidator(1), MaxValueValidator(36)])
+    # the foreign keys leading an index in Meta.indexes get no index of their own
     user = ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, null=True, blank=True,
-                      related_name='assigned_applications_set')
-    application_status = ForeignKey(ApplicationStatus, on_delete=models.PROTECT, null=True, blank=True)
-    agency = ForeignKey(Agency, on_delete=models.PROTECT, null=True, blank=True)
+                      related_name='assigned_applications_set', db_index=False)
+    application_status = ForeignKey(ApplicationStatus, on_delete=models.PROTECT, null=True, blank=True,
+                                    db_index=False)
+    agency = ForeignKey(Agency, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
     created_by = ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, null=True, blank=True,
-                            related_name='created_applications_set')
+                            related_name='created_applications_set', db_index=False)
     last_updated_by = ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, null=True, blank=True,
                                  related_name='updated_applications_set')
     date_submitted = models.DateTimeField(auto_now_add=True)
-    lead_solicitor = ForeignKey(Solicitor, on_delete=models.PROTECT, null=True, blank=True)
+    lead_solicitor = ForeignKey(Solicitor, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
+    # bumped by a database trigger on every update, see migration 0029, it keys the cached representation
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        # match the filter combinations of the application list
+        indexes = [
+            # the list pages on -id, these answer a filter on the leading columns in page order
+            models.Index(fields=['application_status', '-id'], name='application_status_page_idx'),
+            models.Index(fields=['user', 'application_status', '-id'], name='application_user_status_idx'),
+            models.Index(fields=['agency', '-id'], name='application_agency_page_idx'),
+            models.Index(fields=['lead_solicitor', '-id'], name='application_solicitor_page_idx'),
+            models.Index(fields=['created_by', '-id'], name='application_creator_page_idx'),
+            models.Index(fields=['-date_submitted'], name='application_date_idx'),
+            models.Index(fields=['amount'], name='application_amount_idx'),
+        ]
+
+    tracked_fields = ('application_status_id', 'agency_id', 'user_id', 'date_submitted', 'amount', 'term')
 
     def __str__(self):
         return f"ID: {self.pk}"
 
 
-class Estate(models.Model):
+class EstateManager(models.Manager):
+    """Manager for estates, keeps the stored line item totals in step"""
+
+    def add_to_totals(self, estate_id, assets=0, expenses=0, asset_count=0, expense_count=0, dispute_count=0):
+        """Move the stored totals of an estate by the given amounts in a single UPDATE"""
+        if estate_id is None:
+            return
+        updates = {}
+        if assets:
+            updates['total_assets'] = F('total_assets') + assets
+        if expenses:
+            updates['total_expenses'] = F('total_expenses') + expenses
+        if assets or expenses:
+            updates['net_value'] = F('net_value') + assets - expenses
+        if asset_count:
+            updates['asset_count'] = F('asset_count') + asset_count
+        if expense_count:
+            updates['expense_count'] = F('expense_count') + expense_count
+        if dispute_count:
+            updates['dispute_count'] = F('dispute_count') + dispute_count
+        if updates:
+            self.filter(pk=estate_id).update(**updates)
+        if assets != expenses:
+            PortfolioSummary.objects.add_estate_value(estate_id, assets - expenses)
+
+    def rebuild_totals(self, estate_ids):
+        """Recompute the stored totals of the given estates from their line items"""
+
+        def aggregate(model, function):
+            rows = model.objects.filter(estate=OuterRef('pk')).order_by().values('estate')
+            return Subquery(rows.annotate(result=function).values('result'))
+
+        zero = Value(0, output_field=DecimalField(max_digits=14, decimal_places=2))
+        total_assets = Coalesce(aggregate(Asset, Sum('value')), zero)
+        total_expenses = Coalesce(aggregate(Expense, Sum('value')), zero)
+        estates = self.filter(pk__in=estate_ids)
+        old_net_values = dict(estates.values_list('id', 'net_value'))
+        rebuilt = estates.update(
+            total_assets=total_assets,
+            total_expenses=total_expenses,
+            net_value=total_assets - total_expenses,
+            asset_count=Coalesce(aggregate(Asset, Count('id')), 0),
+            expense_count=Coalesce(aggregate(Expense, Count('id')), 0),
+            dispute_count=Coalesce(aggregate(Dispute, Count('id')), 0),
+        )
+        for estate_id, net_value in estates.values_list('id', 'net_value'):
+            if net_value != old_net_values[estate_id]:
+                PortfolioSummary.objects.add_estate_value(estate_id, net_value - old_net_values[estate_id])
+        return rebuilt
+
+
+class Estate(LoadedValuesMixin, models.Model):
     """Estate model"""
-    application = ForeignKey(Application, on_delete=models.CASCADE, null=True, blank=True)
+    application = models.OneToOneField(Application, on_delete=models.CASCADE, null=True, blank=True)
+    # totals of the line items, maintained by core.signals
+    total_assets = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_expenses = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    net_value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    asset_count = models.PositiveIntegerField(default=0)
+    expense_count = models.PositiveIntegerField(default=0)
+    dispute_count = models.PositiveIntegerField(default=0)
+    # bumped by database triggers on every update of the estate and every write to its line items, see migration 0029
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = EstateManager()
+
+    tracked_fields = ('application_id', 'net_value')
+    totals_fields = ('total_assets', 'total_expenses', 'net_value', 'asset_count', 'expense_count', 'dispute_count')
 
     def __str__(self):
         return f"{self.id}"
 
-
-class Asset(models.Model):
+    def save(self, *args, **kwargs):
+        # the stored totals are moved in the database by EstateManager, an update must not write back stale copies
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [field.attname for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.totals_fields]
+        super().save(*args, **kwargs)
+
+    def count_line_items(self, assets=(), expenses=(), disputes=()):
+        """Add line items that are inserted without signals to the in-memory totals"""
+        assets_value = sum((asset.value for asset in assets), 0)
+        expenses_value = sum((expense.value for expense in expenses), 0)
+        self.total_assets += assets_value
+        self.total_expenses += expenses_value
+        self.net_value += assets_value - expenses_value
+        self.asset_count += len(assets)
+        self.expense_count += len(expenses)
+        self.dispute_count += len(disputes)
+
+
+def cascade_with_estate(collector, field, sub_objs, using):
+    """
+    CASCADE for the line items of a deleted estate, marking them so core.signals does not move the totals of an
+    estate that is going away one line item at a time
+    """
+    models.CASCADE(collector, field, sub_objs, using)
+    # the line items have delete receivers, so the collector has fetched them and sends post_delete to these instances
+    for item in sub_objs:
+        item.deleted_with_estate = True
+
+
+class Asset(LoadedValuesMixin, models.Model):
     """Asset model"""
     section = models.CharField(max_length=255, null=True, blank=True, default=None)
     title = models.CharField(max_length=255, null=True, blank=True, default=None)
     description = models.TextField()
     value = models.DecimalField(max_digits=10, decimal_places=2)
-    estate = ForeignKey(Estate, on_delete=models.CASCADE, null=True, blank=True)
+    estate = ForeignKey(Estate, on_delete=cascade_with_estate, null=True, blank=True)
+    # kept current by a database trigger, see migration 0025
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    tracked_fields = ('estate_id', 'value')
 
+    class Meta:
+        indexes = [GinIndex(fields=['search_vector'], name='asset_search_idx')]
 
-class Expense(models.Model):
+
+class Expense(LoadedValuesMixin, models.Model):
     section = models.CharField(max_length=255, null=True, blank=True, default=None)
     title = models.CharField(max_length=255, null=True, blank=True, default=None)
     description = models.TextField()
     value = models.DecimalField(max_digits=10, decimal_places=2)
-    estate = ForeignKey(Estate, on_delete=models.CASCADE, null=True, blank=True)
+    estate = ForeignKey(Estate, on_delete=cascade_with_estate, null=True, blank=True)
+    # kept current by a database trigger, see migration 0025
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    tracked_fields = ('estate_id', 'value')
+
+    class Meta:
+        indexes = [GinIndex(fields=['search_vector'], name='expense_search_idx')]
 
 
-class Dispute(models.Model):
+class Dispute(LoadedValuesMixin, models.Model):
     description = models.TextField()
-    estate = ForeignKey(Estate, on_delete=models.CASCADE, null=True, blank=True)
+    estate = ForeignKey(Estate, on_delete=cascade_with_estate, null=True, blank=True)
+    # kept current by a database trigger, see migration 0025
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    tracked_fields = ('estate_id',)
+
+    class Meta:
+        indexes = [GinIndex(fields=['search_vector'], name='dispute_search_idx')]
+
+
+def portfolio_keys(application_status_id, agency_id, user_id, date_submitted):
+    """Return the (status, agency, user, month) key of an application with the given values"""
+    month = date_submitted.astimezone(dt_timezone.utc).date().replace(day=1)
+    return (
+        PortfolioSummary.NONE_KEY if application_status_id is None else application_status_id,
+        PortfolioSummary.NONE_KEY if agency_id is None else agency_id,
+        PortfolioSummary.NONE_KEY if user_id is None else user_id,
+        month,
+    )
+
+
+def rollup_keys(keys):
+    """Return the (dimension, key, month) of each PortfolioSummary row an application with the given key counts in"""
+    *dimension_keys, month = keys
+    return [(dimension, key, month) for dimension, key in zip(PortfolioSummary.DIMENSIONS, dimension_keys)]
+
+
+class PortfolioSummaryManager(models.Manager):
+    """
+    Manager for the portfolio summary, moves the rows by the changes core.signals reports.
+    Changes are given per application key, see portfolio_keys(), and applied to the row of every rollup.
+    Writes are single statements on the unique key so concurrent requests add up instead of overwriting each other.
+    """
+
+    # the application column keying each rollup, in the order of PortfolioSummary.DIMENSIONS
+    COLUMNS = {'application_status': 'application_status_id', 'agency': 'agency_id', 'user': 'user_id'}
+    # the month of the application aliased "a"
+    MONTH_SQL = "date_trunc('month', a.date_submitted AT TIME ZONE 'UTC')::date"
+
+    def add(self, keys, count=0, amount=0, term=0, estate_value=0):
+        """Move the rows of the given application key by the given amounts, creating them when missing"""
+        self.add_many({keys: (count, amount, term, estate_value)})
+
+    def add_many(self, changes):
+        """Move the rows of several application keys in one statement, changes maps each key to its amounts"""
+        rows = {}
+        for keys, amounts in changes.items():
+            for row in rollup_keys(keys):
+                # applications of different keys share the rows of their common status, agency or user
+                # and ON CONFLICT can not update a row twice in a statement, so they are added up first
+                rows[row] = tuple(map(sum, zip(rows[row], amounts))) if row in rows else amounts
+        if not rows:
+            return
+        table = self.model._meta.db_table
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(rows))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (dimension, key, month,"
+                f" application_count, total_amount, total_term, total_estate_value)"
+                f" VALUES {values}"
+                f" ON CONFLICT (dimension, key, month) DO UPDATE SET"
+                f" application_count = {table}.application_count + EXCLUDED.application_count,"
+                f" total_amount = {table}.total_amount + EXCLUDED.total_amount,"
+                f" total_term = {table}.total_term + EXCLUDED.total_term,"
+                f" total_estate_value = {table}.total_estate_value + EXCLUDED.total_estate_value",
+                [value for row, amounts in rows.items() for value in (*row, *amounts)],
+            )
+
+    def add_estate_value(self, estate_id, value):
+        """Move the estate value of the rows holding the estate's application"""
+        if estate_id is None or not value:
+            return
+        self._move_estate_value(estate_id, '%s', [value])
+
+    def remove_estate_value(self, estate_id):
+        """Take the stored net value of an estate out of the rows holding its application"""
+        self._move_estate_value(estate_id, '-e.net_value', [])
+
+    def _move_estate_value(self, estate_id, value_sql, params):
+        rows = " OR ".join(f"(s.dimension = '{dimension}' AND s.key = COALESCE(a.{column}, -1))"
+                           for dimension, column in self.COLUMNS.items())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {self.model._meta.db_table} s SET total_estate_value = s.total_estate_value + {value_sql}"
+                f" FROM {Estate._meta.db_table} e JOIN {Application._meta.db_table} a ON a.id = e.application_id"
+                f" WHERE e.id = %s AND s.month = {self.MONTH_SQL} AND ({rows})",
+                [*params, estate_id],
+            )
+
+    def refresh(self, keys):
+        """Recompute the rows of the given application key from the applications and estates they cover"""
+        month = keys[-1]
+        month_start = datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+        month_end = datetime(month.year + month.month // 12, month.month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+        selects, params = [], []
+        for dimension, key in zip(self.model.DIMENSIONS, keys):
+            column = self.COLUMNS[dimension]
+            condition = f'a.{column} IS NULL' if key == self.model.NONE_KEY else f'a.{column} = %s'
+            selects.append(
+                f"SELECT %s, %s, %s, COUNT(*), COALESCE(SUM(a.amount), 0), COALESCE(SUM(a.term), 0),"
+                f" COALESCE(SUM(e.net_value), 0)"
+                f" FROM {Application._meta.db_table} a LEFT JOIN {Estate._meta.db_table} e ON e.application_id = a.id"
+                f" WHERE a.date_submitted >= %s AND a.date_submitted < %s AND {condition}"
+            )
+            params += [dimension, key, month, month_start, month_end]
+            if key != self.model.NONE_KEY:
+                params.append(key)
+
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (dimension, key, month,"
+                f" application_count, total_amount, total_term, total_estate_value)"
+                f" {' UNION ALL '.join(selects)}"
+                f" ON CONFLICT (dimension, key, month) DO UPDATE SET"
+                f" application_count = EXCLUDED.application_count, total_amount = EXCLUDED.total_amount,"
+                f" total_term = EXCLUDED.total_term, total_estate_value = EXCLUDED.total_estate_value",
+                params,
+            )
+
+    def rebuild(self):
+        """Replace every row with one recomputed from the applications and estates, returns the row count"""
+        table = self.model._meta.db_table
+        keys = {f'{dimension}_key': f'COALESCE(a.{column}, -1)' for dimension, column in self.COLUMNS.items()}
+        # every rollup from one scan of the applications, a key is null in the grouping sets of the other rollups
+        dimension = " ".join(f"WHEN GROUPING({key}) = 0 THEN '{dimension}'"
+                             for dimension, key in zip(self.model.DIMENSIONS, keys))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(
+                f"INSERT INTO {table} (dimension, key, month,"
+                f" application_count, total_amount, total_term, total_estate_value)"
+                f" SELECT CASE {dimension} END, COALESCE({', '.join(keys)}), month,"
+                f" COUNT(*), SUM(amount), SUM(term), SUM(estate_value)"
+                f" FROM (SELECT {', '.join(f'{sql} AS {key}' for key, sql in keys.items())},"
+                f" {self.MONTH_SQL} AS month, a.amount, a.term, COALESCE(e.net_value, 0) AS estate_value"
+                f" FROM {Application._meta.db_table} a"
+                f" LEFT JOIN {Estate._meta.db_table} e ON e.application_id = a.id) applications"
+                f" GROUP BY GROUPING SETS ({', '.join(f'({key}, month)' for key in keys)})"
+            )
+            return cursor.rowcount
+
+
+class PortfolioSummary(models.Model):
+    """
+    Application count, amount, term and estate value totals per month submitted and status, agency or assigned user.
+    Every application is counted in one row of each rollup, the dimension column tells them apart. The full cross
+    product of the dimensions would hold about a row per application and save nothing over reading them.
+    Maintained by core.signals and rebuilt by the rebuild_portfolio_summary command.
+    Keys are plain ids rather than foreign keys so a missing status, agency or user can be stored as NONE_KEY.
+    """
+    NONE_KEY = -1
+    DIMENSIONS = ('application_status', 'agency', 'user')
+
+    dimension = models.CharField(max_length=20, choices=[(dimension, dimension) for dimension in DIMENSIONS])
+    key = models.BigIntegerField()
+    month = models.DateField()
+    application_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    total_term = models.BigIntegerField(default=0)
+    total_estate_value = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+
+    objects = PortfolioSummaryManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'key', 'month'], name='portfolio_summary_rollup_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} {self.dimension} {self.key}"
 
 
 # endregion
@@ -155,7 +476,7 @@ auditlog.register(User)
 auditlog.register(Team)
 auditlog.register(Solicitor)
 auditlog.register(Agency)
-auditlog.register(Asset)
-auditlog.register(Expense)
-auditlog.register(Dispute)
+auditlog.register(Asset, exclude_fields=['search_vector'])
+auditlog.register(Expense, exclude_fields=['search_vector'])
+auditlog.register(Dispute, exclude_fields=['search_vector'])
 auditlog.register(Estate)
@@ -0,0 +1,162 @@
+"""
+Query budgets: the most queries a request may run, as a fixed part plus a part per row it returns
+
+A budget failure lists the queries run, grouped by the stack of project code that ran them, so an N+1 shows up as
+one call site with a count in the hundreds.
+"""
+import contextvars
+import os
+import sysconfig
+import traceback
+from collections import Counter
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.urls import URLResolver
+
+from core import timing
+
+_recorder = contextvars.ContextVar('query_budget_recorder', default=None)
+
+# innermost project frames kept as the call site of a query
+STACK_DEPTH = 4
+# queries shown for each call site in a failure message
+SAMPLES = 2
+# modules wrapping query execution, their frames are not part of a call site
+INSTRUMENTATION_FILES = {__file__, timing.__file__}
+
+
+@dataclass(frozen=True)
+class QueryBudget:
+    """At most base queries, plus per_row for each row of the response"""
+    base: int
+    per_row: int = 0
+
+    def limit(self, rows=0):
+        return self.base + self.per_row * rows
+
+    def __str__(self):
+        return f'{self.base} + {self.per_row} per row' if self.per_row else str(self.base)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def _is_orm(filename):
+    return (f'{os.sep}django{os.sep}db{os.sep}' in filename
+            or filename.endswith(f'django{os.sep}utils{os.sep}asyncio.py')
+            or filename in INSTRUMENTATION_FILES)
+
+
+def _display_path(filename):
+    for root in (str(settings.BASE_DIR), *sysconfig.get_paths().values()):
+        if filename.startswith(root + os.sep):
+            return os.path.relpath(filename, root)
+    return filename
+
+
+def call_site():
+    """
+    Return where the current query comes from, as (file, line, function) tuples: the frame that called into the
+    ORM, then the innermost frames of project code above it
+    """
+    base_dir = str(settings.BASE_DIR) + os.sep
+    stack = [frame for frame in reversed(traceback.extract_stack()[:-1]) if not _is_orm(frame.filename)]
+    frames = stack[:1] + [frame for frame in stack[1:]
+                          if frame.filename.startswith(base_dir) and 'site-packages' not in frame.filename]
+    return tuple((_display_path(frame.filename), frame.lineno, frame.name) for frame in frames[:STACK_DEPTH])
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper adding each query to the recorder of the current context"""
+    queries = _recorder.get()
+    if queries is not None:
+        queries.append((sql, call_site()))
+    return execute(sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class CaptureQueries:
+    """
+    Context manager collecting the SQL and call site of every query run in its context.
+
+    Unlike django.test.utils.CaptureQueriesContext it covers every connection, including those of the threads the
+    async views run their queries on, since those copy the context they were started from.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __enter__(self):
+        connection_created.connect(install_query_recorder, dispatch_uid='core-query-budget')
+        for connection in connections.all():
+            install_query_recorder(None, connection)
+        self._token = _recorder.set(self.queries)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _recorder.reset(self._token)
+        connection_created.disconnect(dispatch_uid='core-query-budget')
+
+    def __len__(self):
+        return len(self.queries)
+
+    def report(self):
+        """Return the queries grouped by call site, the busiest first"""
+        counts = Counter(site for sql, site in self.queries)
+        lines = []
+        for site, count in counts.most_common():
+            lines.append(f'{count} x ' + ' <- '.join(f'{file}:{line} in {function}' for file, line, function in site)
+                         if site else f'{count} x outside project code')
+            samples = [sql for sql, query_site in self.queries if query_site == site][:SAMPLES]
+            lines += [f'    {sql}' for sql in samples]
+        return '\n'.join(lines)
+
+
+def check_budget(captured, budget, rows=0, description='request'):
+    """Raise QueryBudgetExceeded when the captured queries go over the budget for the given number of rows"""
+    limit = budget.limit(rows)
+    if len(captured) > limit:
+        raise QueryBudgetExceeded(
+            f'{description} ran {len(captured)} queries for {rows} rows, over its budget of {budget} '
+            f'= {limit}:\n{captured.report()}'
+        )
+
+
+def route_names(patterns, namespace):
+    """Return the names of the routes of a list of url patterns, as namespace:name, so budgets can cover them all"""
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            names |= route_names(pattern.url_patterns, namespace)
+        elif pattern.name:
+            names.add(f'{namespace}:{pattern.name}')
+    return names
+
+
+class QueryBudgetTestMixin:
+    """TestCase mixin asserting the queries of a block stay within a budget"""
+
+    def assertQueryBudget(self, budget, rows=0, description='request'):
+        return _AssertQueryBudget(budget, rows, description)
+
+
+class _AssertQueryBudget(CaptureQueries):
+
+    def __init__(self, budget, rows, description):
+        super().__init__()
+        self.budget = budget
+        self.rows = rows
+        self.description = description
+
+    def __exit__(self, exc_type, exc_value, tb):
+        super().__exit__(exc_type, exc_value, tb)
+        if exc_type is None:
+            check_budget(self, self.budget, self.rows, self.description)
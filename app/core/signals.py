@@ -0,0 +1,126 @@
+"""
+Signal handlers keeping the stored estate totals and the portfolio summary in step with the rows they cover
+"""
+from django.db.models import Sum
+from django.db.models.signals import post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from core.models import Application, Estate, Asset, Expense, Dispute, PortfolioSummary, portfolio_keys
+
+
+def _totals_delta(instance, value, count):
+    """Return the add_to_totals() arguments for moving the totals by a line item's value and count"""
+    if isinstance(instance, Asset):
+        return {'assets': value, 'asset_count': count}
+    if isinstance(instance, Expense):
+        return {'expenses': value, 'expense_count': count}
+    return {'dispute_count': count}
+
+
+@receiver(post_save, sender=Asset)
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=Dispute)
+def update_estate_totals_on_save(sender, instance, created, raw=False, **kwargs):
+    """Apply the difference the saved line item makes to its estate's totals"""
+    if raw:
+        return
+    value = getattr(instance, 'value', None) or 0
+
+    if created:
+        Estate.objects.add_to_totals(instance.estate_id, **_totals_delta(instance, value, 1))
+    elif not hasattr(instance, 'loaded_values'):
+        # saved without being loaded first, so the previous values are unknown
+        Estate.objects.rebuild_totals([instance.estate_id])
+    else:
+        old_estate_id = instance.loaded_values['estate_id']
+        old_value = instance.loaded_values.get('value') or 0
+        if old_estate_id == instance.estate_id:
+            Estate.objects.add_to_totals(instance.estate_id, **_totals_delta(instance, value - old_value, 0))
+        else:
+            Estate.objects.add_to_totals(old_estate_id, **_totals_delta(instance, -old_value, -1))
+            Estate.objects.add_to_totals(instance.estate_id, **_totals_delta(instance, value, 1))
+
+    instance.remember_loaded_values()
+
+
+@receiver(post_delete, sender=Asset)
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=Dispute)
+def update_estate_totals_on_delete(sender, instance, **kwargs):
+    """Remove the deleted line item from its estate's totals, unless the estate is deleted with it"""
+    if getattr(instance, 'deleted_with_estate', False):
+        return
+    loaded = getattr(instance, 'loaded_values', None) or {'estate_id': instance.estate_id,
+                                                          'value': getattr(instance, 'value', None)}
+    Estate.objects.add_to_totals(loaded['estate_id'], **_totals_delta(instance, -(loaded.get('value') or 0), -1))
+
+
+def _application_keys(values):
+    return portfolio_keys(values['application_status_id'], values['agency_id'], values['user_id'],
+                          values['date_submitted'])
+
+
+def _current_values(instance):
+    return {name: getattr(instance, name) for name in instance.tracked_fields}
+
+
+@receiver(post_save, sender=Application)
+def update_portfolio_summary_on_application_save(sender, instance, created, raw=False, **kwargs):
+    """Move the saved application's amounts within the portfolio summary"""
+    if raw:
+        return
+    keys = _application_keys(_current_values(instance))
+
+    if created:
+        PortfolioSummary.objects.add(keys, count=1, amount=instance.amount, term=instance.term)
+    elif not hasattr(instance, 'loaded_values'):
+        # saved without being loaded first, the row it was counted in is unknown
+        PortfolioSummary.objects.refresh(keys)
+    else:
+        loaded = instance.loaded_values
+        old_keys = _application_keys(loaded)
+        if old_keys == keys:
+            PortfolioSummary.objects.add(keys, amount=instance.amount - loaded['amount'],
+                                         term=instance.term - loaded['term'])
+        else:
+            estate_value = Estate.objects.filter(application=instance).aggregate(value=Sum('net_value'))['value'] or 0
+            PortfolioSummary.objects.add(old_keys, count=-1, amount=-loaded['amount'], term=-loaded['term'],
+                                         estate_value=-estate_value)
+            PortfolioSummary.objects.add(keys, count=1, amount=instance.amount, term=instance.term,
+                                         estate_value=estate_value)
+
+    instance.remember_loaded_values()
+
+
+@receiver(post_delete, sender=Application)
+def update_portfolio_summary_on_application_delete(sender, instance, **kwargs):
+    """
+    Recompute the deleted application's portfolio summary row.
+    Its estates and line items are deleted first and move the row on their own, so a delta would count them twice.
+    """
+    values = getattr(instance, 'loaded_values', None) or _current_values(instance)
+    PortfolioSummary.objects.refresh(_application_keys(values))
+
+
+@receiver(post_save, sender=Estate)
+def update_portfolio_summary_on_estate_save(sender, instance, created, raw=False, **kwargs):
+    """Add a new estate's value to its application's row, or move it when the estate changes application"""
+    if raw:
+        return
+    if created:
+        PortfolioSummary.objects.add_estate_value(instance.pk, instance.net_value)
+    else:
+        old_application_id = getattr(instance, 'loaded_values', {}).get('application_id')
+        if old_application_id != instance.application_id:
+            for application in Application.objects.filter(pk__in=[old_application_id, instance.application_id]):
+                PortfolioSummary.objects.refresh(_application_keys(_current_values(application)))
+    instance.remember_loaded_values()
+
+
+@receiver(pre_delete, sender=Estate)
+def update_portfolio_summary_on_estate_delete(sender, instance, **kwargs):
+    """
+    Take the stored value of the deleted estate out of its application's rows once, while the estate can still be
+    joined. The line items deleted with it leave the estate's totals alone, see cascade_with_estate().
+    """
+    PortfolioSummary.objects.remove_estate_value(instance.pk)
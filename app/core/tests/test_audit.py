@@ -0,0 +1,148 @@
+"""
+Tests for the buffered audit log
+"""
+from decimal import Decimal
+from unittest import mock
+
+from auditlog.context import disable_auditlog
+from auditlog.models import LogEntry
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core import audit
+from core.models import Agency, Asset, Estate
+
+
+def log_entry_inserts(queries):
+    return [query for query in queries if query['sql'].startswith('INSERT INTO "auditlog_logentry"')]
+
+
+class BufferedAuditTestCase(TestCase):
+    """Test audit entries are collected and inserted in batches"""
+
+    def setUp(self):
+        self.estate = Estate.objects.create()
+
+    def test_buffered_entries_are_inserted_together(self):
+        """Test many audited saves cost a single log entry INSERT, made before the block's transaction ends"""
+        with CaptureQueriesContext(connection) as queries, audit.buffered_audit():
+            for i in range(20):
+                Asset.objects.create(description=f"Asset {i}", value=Decimal("10"), estate=self.estate)
+            self.assertEqual(LogEntry.objects.get_for_model(Asset).count(), 0)
+            self.assertTrue(transaction.get_connection().in_atomic_block)
+
+        self.assertEqual(len(log_entry_inserts(queries)), 1)
+        self.assertEqual(LogEntry.objects.get_for_model(Asset).filter(action=LogEntry.Action.CREATE).count(), 20)
+
+    def test_buffered_updates_and_deletes_are_logged(self):
+        """Test updates keep their changes and deletes are logged"""
+        asset = Asset.objects.create(description="House", value=Decimal("100"), estate=self.estate)
+
+        with audit.buffered_audit():
+            asset.value = Decimal("200")
+            asset.save()
+            asset_id = asset.id
+            asset.delete()
+
+        update = LogEntry.objects.get(object_id=asset_id, content_type__model='asset', action=LogEntry.Action.UPDATE)
+        self.assertEqual(update.changes['value'], ['100.00', '200'])
+        self.assertTrue(LogEntry.objects.filter(object_id=asset_id, content_type__model='asset',
+                                                action=LogEntry.Action.DELETE).exists())
+
+    def test_failed_block_rolls_back_writes_and_entries(self):
+        """Test a block that fails leaves neither its writes nor their entries"""
+        with self.assertRaises(RuntimeError), audit.buffered_audit():
+            Asset.objects.create(description="House", value=Decimal("100"), estate=self.estate)
+            raise RuntimeError
+
+        self.assertFalse(Asset.objects.exists())
+        self.assertFalse(LogEntry.objects.get_for_model(Asset).exists())
+
+    def test_rolled_back_savepoint_leaves_no_entries(self):
+        """Test the entries of writes rolled back inside the block are dropped, those of the others are kept"""
+        with audit.buffered_audit():
+            kept = Asset.objects.create(description="House", value=Decimal("100"), estate=self.estate)
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Asset.objects.create(description="Car", value=Decimal("100"), estate=self.estate)
+                raise RuntimeError
+
+        self.assertEqual(list(LogEntry.objects.get_for_model(Asset).values_list('object_id', flat=True)), [kept.id])
+
+    def test_failed_insert_rolls_back_the_writes(self):
+        """Test writes are not kept without their entries when the batch cannot be inserted"""
+        failing = mock.Mock(**{'bulk_create.side_effect': RuntimeError})
+        with mock.patch.object(LogEntry.objects, 'using', return_value=failing):
+            with self.assertRaises(RuntimeError), audit.buffered_audit():
+                Asset.objects.create(description="House", value=Decimal("100"), estate=self.estate)
+
+        self.assertFalse(Asset.objects.exists())
+
+    def test_unbuffered_saves_are_logged_immediately(self):
+        """Test saves outside a buffer behave like plain auditlog"""
+        Asset.objects.create(description="House", value=Decimal("100"), estate=self.estate)
+        self.assertEqual(LogEntry.objects.get_for_model(Asset).count(), 1)
+
+    def test_disabled_auditlog_is_respected(self):
+        """Test nothing is buffered while auditlog is disabled"""
+        with audit.buffered_audit(), disable_auditlog():
+            Asset.objects.create(description="House", value=Decimal("100"), estate=self.estate)
+        self.assertFalse(LogEntry.objects.get_for_model(Asset).exists())
+
+    def test_registered_models_are_buffered(self):
+        """Test every registered model logs through the pre_log hook"""
+        agency = Agency(name="Agency", house_number="1", street="Main Street", town="Cork", county="Cork",
+                        eircode="T12AB34")
+        with audit.buffered_audit():
+            agency.save()
+            self.assertFalse(LogEntry.objects.get_for_object(agency).exists())
+
+        self.assertTrue(LogEntry.objects.get_for_object(agency).exists())
+
+
+class BufferedWriteRequestTestCase(TestCase):
+    """Test the estate writes of the API are buffered"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(email='test@example.com', password='testpass')
+        self.client.force_authenticate(self.user)
+
+    def test_estate_creation_inserts_entries_in_one_batch(self):
+        """Test the estate and all its line items are logged with one INSERT"""
+        payload = {
+            'application': None,
+            'asset_set': [{'description': f'Asset {i}', 'value': '100.00'} for i in range(50)],
+            'expense_set': [{'description': f'Expense {i}', 'value': '10.00'} for i in range(50)],
+            'dispute_set': [],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('loan:estate-list'), payload, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(log_entry_inserts(queries)), 1)
+        self.assertEqual(LogEntry.objects.exclude(object_repr=str(self.user)).count(), 101)
+
+    def test_estate_deletion_inserts_entries_in_one_batch(self):
+        """Test deleting an estate logs it and its line items with one INSERT"""
+        estate = Estate.objects.create()
+        Asset.objects.bulk_create([Asset(description=f"Asset {i}", value=Decimal("10"), estate=estate)
+                                   for i in range(20)])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(reverse('loan:estate-detail', args=[estate.id]))
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(len(log_entry_inserts(queries)), 1)
+        self.assertEqual(LogEntry.objects.filter(action=LogEntry.Action.DELETE).count(), 21)
+
+    def test_update_request_is_logged(self):
+        """Test a PATCH through the API leaves its log entry"""
+        asset = Asset.objects.create(description="House", value=Decimal("100"))
+        response = self.client.patch(reverse('loan:asset-detail', args=[asset.id]), {'value': '150.00'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(LogEntry.objects.get_for_object(asset).filter(action=LogEntry.Action.UPDATE).exists())
@@ -0,0 +1,61 @@
+"""
+Tests for the database connection helpers
+"""
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from core.db import CopySource, close_unusable_connections
+
+
+class FakeConnection:
+    """Stand in for a database wrapper with an open connection"""
+
+    def __init__(self, usable, in_atomic_block=False):
+        self.connection = object()
+        self.in_atomic_block = in_atomic_block
+        self.usable = usable
+        self.closed = False
+
+    def is_usable(self):
+        return self.usable
+
+    def close(self):
+        self.closed = True
+
+
+class CloseUnusableConnectionsTestCase(SimpleTestCase):
+    """Tests persistent connections are checked at the start of a request"""
+
+    def test_only_dropped_connections_are_closed(self):
+        """Test a dropped connection is closed and a live one or one inside a transaction is kept"""
+        dropped, live, in_transaction = FakeConnection(False), FakeConnection(True), FakeConnection(False, True)
+
+        with mock.patch('core.db.connections') as connections:
+            connections.all.return_value = [dropped, live, in_transaction]
+            close_unusable_connections()
+
+        self.assertTrue(dropped.closed)
+        self.assertFalse(live.closed)
+        self.assertFalse(in_transaction.closed)
+
+
+class CopySourceTestCase(SimpleTestCase):
+    """Tests rows are formatted for COPY as they are read"""
+
+    def test_rows_in_text_format(self):
+        """Test values are tab separated with nulls and booleans in the COPY text format"""
+        source = CopySource([(1, 'House', None, True), (2, 'Car', '10.50', False)])
+
+        self.assertEqual(source.read(), '1\tHouse\t\\N\tt\n2\tCar\t10.50\tf\n')
+        self.assertEqual(source.read(), '')
+        self.assertEqual(source.rows, 2)
+
+    def test_reads_in_pieces(self):
+        """Test reads return at most the size asked for, and all of the rows in order"""
+        source = CopySource((i,) for i in range(5000))
+
+        pieces = list(iter(lambda: source.read(100), ''))
+
+        self.assertLessEqual(max(len(piece) for piece in pieces), 100)
+        self.assertEqual(''.join(pieces), ''.join(f'{i}\n' for i in range(5000)))
@@ -0,0 +1,82 @@
+"""
+Tests for the stored estate totals
+"""
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from core import models
+
+
+class EstateTotalsTestCase(TestCase):
+    """Tests the totals are moved incrementally as line items change"""
+
+    def setUp(self):
+        self.estate = models.Estate.objects.create()
+
+    def assertTotals(self, estate, assets, expenses, asset_count, expense_count, dispute_count):
+        estate.refresh_from_db()
+        self.assertEqual(estate.total_assets, Decimal(assets))
+        self.assertEqual(estate.total_expenses, Decimal(expenses))
+        self.assertEqual(estate.net_value, Decimal(assets) - Decimal(expenses))
+        self.assertEqual(estate.asset_count, asset_count)
+        self.assertEqual(estate.expense_count, expense_count)
+        self.assertEqual(estate.dispute_count, dispute_count)
+
+    def test_totals_follow_created_line_items(self):
+        """Test creating line items adds to the totals"""
+        models.Asset.objects.create(description="House", value=Decimal("250000"), estate=self.estate)
+        models.Asset.objects.create(description="Car", value=Decimal("5000.50"), estate=self.estate)
+        models.Expense.objects.create(description="Funeral", value=Decimal("4000"), estate=self.estate)
+        models.Dispute.objects.create(description="Will contested", estate=self.estate)
+
+        self.assertTotals(self.estate, "255000.50", "4000", 2, 1, 1)
+
+    def test_totals_follow_updated_line_items(self):
+        """Test changing a value moves the totals by the difference"""
+        asset = models.Asset.objects.create(description="House", value=Decimal("250000"), estate=self.estate)
+        asset.value = Decimal("240000")
+        asset.save()
+
+        loaded = models.Asset.objects.get(id=asset.id)
+        loaded.value = Decimal("230000")
+        loaded.save()
+
+        self.assertTotals(self.estate, "230000", "0", 1, 0, 0)
+
+    def test_totals_follow_line_items_moved_between_estates(self):
+        """Test moving a line item to another estate moves it between the totals"""
+        other_estate = models.Estate.objects.create()
+        expense = models.Expense.objects.create(description="Funeral", value=Decimal("4000"), estate=self.estate)
+
+        expense = models.Expense.objects.get(id=expense.id)
+        expense.estate = other_estate
+        expense.save()
+
+        self.assertTotals(self.estate, "0", "0", 0, 0, 0)
+        self.assertTotals(other_estate, "0", "4000", 0, 1, 0)
+
+    def test_totals_follow_deleted_line_items(self):
+        """Test deleting line items removes them from the totals"""
+        asset = models.Asset.objects.create(description="House", value=Decimal("250000"), estate=self.estate)
+        models.Asset.objects.create(description="Car", value=Decimal("5000"), estate=self.estate)
+        dispute = models.Dispute.objects.create(description="Will contested", estate=self.estate)
+
+        asset.delete()
+        models.Dispute.objects.filter(id=dispute.id).delete()
+
+        self.assertTotals(self.estate, "5000", "0", 1, 0, 0)
+
+    def test_rebuild_estate_totals_command(self):
+        """Test the rebuild command recomputes drifted totals in chunks"""
+        other_estate = models.Estate.objects.create()
+        models.Asset.objects.create(description="House", value=Decimal("250000"), estate=self.estate)
+        models.Expense.objects.create(description="Funeral", value=Decimal("4000"), estate=other_estate)
+        models.Estate.objects.update(total_assets=0, total_expenses=0, net_value=0, asset_count=0, expense_count=0)
+
+        call_command('rebuild_estate_totals', chunk_size=1, stdout=StringIO())
+
+        self.assertTotals(self.estate, "250000", "0", 1, 0, 0)
+        self.assertTotals(other_estate, "0", "4000", 0, 1, 0)
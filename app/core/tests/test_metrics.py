@@ -0,0 +1,101 @@
+"""
+Tests for the /metrics endpoint
+"""
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.metrics import metrics_view
+from loan.cache import list_cache
+
+APP_DIR = Path(__file__).resolve().parents[2]
+
+
+def sample(text, name):
+    """Return the value of the sample line starting with name"""
+    for line in text.splitlines():
+        if line.startswith(name + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+class MetricsTestCase(TestCase):
+    """Test the metrics endpoint"""
+
+    def setUp(self):
+        # the agency list has to be read from the database to count its queries
+        list_cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(email='test@example.com', password='testpass')
+        self.client.force_authenticate(self.user)
+
+    def test_request_and_database_metrics_per_route(self):
+        """Test served requests add to the latency histogram and query counters of their route"""
+        text = self.client.get(reverse('metrics')).content.decode()
+        route = 'route="loan:agency-list"'
+        before = sample(text, f'http_request_duration_seconds_count{{method="GET",{route}}}') or 0
+        queries_before = sample(text, f'db_queries_total{{{route}}}') or 0
+
+        self.client.get(reverse('loan:agency-list'))
+        self.client.get(reverse('loan:agency-list'))
+        response = self.client.get(reverse('metrics'))
+
+        text = response.content.decode()
+        self.assertEqual(response['Content-Type'].split(';')[0], 'text/plain')
+        self.assertEqual(sample(text, f'http_request_duration_seconds_count{{method="GET",{route}}}'), before + 2)
+        self.assertGreater(sample(text, f'db_queries_total{{{route}}}'), queries_before)
+        self.assertEqual(sample(text, 'http_requests_in_flight'), 1)
+        self.assertIn('token_auth_cache_lookups_total', text)
+        self.assertIn('auditlog_buffered_entries', text)
+
+    def test_counters_add_up_across_processes(self):
+        """Test with PROMETHEUS_MULTIPROC_DIR set the endpoint reports the sum of every process"""
+        with tempfile.TemporaryDirectory() as directory:
+            environment = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': directory}
+            for _ in range(2):
+                subprocess.run([sys.executable, '-c',
+                                "from core import metrics; metrics.token_cache_lookups.labels('hit').inc(3)"],
+                               cwd=APP_DIR, env=environment, check=True)
+
+            with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': directory}):
+                response = metrics_view(RequestFactory().get('/metrics'))
+
+        self.assertEqual(sample(response.content.decode(), 'token_auth_cache_lookups_total{result="hit"}'), 6)
+
+
+class MetricsAccessTestCase(TestCase):
+    """Test only allowed addresses and the metrics token may scrape"""
+
+    def scrape(self, remote_addr='127.0.0.1', **headers):
+        return metrics_view(RequestFactory().get('/metrics', REMOTE_ADDR=remote_addr, **headers))
+
+    def test_local_address_allowed_by_default(self):
+        """Test the default settings let the host itself scrape and nobody else"""
+        self.assertEqual(self.scrape().status_code, 200)
+        self.assertEqual(self.scrape('::1').status_code, 200)
+        self.assertEqual(self.scrape('10.0.0.5').status_code, 403)
+
+    @override_settings(METRICS={'ALLOWED_IPS': ['10.0.0.0/8'], 'TOKEN': None})
+    def test_allowed_networks(self):
+        """Test addresses are matched against the allowed networks"""
+        self.assertEqual(self.scrape('10.1.2.3').status_code, 200)
+        self.assertEqual(self.scrape('127.0.0.1').status_code, 403)
+        self.assertEqual(self.scrape('10.1.2.3', HTTP_X_FORWARDED_FOR='192.168.0.1').status_code, 200)
+        self.assertEqual(self.scrape('192.168.0.1', HTTP_X_FORWARDED_FOR='10.1.2.3').status_code, 403)
+
+    @override_settings(METRICS={'ALLOWED_IPS': [], 'TOKEN': 'scrape-secret'})
+    def test_bearer_token(self):
+        """Test the token lets any address scrape and a wrong or missing one does not"""
+        self.assertEqual(self.scrape('10.0.0.5', HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+        self.assertEqual(self.scrape('10.0.0.5', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.scrape('10.0.0.5', HTTP_AUTHORIZATION='Token scrape-secret').status_code, 403)
+        self.assertEqual(self.scrape('127.0.0.1').status_code, 403)
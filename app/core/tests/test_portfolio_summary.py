@@ -0,0 +1,186 @@
+"""
+Tests for the portfolio summary
+"""
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from core import models
+
+
+def summary_rows():
+    """Return the non empty summary rows as {(dimension, key, month): (count, amount, term, estate value)}"""
+    return {
+        (row.dimension, row.key, row.month):
+            (row.application_count, row.total_amount, row.total_term, row.total_estate_value)
+        for row in models.PortfolioSummary.objects.filter(application_count__gt=0)
+    }
+
+
+def rows_of(keys, rows=None):
+    """Return the totals of the row of each rollup an application with the given key counts in"""
+    rows = summary_rows() if rows is None else rows
+    return {dimension: rows.get((dimension, key, month)) for dimension, key, month in models.rollup_keys(keys)}
+
+
+class PortfolioSummaryTestCase(TestCase):
+    """Tests the summary is moved incrementally as applications and estates change"""
+
+    def setUp(self):
+        self.new = models.ApplicationStatus.objects.create(name="New")
+        self.approved = models.ApplicationStatus.objects.create(name="Approved")
+        self.agency = models.Agency.objects.create(name="Agency", house_number="1", street="Main Street",
+                                                   town="Cork", county="Cork", eircode="T12AB34")
+
+    def assertMatchesRebuild(self):
+        incremental = summary_rows()
+        call_command('rebuild_portfolio_summary', stdout=StringIO())
+        self.assertEqual(incremental, summary_rows())
+
+    def test_created_applications_are_counted(self):
+        """Test new applications are added to the rows of their status, agency and user in their month"""
+        first = models.Application.objects.create(amount=Decimal("1000"), term=12, application_status=self.new,
+                                                  agency=self.agency)
+        models.Application.objects.create(amount=Decimal("500.50"), term=6, application_status=self.new,
+                                          agency=self.agency)
+        models.Application.objects.create(amount=Decimal("200"), term=3)
+
+        keys = models.portfolio_keys(self.new.id, self.agency.id, None, first.date_submitted)
+        self.assertEqual(rows_of(keys), {
+            'application_status': (2, Decimal("1500.50"), 18, Decimal("0")),
+            'agency': (2, Decimal("1500.50"), 18, Decimal("0")),
+            'user': (3, Decimal("1700.50"), 21, Decimal("0")),
+        })
+        # the status and agency rollups have a row for the third application, the user rollup counts it with the rest
+        self.assertEqual(len(summary_rows()), 5)
+        self.assertMatchesRebuild()
+
+    def test_changed_applications_move_between_rows(self):
+        """Test changing the status moves the application and its estate value to another status row"""
+        application = models.Application.objects.create(amount=Decimal("1000"), term=12, application_status=self.new)
+        estate = models.Estate.objects.create(application=application)
+        models.Asset.objects.create(description="House", value=Decimal("250000"), estate=estate)
+        models.Expense.objects.create(description="Funeral", value=Decimal("4000"), estate=estate)
+
+        application = models.Application.objects.get(id=application.id)
+        application.application_status = self.approved
+        application.amount = Decimal("1200")
+        application.save()
+
+        keys = models.portfolio_keys(self.approved.id, None, None, application.date_submitted)
+        self.assertEqual(summary_rows(), {row: (1, Decimal("1200"), 12, Decimal("246000"))
+                                          for row in models.rollup_keys(keys)})
+        self.assertMatchesRebuild()
+
+    def test_line_item_changes_move_the_estate_value(self):
+        """Test changing, moving and deleting line items moves the estate value of the application's rows"""
+        first = models.Application.objects.create(amount=Decimal("1000"), term=12, application_status=self.new)
+        second = models.Application.objects.create(amount=Decimal("1000"), term=12, agency=self.agency)
+        first_estate = models.Estate.objects.create(application=first)
+        second_estate = models.Estate.objects.create(application=second)
+        asset = models.Asset.objects.create(description="House", value=Decimal("250000"), estate=first_estate)
+        models.Asset.objects.create(description="Car", value=Decimal("5000"), estate=second_estate)
+
+        asset = models.Asset.objects.get(id=asset.id)
+        asset.value = Decimal("200000")
+        asset.estate = second_estate
+        asset.save()
+        models.Asset.objects.filter(description="Car").get().delete()
+
+        self.assertMatchesRebuild()
+        keys = models.portfolio_keys(None, self.agency.id, None, second.date_submitted)
+        self.assertEqual(rows_of(keys)['agency'][3], Decimal("200000"))
+
+    def test_estates_moved_between_applications_move_their_value(self):
+        """Test giving an estate to another application moves its value"""
+        first = models.Application.objects.create(amount=Decimal("1000"), term=12, application_status=self.new)
+        second = models.Application.objects.create(amount=Decimal("1000"), term=12, application_status=self.approved)
+        estate = models.Estate.objects.create(application=first)
+        models.Asset.objects.create(description="House", value=Decimal("250000"), estate=estate)
+
+        estate = models.Estate.objects.get(id=estate.id)
+        estate.application = second
+        estate.save()
+
+        self.assertMatchesRebuild()
+
+    def test_deleted_applications_are_removed(self):
+        """Test deleting an application removes it, its estate and line items from its rows once"""
+        kept = models.Application.objects.create(amount=Decimal("700"), term=6, application_status=self.new)
+        deleted = models.Application.objects.create(amount=Decimal("1000"), term=12, application_status=self.new)
+        estate = models.Estate.objects.create(application=deleted)
+        models.Asset.objects.create(description="House", value=Decimal("250000"), estate=estate)
+        models.Expense.objects.create(description="Funeral", value=Decimal("4000"), estate=estate)
+
+        deleted.delete()
+
+        keys = models.portfolio_keys(self.new.id, None, None, kept.date_submitted)
+        self.assertEqual(summary_rows(), {row: (1, Decimal("700"), 6, Decimal("0"))
+                                          for row in models.rollup_keys(keys)})
+        self.assertMatchesRebuild()
+
+    def test_deleted_estates_leave_their_totals_alone(self):
+        """Test deleting an estate takes its value out of the summary once, whatever the number of line items"""
+        def create_estate(items):
+            application = models.Application.objects.create(amount=Decimal("1000"), term=12,
+                                                            application_status=self.new)
+            estate = models.Estate.objects.create(application=application)
+            for i in range(items):
+                models.Asset.objects.create(description=f"Asset {i}", value=Decimal("100"), estate=estate)
+                models.Expense.objects.create(description=f"Expense {i}", value=Decimal("10"), estate=estate)
+            return models.Estate.objects.get(id=estate.id)
+
+        small, large = create_estate(1), create_estate(10)
+        with CaptureQueriesContext(connection) as small_queries:
+            small.delete()
+        with CaptureQueriesContext(connection) as large_queries:
+            large.delete()
+
+        # auditlog logs each deleted row on its own outside a request, see core.audit
+        self.assertEqual(*[len([query for query in queries if 'auditlog_logentry' not in query['sql']])
+                           for queries in (small_queries, large_queries)])
+        self.assertFalse(any(query['sql'].startswith('UPDATE "core_estate"') for query in large_queries))
+        self.assertEqual({totals[3] for totals in summary_rows().values()}, {Decimal("0")})
+        self.assertMatchesRebuild()
+
+    def test_estate_saves_do_not_overwrite_stored_totals(self):
+        """Test saving an estate loaded before its line items changed keeps the stored totals"""
+        application = models.Application.objects.create(amount=Decimal("1000"), term=12)
+        estate = models.Estate.objects.create(application=application)
+        models.Asset.objects.create(description="House", value=Decimal("250000"), estate=estate)
+
+        estate.save()
+
+        estate.refresh_from_db()
+        self.assertEqual(estate.net_value, Decimal("250000"))
+        self.assertMatchesRebuild()
+
+    def test_rebuild_restores_a_lost_summary(self):
+        """Test the rebuild command recreates the rows from the applications"""
+        application = models.Application.objects.create(amount=Decimal("1000"), term=12, application_status=self.new)
+        models.Estate.objects.create(application=application, net_value=Decimal("300"))
+        expected = summary_rows()
+        models.PortfolioSummary.objects.all().delete()
+
+        call_command('rebuild_portfolio_summary', stdout=StringIO())
+
+        self.assertEqual(summary_rows(), expected)
+
+    def test_add_many_moves_several_rows_at_once(self):
+        """Test add_many creates missing rows and adds to existing ones in one statement, shared rows once"""
+        application = models.Application.objects.create(amount=Decimal("1000"), term=12, application_status=self.new)
+        existing = models.portfolio_keys(self.new.id, None, None, application.date_submitted)
+        missing = models.portfolio_keys(self.approved.id, None, None, application.date_submitted)
+
+        with self.assertNumQueries(1):
+            models.PortfolioSummary.objects.add_many({existing: (2, Decimal("500"), 6, Decimal("0")),
+                                                      missing: (1, Decimal("200"), 3, Decimal("50"))})
+
+        self.assertEqual(rows_of(existing)['application_status'], (3, Decimal("1500"), 18, Decimal("0")))
+        self.assertEqual(rows_of(missing)['application_status'], (1, Decimal("200"), 3, Decimal("50")))
+        # both keys have no agency and no user, their amounts are added up in those rows
+        self.assertEqual(rows_of(existing)['user'], (4, Decimal("1700"), 21, Decimal("50")))
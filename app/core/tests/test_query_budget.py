@@ -0,0 +1,52 @@
+"""
+Tests for the query budget helpers
+"""
+from django.test import TestCase
+
+from core.models import Agency
+from core.query_budget import CaptureQueries, QueryBudget, QueryBudgetExceeded, QueryBudgetTestMixin, check_budget
+
+
+def load_agency_names(ids):
+    return [Agency.objects.get(id=agency_id).name for agency_id in ids]
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+
+    def setUp(self):
+        self.ids = [Agency.objects.create(name=f'Agency {i}').id for i in range(3)]
+
+    def test_limit_grows_with_rows(self):
+        """Test the budget allows base queries plus per_row for each row"""
+        self.assertEqual(QueryBudget(2).limit(10), 2)
+        self.assertEqual(QueryBudget(2, per_row=1).limit(10), 12)
+
+    def test_within_budget(self):
+        """Test a block running no more queries than its budget passes"""
+        with self.assertQueryBudget(QueryBudget(1), rows=3):
+            list(Agency.objects.filter(id__in=self.ids))
+
+    def test_over_budget_reports_queries_by_call_site(self):
+        """Test a query per row fails the budget, with the queries grouped under the line that ran them"""
+        with CaptureQueries() as captured:
+            load_agency_names(self.ids)
+
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            check_budget(captured, QueryBudget(1), rows=3, description='names')
+
+        message = str(raised.exception)
+        self.assertIn('names ran 3 queries for 3 rows, over its budget of 1 = 1', message)
+        self.assertIn('3 x core/tests/test_query_budget.py:', message)
+        self.assertIn('in load_agency_names', message)
+        self.assertIn('FROM "core_agency"', message)
+
+    def test_captures_nested_blocks_separately(self):
+        """Test queries are only counted by the capture they run in"""
+        with CaptureQueries() as outer:
+            Agency.objects.count()
+            with CaptureQueries() as inner:
+                Agency.objects.count()
+                Agency.objects.count()
+
+        self.assertEqual(len(inner), 2)
+        self.assertEqual(len(outer), 1)
@@ -0,0 +1,78 @@
+"""
+Tests for the seed_data command
+"""
+from io import StringIO
+
+from django.core.management import call_command
+from django.db.models import Max, Sum
+from django.test import TestCase
+
+from core import models
+
+OPTIONS = {'agencies': 3, 'solicitors_per_agency': 2, 'users': 4, 'applications': 30, 'line_items_per_estate': 6}
+
+
+def seed(seed=0):
+    call_command('seed_data', seed=seed, stdout=StringIO(), **OPTIONS)
+
+
+def snapshot():
+    """Return the seeded rows without their ids, which depend on what the tables held before"""
+    return {
+        'applications': list(models.Application.objects.order_by('id').values_list(
+            'amount', 'term', 'application_status_id', 'date_submitted')),
+        'estates': list(models.Estate.objects.order_by('id').values_list(
+            'total_assets', 'total_expenses', 'asset_count', 'expense_count', 'dispute_count')),
+        'assets': list(models.Asset.objects.order_by('id').values_list('section', 'title', 'value')),
+        'solicitors': list(models.Solicitor.objects.order_by('id').values_list('first_name', 'last_name')),
+    }
+
+
+class SeedDataTestCase(TestCase):
+    """Tests the generated data is consistent and repeatable"""
+
+    def test_counts_and_relations(self):
+        """Test the requested rows are created and refer to each other"""
+        seed()
+
+        self.assertEqual(models.Agency.objects.count(), 3)
+        self.assertEqual(models.Solicitor.objects.count(), 6)
+        self.assertEqual(models.Application.objects.count(), 30)
+        self.assertGreater(models.Estate.objects.count(), 0)
+        self.assertGreater(models.Asset.objects.count(), 0)
+        for application in models.Application.objects.select_related('lead_solicitor'):
+            self.assertEqual(application.agency_id, application.lead_solicitor.agency_id)
+        summary = models.PortfolioSummary.objects.filter(dimension='user')
+        self.assertEqual(summary.aggregate(Sum('application_count'))['application_count__sum'], 30)
+
+    def test_estate_totals_match_line_items(self):
+        """Test the totals loaded with the estates are the ones computed from their line items"""
+        seed()
+        loaded = snapshot()['estates']
+
+        models.Estate.objects.rebuild_totals(models.Estate.objects.values_list('id', flat=True))
+
+        self.assertEqual(snapshot()['estates'], loaded)
+
+    def test_same_seed_same_data(self):
+        """Test a seed generates the same rows every time, and another seed different ones"""
+        seed(seed=1)
+        first = snapshot()
+        models.Application.objects.all().delete()
+        models.Solicitor.objects.all().delete()
+
+        seed(seed=1)
+        self.assertEqual(snapshot(), first)
+
+        models.Application.objects.all().delete()
+        seed(seed=2)
+        self.assertNotEqual(snapshot()['applications'], first['applications'])
+
+    def test_ids_follow_existing_rows(self):
+        """Test loaded rows get ids after the existing ones, and later inserts after the loaded ones"""
+        existing = models.Agency.objects.create(name='Existing')
+        seed()
+
+        self.assertFalse(models.Agency.objects.filter(id__lt=existing.id).exists())
+        created = models.Agency.objects.create(name='Created')
+        self.assertEqual(created.id, models.Agency.objects.aggregate(Max('id'))['id__max'])
@@ -0,0 +1,79 @@
+"""
+Tests for the request timing middleware
+"""
+import json
+import re
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from prometheus_client import REGISTRY
+from rest_framework.test import APIClient
+
+from core.models import Agency
+
+SERVER_TIMING = re.compile(r'app;dur=[\d.]+, db;dur=[\d.]+;desc="(\d+) queries", serialize;dur=([\d.]+)')
+
+
+def timed_requests(route):
+    """Return the number of GET requests of the route in the request duration histogram"""
+    return REGISTRY.get_sample_value('http_request_duration_seconds_count', {'route': route, 'method': 'GET'}) or 0
+
+
+class ServerTimingMiddlewareTestCase(TestCase):
+    """Test every request is timed"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser(email='admin@example.com', password='testpass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Agency.objects.create(name="Agency", house_number="1", street="Main Street", town="Cork", county="Cork",
+                              eircode="T12AB34")
+
+    def test_api_requests_report_queries_and_serializer_time(self):
+        """Test an API response carries a Server-Timing header counting its queries"""
+        with self.assertNumQueries(2) as captured:
+            response = self.client.get(reverse('loan:agency-list'))
+
+        match = SERVER_TIMING.fullmatch(response['Server-Timing'])
+        self.assertIsNotNone(match)
+        self.assertEqual(int(match.group(1)), len(captured.captured_queries))
+        self.assertGreater(float(match.group(2)), 0)
+
+    def test_requests_are_logged_and_counted_per_route(self):
+        """Test each request writes a JSON log line and lands in the histogram of its route"""
+        before = {route: timed_requests(route) for route in ('loan:agency-list', 'user:me')}
+        with self.assertLogs('core.timing', 'INFO') as logs:
+            response = self.client.get(reverse('loan:agency-list'))
+            self.client.get(reverse('loan:agency-list'))
+            self.client.get(reverse('user:me'))
+
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['route'], 'loan:agency-list')
+        self.assertEqual(line['status'], 200)
+        self.assertEqual(line['bytes'], len(response.content))
+        self.assertEqual(line['queries'], 2)
+        self.assertEqual(timed_requests('loan:agency-list'), before['loan:agency-list'] + 2)
+        self.assertEqual(timed_requests('user:me'), before['user:me'] + 1)
+
+    def test_admin_requests_are_timed(self):
+        """Test admin pages are timed as well"""
+        self.client.force_login(self.user)
+        before = timed_requests('admin:core_agency_changelist')
+        response = self.client.get(reverse('admin:core_agency_changelist'))
+
+        self.assertIsNotNone(SERVER_TIMING.fullmatch(response['Server-Timing']))
+        self.assertEqual(timed_requests('admin:core_agency_changelist'), before + 1)
+
+    @override_settings(SERVER_TIMING=False)
+    def test_metrics_are_recorded_without_server_timing(self):
+        """Test turning SERVER_TIMING off drops the header and log line but not the Prometheus metrics"""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        before = timed_requests('loan:agency-list')
+        with self.assertNoLogs('core.timing', 'INFO'):
+            response = client.get(reverse('loan:agency-list'))
+
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(timed_requests('loan:agency-list'), before + 1)
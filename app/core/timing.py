@@ -0,0 +1,141 @@
+"""
+Per request timings: wall time, database time and query count, serializer time and response size
+
+The figures of the request being served are kept in a context variable, so queries and serializers anywhere in the
+request add to them, including those the async views run on their worker threads.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger('core.timing')
+
+_current = contextvars.ContextVar('request_timing', default=None)
+_serializer_depth = threading.local()
+
+
+class RequestTiming:
+    """Figures of one request, added to from every thread working on it"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.wall = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        self.serializer_time = 0.0
+        self._lock = threading.Lock()
+
+    def add_query(self, duration):
+        with self._lock:
+            self.db_time += duration
+            self.queries += 1
+
+    def add_serializer(self, duration):
+        with self._lock:
+            self.serializer_time += duration
+
+    def finish(self):
+        self.wall = time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Return the Server-Timing header value, durations in milliseconds"""
+        return (f'app;dur={self.wall * 1000:.1f}, '
+                f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries", '
+                f'serialize;dur={self.serializer_time * 1000:.1f}')
+
+
+def start():
+    """Start timing the current request, returns the token to pass to stop()"""
+    return _current.set(RequestTiming())
+
+
+def current():
+    """Return the timing of the request being served, or None outside of one"""
+    return _current.get()
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper adding each query to the timing of the current request"""
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.add_query(time.perf_counter() - started)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver wrapping every new connection with record_query"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def timed_serializer_data(data_property):
+    """
+    Wrap a serializer's data property to add its time to the current request.
+    Only the outermost call is timed, nested serializers asking for .data are part of it.
+    """
+
+    def data(self):
+        timing = _current.get()
+        depth = getattr(_serializer_depth, 'value', 0)
+        if timing is None or depth:
+            return data_property.fget(self)
+        _serializer_depth.value = depth + 1
+        started = time.perf_counter()
+        try:
+            return data_property.fget(self)
+        finally:
+            _serializer_depth.value = depth
+            timing.add_serializer(time.perf_counter() - started)
+
+    data.timed = True
+    return property(data)
+
+
+def instrument_serializers():
+    """Time the data property of DRF's serializers, it is where instances are turned into primitives"""
+    from rest_framework import serializers
+
+    for serializer_class in (serializers.Serializer, serializers.ListSerializer):
+        data_property = serializer_class.__dict__['data']
+        if not getattr(data_property.fget, 'timed', False):
+            serializer_class.data = timed_serializer_data(data_property)
+
+
+def route_name(request):
+    """Return the name of the route that served the request, the url name where there is one"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route
+
+
+def response_size(response):
+    if response.streaming:
+        return None
+    return len(response.content)
+
+
+def log_request(request, response, timing, route):
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    logger.info(json.dumps({
+        'method': request.method,
+        'path': request.path,
+        'route': route,
+        'status': response.status_code,
+        'wall_ms': round(timing.wall * 1000, 2),
+        'db_ms': round(timing.db_time * 1000, 2),
+        'queries': timing.queries,
+        'serializer_ms': round(timing.serializer_time * 1000, 2),
+        'bytes': response_size(response),
+    }))
@@ -0,0 +1,57 @@
+"""
+Gunicorn settings for serving the API in production.
+
+gunicorn reads this file from the working directory:
+    gunicorn app.wsgi                                                     threaded WSGI workers
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn app.asgi  ASGI workers
+
+Every value can be overridden with the environment variable read next to it.
+Send the master process SIGHUP to reload the code gracefully, workers finish their requests before they are replaced.
+"""
+import multiprocessing
+import os
+import shutil
+
+cores = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# requests spend most of their time waiting on postgres, so run more workers than cores
+workers = int(os.environ.get('GUNICORN_WORKERS', cores * 2 + 1))
+# read by the workers, whose in process caches can not see each other's invalidations, see core/cache.py
+os.environ['GUNICORN_WORKERS'] = str(workers)
+# threads per gthread worker, each thread keeps its own persistent database connection
+threads = int(os.environ.get('GUNICORN_THREADS', 4 if cores <= 4 else 2))
+
+# a worker silent for this many seconds is killed and replaced, keep it above DB_STATEMENT_TIMEOUT
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+# time given to workers to finish in flight requests on reload or shutdown
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# replace workers now and then so a slow leak cannot grow forever, the jitter keeps them from restarting together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# heartbeat files on tmpfs, a container's disk backed /tmp can stall workers into timeouts
+worker_tmp_dir = os.environ.get('GUNICORN_WORKER_TMP_DIR', '/dev/shm')
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+# workers write their Prometheus samples here, /metrics adds them up, see core/metrics.py
+# on tmpfs like the heartbeat files, the image has no /tmp and runs as a user that can not create one
+prometheus_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/dev/shm/prometheus')
+
+
+def on_starting(server):
+    # samples of a previous run would be added to this one's
+    shutil.rmtree(prometheus_dir, ignore_errors=True)
+    os.makedirs(prometheus_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class LoanConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'loan'
+
+    def ready(self):
+        from core.models import ApplicationStatus, Agency, Solicitor
+        from loan.cache import list_cache
+        from loan.fields import reference_cache
+
+        reference_cache.register(ApplicationStatus)
+        list_cache.register(Agency)
+        list_cache.register(Solicitor)
@@ -0,0 +1,220 @@
+"""
+Async read views for loan APIs, for serving under ASGI
+
+DRF 3.12 views are synchronous, so these are plain Django async views that reuse the viewsets' filtering,
+pagination and serializers. The Django 3.2 ORM is synchronous too: queries run on a pool of worker threads and
+the ones that do not depend on each other are awaited together, while the event loop serves other requests.
+"""
+import asyncio
+import contextvars
+import functools
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404, JsonResponse
+from rest_framework import exceptions
+from rest_framework.request import Request
+
+from core.models import Application, Estate, Asset, Expense, Dispute, Agency, Solicitor, User
+from loan import serializers
+from loan.views import ApplicationViewSet, EstateViewSet, AgencyViewSet
+from user.authentication import CachedTokenAuthentication
+
+_executor = None
+
+
+def get_executor():
+    """Return the thread pool the queries run on, each of its threads keeps its own database connection"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'ASYNC_READ_THREADS', 10),
+                                       thread_name_prefix='async-read')
+    return _executor
+
+
+def _call_with_connections(function, *args):
+    # worker threads see no request_started/request_finished, so expire their connections here
+    close_old_connections()
+    try:
+        return function(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_in_worker(function, *args):
+    """Run a synchronous, database touching function on the worker pool, in a copy of the caller's context"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), functools.partial(context.run, _call_with_connections,
+                                                                        function, *args))
+
+
+def set_prefetched(instance, name, objects):
+    """Fill the cache of a reverse relation the way prefetch_related() does, so reading it runs no query"""
+    queryset = getattr(instance, name).all()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    instance.__dict__.setdefault('_prefetched_objects_cache', {})[name] = queryset
+
+
+def group_by(objects, attname):
+    groups = defaultdict(list)
+    for obj in objects:
+        groups[getattr(obj, attname)].append(obj)
+    return groups
+
+
+def error_response(exc):
+    """Render an APIException the way DRF's exception handler does"""
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = JsonResponse(data, status=exc.status_code, safe=False)
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        response['WWW-Authenticate'] = CachedTokenAuthentication().authenticate_header(None)
+    return response
+
+
+def async_read_view(viewset_class, action):
+    """
+    Turn an async function of (view, **url kwargs) returning response data into an authenticated async Django view.
+    The view is an instance of viewset_class, configured as for the given action, for its filters and pagination.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        async def view_function(request, **kwargs):
+            view = viewset_class(action=action, args=(), kwargs=kwargs, format_kwarg=None, request=Request(request))
+            try:
+                credentials = await run_in_worker(CachedTokenAuthentication().authenticate, request)
+                if credentials is None:
+                    raise exceptions.NotAuthenticated()
+                view.request.user, view.request.auth = credentials
+                data = await function(view, **kwargs)
+            except Http404:
+                return error_response(exceptions.NotFound())
+            except exceptions.APIException as exc:
+                return error_response(exc)
+            return JsonResponse(data, safe=False)
+
+        return view_function
+
+    return decorator
+
+
+async def load_line_items(estates):
+    """Load the assets, expenses and disputes of the estates concurrently"""
+    ids = [estate.id for estate in estates]
+    line_items = await asyncio.gather(*[
+        run_in_worker(lambda model=model: list(model.objects.filter(estate_id__in=ids).order_by('id')))
+        for model in (Asset, Expense, Dispute)
+    ])
+    for name, items in zip(('asset_set', 'expense_set', 'dispute_set'), line_items):
+        by_estate = group_by(items, 'estate_id')
+        for estate in estates:
+            set_prefetched(estate, name, by_estate[estate.id])
+
+
+async def load_application_relations(applications, fields, expand, line_items=True):
+    """
+    Load the line items and users the representation of the applications reads, concurrently.
+    line_items=False leaves the line items to the fragment cache, which loads those of its misses only.
+    """
+    fields = fields or serializers.ApplicationSerializer.Meta.fields
+    user_fields = [name for name, wanted in (('created_by', 'created_by' in fields),
+                                             ('last_updated_by', 'last_modified_by' in fields),
+                                             ('user', 'user' in expand)) if wanted]
+    user_ids = {getattr(application, f'{name}_id') for application in applications for name in user_fields}
+    user_ids.discard(None)
+
+    queries = {}
+    estates = []
+    if 'estate' in fields and line_items:
+        # the estates were joined by application_queryset, only their line items are left to load
+        estates = [estate for estate in map(serializers.ApplicationSerializer.get_estate, applications)
+                   if estate is not None]
+        ids = [estate.id for estate in estates]
+        for name, model in (('asset_set', Asset), ('expense_set', Expense), ('dispute_set', Dispute)):
+            queries[name] = lambda model=model: list(model.objects.filter(estate_id__in=ids).order_by('id'))
+    if user_ids:
+        queries['users'] = lambda: User.objects.in_bulk(user_ids)
+    results = dict(zip(queries, await asyncio.gather(*[run_in_worker(query) for query in queries.values()])))
+
+    for name in ('asset_set', 'expense_set', 'dispute_set'):
+        if name in results:
+            by_estate = group_by(results[name], 'estate_id')
+            for estate in estates:
+                set_prefetched(estate, name, by_estate[estate.id])
+    users = results.get('users', {})
+    for application in applications:
+        for name in user_fields:
+            user = users.get(getattr(application, f'{name}_id'))
+            if user is not None:
+                setattr(application, name, user)
+
+
+def application_queryset(view, fields, expand):
+    # users are loaded by load_application_relations alongside the line items, the other expansions are joined
+    joined = [name for name in expand if name != 'user']
+    if 'estate' in (fields or serializers.ApplicationSerializer.Meta.fields):
+        joined.append('estate')
+    return view.filter_queryset(Application.objects.order_by('-id').select_related(*joined))
+
+
+@async_read_view(ApplicationViewSet, 'list')
+async def application_list(view):
+    """Async version of the application list, with the same filters, ordering, pagination and ?fields=/?expand="""
+    fields, expand = view.get_representation_options()
+    paginator = view.paginator
+    applications = await run_in_worker(paginator.paginate_queryset, application_queryset(view, fields, expand),
+                                       view.request, view)
+    await load_application_relations(applications, fields, expand, line_items=not view.cache_fragments)
+    serializer = serializers.ApplicationSerializer(applications, many=True, context=view.get_serializer_context())
+    data = await run_in_worker(lambda: serializer.data)
+    return paginator.get_paginated_response(data).data
+
+
+@async_read_view(ApplicationViewSet, 'retrieve')
+async def application_detail(view, pk):
+    """Async version of the application detail"""
+    fields, expand = view.get_representation_options()
+    application = await run_in_worker(lambda: application_queryset(view, fields, expand).filter(pk=pk).first())
+    if application is None:
+        raise Http404
+    await load_application_relations([application], fields, expand, line_items=not view.cache_fragments)
+    serializer = serializers.ApplicationDetailSerializer(application, context=view.get_serializer_context())
+    return await run_in_worker(lambda: serializer.data)
+
+
+@async_read_view(EstateViewSet, 'list')
+async def estate_list(view):
+    """Async version of the estate list"""
+    paginator = view.paginator
+    estates = await run_in_worker(paginator.paginate_queryset, Estate.objects.order_by('-id'), view.request, view)
+    await load_line_items(estates)
+    data = await run_in_worker(lambda: serializers.EstateSerializer(estates, many=True).data)
+    return paginator.get_paginated_response(data).data
+
+
+@async_read_view(EstateViewSet, 'retrieve')
+async def estate_detail(view, pk):
+    """Async version of the estate detail"""
+    estate = await run_in_worker(lambda: Estate.objects.filter(pk=pk).first())
+    if estate is None:
+        raise Http404
+    await load_line_items([estate])
+    return await run_in_worker(lambda: serializers.EstateSerializer(estate).data)
+
+
+@async_read_view(AgencyViewSet, 'list')
+async def agency_list(view):
+    """Async version of the agency list, with the solicitors of each agency"""
+    paginator = view.paginator
+    agencies = await run_in_worker(paginator.paginate_queryset, Agency.objects.order_by('name'), view.request, view)
+    ids = [agency.id for agency in agencies]
+    solicitors = await run_in_worker(lambda: list(Solicitor.objects.filter(agency_id__in=ids).order_by('id')))
+    by_agency = group_by(solicitors, 'agency_id')
+    for agency in agencies:
+        set_prefetched(agency, 'solicitors', by_agency[agency.id])
+    data = await run_in_worker(lambda: serializers.AgencySerializer(agencies, many=True).data)
+    return paginator.get_paginated_response(data).data
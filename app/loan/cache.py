@@ -0,0 +1,147 @@
+"""
+Response cache for list endpoints of rarely changing models, keyed on per-model version counters
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from rest_framework import status
+from rest_framework.response import Response
+
+from core import metrics
+from core.cache import invalidations_reach_every_worker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'TIMEOUT': 300,
+    # alias of the Django cache holding the versions and the responses, it has to be shared by the workers (the
+    # memcached of MEMCACHED_LOCATION) for the cache to be on under several gunicorn workers
+    'CACHE': 'default',
+}
+
+
+class ListResponseCache:
+    """
+    Cache of list response data keyed on the request URL and the version of every model the list reads.
+
+    Each model has a version counter in the cache, bumped by post_save/post_delete of its rows, so a write makes the
+    keys of every cached list that reads the model unreachable and they expire on their own. Writes that send no
+    signals, such as queryset.update() or bulk_create(), have to call bump() themselves.
+
+    A bump only reaches the workers sharing the cache, so from_settings() leaves the cache off when gunicorn runs
+    several workers on a process local cache.
+    """
+
+    def __init__(self, timeout=300, cache='default', enabled=True):
+        self.enabled = enabled
+        self.timeout = timeout
+        self.cache_alias = cache
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULT_SETTINGS, **getattr(settings, 'LIST_RESPONSE_CACHE', {})}
+        enabled = invalidations_reach_every_worker(options['CACHE'])
+        if not enabled:
+            logger.warning('List response cache disabled: several workers and the %s cache is local to each of '
+                           'them, a write would not reach the lists cached by the other workers.', options['CACHE'])
+        return cls(timeout=options['TIMEOUT'], cache=options['CACHE'], enabled=enabled)
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def register(self, model):
+        uid = f'list-response-cache-{model._meta.label}'
+        post_save.connect(self._invalidate, sender=model, weak=False, dispatch_uid=uid)
+        post_delete.connect(self._invalidate, sender=model, weak=False, dispatch_uid=uid)
+
+    def key(self, name, models, request):
+        """Return the cache key of a list response, name tells the views apart"""
+        versions = '.'.join(str(self.version(model)) for model in models)
+        return f'list-response:{name}:{versions}:{request.build_absolute_uri()}'
+
+    def get(self, name, key):
+        """Return the cached response data of the key, or None"""
+        data = self.cache.get(key)
+        if data is None:
+            self.misses += 1
+            metrics.list_cache_lookups.labels(name, 'miss').inc()
+        else:
+            self.hits += 1
+            metrics.list_cache_lookups.labels(name, 'hit').inc()
+        return data
+
+    def set(self, key, data):
+        self.cache.set(key, data, self.timeout)
+
+    def version(self, model):
+        version = self.cache.get(self._version_key(model))
+        if version is None:
+            # started from the clock, so a counter that was evicted does not come back to a version already used
+            self.cache.add(self._version_key(model), time.time_ns(), None)
+            version = self.cache.get(self._version_key(model))
+        return version
+
+    def bump(self, model):
+        try:
+            self.cache.incr(self._version_key(model))
+        except ValueError:
+            self.cache.add(self._version_key(model), time.time_ns(), None)
+
+    def clear(self):
+        # the whole Django cache it uses, for tests
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _invalidate(self, sender, **kwargs):
+        self.bump(sender)
+        # bumped again once the write is committed, a list cached by another request while it was not yet
+        # visible holds the old rows under the first bumped version
+        transaction.on_commit(lambda: self.bump(sender))
+
+    @staticmethod
+    def _version_key(model):
+        return f'list-response-version:{model._meta.label}'
+
+
+list_cache = ListResponseCache.from_settings()
+
+
+class CachedListMixin:
+    """
+    ViewSet mixin serving list() from list_cache. list_cache_models are the models the list reads, each of them
+    has to be registered with list_cache. A hit skips the database and the serializer.
+    """
+    list_cache_models = ()
+
+    def list(self, request, *args, **kwargs):
+        if not list_cache.enabled:
+            return super().list(request, *args, **kwargs)
+        name = self.basename
+        key = list_cache.key(name, self.list_cache_models, request)
+        data = list_cache.get(name, key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            list_cache.set(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,87 @@
+"""
+Streaming export of applications with their estate totals, as CSV or JSON lines.
+
+Rows are read through a server-side cursor CHUNK_SIZE at a time and rendered as they arrive, so a worker holds one
+chunk whatever the size of the export.
+"""
+import csv
+import io
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from rest_framework import renderers
+
+CHUNK_SIZE = 2000
+
+# exported column and the lookup it is read from, the annotations come from filters.EstateTotalsFilter
+COLUMNS = (
+    ('id', 'id'),
+    ('date_submitted', 'date_submitted'),
+    ('amount', 'amount'),
+    ('term', 'term'),
+    ('application_status', 'application_status_id'),
+    ('application_status_name', 'application_status__name'),
+    ('agency', 'agency_id'),
+    ('agency_name', 'agency__name'),
+    ('lead_solicitor', 'lead_solicitor_id'),
+    ('user', 'user_id'),
+    ('estate_total_assets', 'estate_total_assets'),
+    ('estate_total_expenses', 'estate_total_expenses'),
+    ('estate_net_value', 'estate_net_value'),
+    ('estate_surplus', 'estate_surplus'),
+)
+
+
+class CSVRenderer(renderers.BaseRenderer):
+    """Selects CSV for ?format=csv or Accept: text/csv, the rows themselves are streamed by stream_csv()"""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+
+class JSONLinesRenderer(renderers.BaseRenderer):
+    """Selects JSON lines for ?format=jsonl or Accept: application/x-ndjson, see stream_jsonl()"""
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+    charset = 'utf-8'
+
+
+def read_rows(queryset, chunk_size=CHUNK_SIZE):
+    """Yield the exported columns of each row of the queryset, fetched chunk_size rows at a time"""
+    # inside a transaction postgres produces the rows as they are fetched, a cursor held across commits
+    # would have the whole result materialized on the server first
+    with transaction.atomic():
+        yield from queryset.values_list(*(lookup for name, lookup in COLUMNS)).iterator(chunk_size=chunk_size)
+
+
+def stream_csv(rows, chunk_size=CHUNK_SIZE):
+    """Yield the rows as CSV with a header line, in blocks of chunk_size rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, lookup in COLUMNS])
+    for number, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if number % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_jsonl(rows, chunk_size=CHUNK_SIZE):
+    """Yield the rows as JSON objects, one per line, in blocks of chunk_size rows"""
+    names = [name for name, lookup in COLUMNS]
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + '\n')
+        if len(lines) == chunk_size:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+
+STREAMS = {
+    CSVRenderer.format: stream_csv,
+    JSONLinesRenderer.format: stream_jsonl,
+}
@@ -0,0 +1,237 @@
+"""
+Related fields for loan APIs that validate ids without one query per field
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Mapping
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet, ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.utils.functional import cached_property
+from rest_framework import serializers
+
+from core.cache import invalidations_reach_every_worker
+
+logger = logging.getLogger(__name__)
+
+RESOLVED_INSTANCES = '_resolved_related_instances'
+
+DEFAULT_REFERENCE_CACHE_SETTINGS = {
+    # alias of the Django cache holding the table versions, it has to be shared by the workers (the memcached of
+    # MEMCACHED_LOCATION) for the cache to be on under several gunicorn workers
+    'CACHE': 'default',
+    'MISS_TIMEOUT': 5,
+    'VERSION_CHECK_INTERVAL': 1,
+}
+
+
+class ReferenceCache:
+    """
+    In-process copy of small reference tables, loaded whole on first use.
+
+    Every table has a version counter in a Django cache shared by the workers, bumped by post_save/post_delete, and
+    a copy older than the counter is loaded again. The counter is read at most every VERSION_CHECK_INTERVAL seconds,
+    so rows written or deleted by another process are seen within that time. An id missing from a freshly loaded
+    table is remembered as missing for MISS_TIMEOUT seconds, so unknown ids do not reload the table every time.
+    """
+
+    def __init__(self, cache='default', miss_timeout=5, version_check_interval=1, enabled=True):
+        self.enabled = enabled
+        self.cache_alias = cache
+        self.miss_timeout = miss_timeout
+        self.version_check_interval = version_check_interval
+        # model: (version, {pk: instance})
+        self._tables = {}
+        # model: {pk: monotonic time the miss expires}
+        self._misses = {}
+        # model: (version, monotonic time it was read)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULT_REFERENCE_CACHE_SETTINGS, **getattr(settings, 'REFERENCE_CACHE', {})}
+        enabled = invalidations_reach_every_worker(options['CACHE'])
+        if not enabled:
+            logger.warning('Reference cache disabled: several workers and the %s cache is local to each of them, '
+                           'a write would not reach the tables copied by the other workers.', options['CACHE'])
+        return cls(cache=options['CACHE'], miss_timeout=options['MISS_TIMEOUT'],
+                   version_check_interval=options['VERSION_CHECK_INTERVAL'], enabled=enabled)
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def register(self, model):
+        post_save.connect(self._invalidate, sender=model, weak=False, dispatch_uid=f'reference-cache-{model.__name__}')
+        post_delete.connect(self._invalidate, sender=model, weak=False,
+                            dispatch_uid=f'reference-cache-{model.__name__}')
+
+    def get(self, model, pk):
+        """Return the row with the given pk, or None when the table does not have it"""
+        if not self.enabled:
+            return model._default_manager.filter(pk=pk).first()
+        version = self.version(model)
+        loaded_version, table = self._tables.get(model, (None, None))
+        if loaded_version != version:
+            table = self.load(model, version)
+        elif pk not in table:
+            if self._misses.get(model, {}).get(pk, 0) > time.monotonic():
+                return None
+            table = self.load(model, version)
+        if pk not in table:
+            with self._lock:
+                self._misses.setdefault(model, {})[pk] = time.monotonic() + self.miss_timeout
+        return table.get(pk)
+
+    def load(self, model, version=None):
+        if version is None:
+            version = self.version(model)
+        table = {instance.pk: instance for instance in model._default_manager.all()}
+        with self._lock:
+            self._tables[model] = (version, table)
+            self._misses.pop(model, None)
+        return table
+
+    def version(self, model):
+        """Return the shared version of the table, read again once version_check_interval has passed"""
+        now = time.monotonic()
+        version, read_at = self._versions.get(model, (None, None))
+        if read_at is not None and now - read_at < self.version_check_interval:
+            return version
+        key = self._version_key(model)
+        version = self.cache.get(key)
+        if version is None:
+            # started from the clock, so a counter that was evicted does not come back to a version already used
+            self.cache.add(key, time.time_ns(), None)
+            version = self.cache.get(key)
+        with self._lock:
+            self._versions[model] = (version, now)
+        return version
+
+    def bump(self, model):
+        try:
+            self.cache.incr(self._version_key(model))
+        except ValueError:
+            self.cache.add(self._version_key(model), time.time_ns(), None)
+        with self._lock:
+            self._tables.pop(model, None)
+            self._misses.pop(model, None)
+            self._versions.pop(model, None)
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self._misses.clear()
+            self._versions.clear()
+
+    def _invalidate(self, sender, **kwargs):
+        self.bump(sender)
+        # bumped again once the write is committed, a table loaded by another request while it was not yet
+        # visible holds the old rows under the first bumped version
+        transaction.on_commit(lambda: self.bump(sender))
+
+    @staticmethod
+    def _version_key(model):
+        return f'reference-cache-version:{model._meta.label}'
+
+
+reference_cache = ReferenceCache.from_settings()
+
+
+class BatchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField that takes its instance from those the parent serializer loaded for the whole payload.
+    With reference=True the id is looked up in reference_cache instead of the database.
+    """
+
+    def __init__(self, **kwargs):
+        self.reference = kwargs.pop('reference', False)
+        super().__init__(**kwargs)
+
+    @cached_property
+    def resolved_key(self):
+        """Fields reading the same queryset share their resolved instances and are loaded with one query"""
+        queryset = self.get_queryset()
+        try:
+            return queryset.model._meta.label, str(queryset.query)
+        except EmptyResultSet:
+            return queryset.model._meta.label, self.field_name
+
+    def to_pk(self, data):
+        """Return the data as a primary key value of the related model"""
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return self.get_queryset().model._meta.pk.to_python(data)
+        except (DjangoValidationError, TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+    def to_internal_value(self, data):
+        model = self.get_queryset().model
+        if self.reference:
+            instance = reference_cache.get(model, self.to_pk(data))
+            if instance is None:
+                self.fail('does_not_exist', pk_value=data)
+            return instance
+
+        resolved = self.context.get(RESOLVED_INSTANCES, {}).get(self.resolved_key)
+        if resolved is None:
+            return super().to_internal_value(data)
+        pk = self.to_pk(data)
+        if pk not in resolved:
+            self.fail('does_not_exist', pk_value=data)
+        return resolved[pk]
+
+
+class BatchedRelatedListSerializer(serializers.ListSerializer):
+    """List serializer that resolves the related ids of every item before validating them one by one"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.child.resolve_related(data)
+        return super().to_internal_value(data)
+
+
+class BatchedRelatedFieldsMixin:
+    """
+    Serializer mixin that loads the instances of every BatchedPrimaryKeyRelatedField in the payload
+    with one query per related queryset, instead of one query per field per item.
+    Set Meta.list_serializer_class = BatchedRelatedListSerializer to batch a whole list payload.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, Mapping):
+            self.resolve_related([data])
+        return super().to_internal_value(data)
+
+    def resolve_related(self, items):
+        """Load the related instances referenced by the given payload items that are not loaded yet"""
+        resolved = self.context.setdefault(RESOLVED_INSTANCES, {})
+        wanted = defaultdict(set)
+        fields = [field for field in self.fields.values()
+                  if isinstance(field, BatchedPrimaryKeyRelatedField) and not field.read_only and not field.reference]
+
+        for field in fields:
+            loaded = resolved.setdefault(field.resolved_key, {})
+            for item in items:
+                if not isinstance(item, Mapping) or item.get(field.field_name) in (None, ''):
+                    continue
+                try:
+                    pk = field.to_pk(item[field.field_name])
+                except serializers.ValidationError:
+                    # reported by the field itself during validation
+                    continue
+                if pk not in loaded:
+                    wanted[field.resolved_key].add(pk)
+
+        querysets = {field.resolved_key: field.get_queryset() for field in fields}
+        for key, pks in wanted.items():
+            resolved[key].update((instance.pk, instance) for instance in querysets[key].filter(pk__in=pks))
@@ -0,0 +1,145 @@
+"""
+Filters for loan APIs
+"""
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from django.db.models import Value, F, DecimalField
+from django.db.models.functions import Coalesce
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+from core.models import Application
+
+
+def parse(field, name, value):
+    """Validate a query parameter with a serializer field, reporting errors under the parameter name"""
+    try:
+        return field.run_validation(value)
+    except serializers.ValidationError as e:
+        raise serializers.ValidationError({name: e.detail})
+
+
+def annotate_estate_totals(queryset):
+    """Annotate applications with the stored totals of their estate, zero when there is none"""
+    zero = Value(Decimal('0.00'), output_field=DecimalField(max_digits=14, decimal_places=2))
+    # an application has at most one estate, its totals are read through a left join
+    return queryset.annotate(
+        estate_total_assets=Coalesce(F('estate__total_assets'), zero),
+        estate_total_expenses=Coalesce(F('estate__total_expenses'), zero),
+        estate_net_value=Coalesce(F('estate__net_value'), zero),
+    ).annotate(estate_surplus=F('estate_net_value') - F('amount'))
+
+
+class ApplicationFilter(BaseFilterBackend):
+    """
+    Filter applications on their indexed columns.
+
+    ?application_status=, ?agency=, ?lead_solicitor=, ?user= and ?created_by= take one id or a comma separated list,
+    ?date_submitted_after= / ?date_submitted_before= and ?amount_min= / ?amount_max= bound a range.
+    """
+    related_filters = ('application_status', 'agency', 'lead_solicitor', 'user', 'created_by')
+    id_field = serializers.IntegerField(min_value=1)
+    date_field = serializers.DateTimeField()
+    amount_field = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        filters = {}
+
+        for name in self.related_filters:
+            if name in params:
+                ids = [parse(self.id_field, name, value) for value in params[name].split(',')]
+                filters[f'{name}_id__in'] = ids
+        for name, lookup in (('date_submitted_after', 'date_submitted__gte'),
+                             ('date_submitted_before', 'date_submitted__lt')):
+            if name in params:
+                filters[lookup] = parse(self.date_field, name, params[name])
+        for name, lookup in (('amount_min', 'amount__gte'), ('amount_max', 'amount__lte')):
+            if name in params:
+                filters[lookup] = parse(self.amount_field, name, params[name])
+
+        return queryset.filter(**filters)
+
+
+class EstateTotalsFilter(BaseFilterBackend):
+    """
+    Filter applications on the stored totals of their estate.
+
+    ?net_value_min= / ?net_value_max= bound the estate net value,
+    ?covers_amount=true|false keeps applications whose estate net value does or does not cover the amount.
+    The totals are joined in only for these parameters or an ?ordering= on them.
+    """
+    totals_params = {'net_value_min', 'net_value_max', 'covers_amount'}
+    totals_fields = {'estate_total_assets', 'estate_total_expenses', 'estate_net_value', 'estate_surplus'}
+    amount_field = serializers.DecimalField(max_digits=14, decimal_places=2)
+    boolean_field = serializers.BooleanField()
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        ordering = {name.strip().lstrip('-') for name in params.get(OrderingFilter.ordering_param, '').split(',')}
+        if not (self.totals_params & params.keys() or self.totals_fields & ordering):
+            return queryset
+        if 'estate_net_value' not in queryset.query.annotations:
+            queryset = annotate_estate_totals(queryset)
+
+        if 'net_value_min' in params:
+            queryset = queryset.filter(estate_net_value__gte=parse(self.amount_field, 'net_value_min',
+                                                                   params['net_value_min']))
+        if 'net_value_max' in params:
+            queryset = queryset.filter(estate_net_value__lte=parse(self.amount_field, 'net_value_max',
+                                                                   params['net_value_max']))
+        if 'covers_amount' in params:
+            if parse(self.boolean_field, 'covers_amount', params['covers_amount']):
+                queryset = queryset.filter(estate_surplus__gte=0)
+            else:
+                queryset = queryset.filter(estate_surplus__lt=0)
+        return queryset
+
+
+class StableOrderingFilter(OrderingFilter):
+    """Ordering filter that always ends with the primary key, so rows with equal values keep a fixed order"""
+
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view) or [])
+        if not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering.append('-id')
+        return ordering
+
+
+class PortfolioSummaryFilter(BaseFilterBackend):
+    """
+    Filter portfolio summary rows, or the applications when the report is read from them.
+
+    ?application_status=, ?agency= and ?user= take one id or a comma separated list,
+    ?month_from= / ?month_to= bound the month submitted as YYYY-MM, both inclusive.
+    """
+    key_filters = {'application_status': 'status_key', 'agency': 'agency_key', 'user': 'user_key'}
+    id_field = serializers.IntegerField(min_value=0)
+    month_field = serializers.DateField(input_formats=['%Y-%m'])
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        filters = {}
+        # the applications are filtered on their own columns, which the indexes cover
+        on_applications = queryset.model is Application
+
+        for name, column in self.key_filters.items():
+            if name in params:
+                ids = [parse(self.id_field, name, value) for value in params[name].split(',')]
+                filters[f'{name}_id__in' if on_applications else f'{column}__in'] = ids
+        if 'month_from' in params:
+            month = parse(self.month_field, 'month_from', params['month_from'])
+            if on_applications:
+                filters['date_submitted__gte'] = datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+            else:
+                filters['month__gte'] = month
+        if 'month_to' in params:
+            month = parse(self.month_field, 'month_to', params['month_to'])
+            if on_applications:
+                filters['date_submitted__lt'] = datetime(month.year + month.month // 12, month.month % 12 + 1, 1,
+                                                         tzinfo=timezone.utc)
+            else:
+                filters['month__lte'] = month
+
+        return queryset.filter(**filters)
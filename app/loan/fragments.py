@@ -0,0 +1,170 @@
+"""
+Cache of the serialized representation of single rows, Russian doll style.
+
+The key of a fragment holds the version of its row and of every row nested in it. A line item write bumps the
+version of its estate, which gives the estate fragment a new key and so the fragment of its application too, while
+the other applications of a list keep theirs. Stale fragments are never invalidated, they are no longer asked for
+and expire. Versions are bumped by database triggers, see core migration 0029.
+"""
+import hashlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Manager
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+
+from core import metrics
+from loan.fields import BatchedRelatedListSerializer
+
+# serializer context flag that turns the cache on, set by the read actions of the views
+CACHE_FRAGMENTS = 'cache_fragments'
+# serializer context entry of the fragments looked up for the instances being serialized, None for a miss
+FRAGMENTS = '_cached_fragments'
+
+DEFAULT_SETTINGS = {
+    'ENABLED': True,
+    'TIMEOUT': 24 * 60 * 60,
+    # alias of the Django cache holding the fragments
+    'CACHE': 'default',
+}
+
+
+class FragmentCache:
+    """Serialized fragments in a Django cache, with hit and miss counts by kind of fragment"""
+
+    def __init__(self, timeout=24 * 60 * 60, cache='default', enabled=True):
+        self.timeout = timeout
+        self.cache_alias = cache
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULT_SETTINGS, **getattr(settings, 'FRAGMENT_CACHE', {})}
+        return cls(timeout=options['TIMEOUT'], cache=options['CACHE'], enabled=options['ENABLED'])
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get_many(self, kind, keys):
+        """Return {key: fragment} of the keys found, in one round trip"""
+        found = self.cache.get_many(keys) if keys else {}
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        if found:
+            metrics.fragment_cache_lookups.labels(kind, 'hit').inc(len(found))
+        if len(keys) > len(found):
+            metrics.fragment_cache_lookups.labels(kind, 'miss').inc(len(keys) - len(found))
+        return found
+
+    def set(self, key, fragment):
+        self.cache.set(key, fragment, self.timeout)
+
+    def clear(self):
+        # the whole Django cache it uses, for tests
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+fragment_cache = FragmentCache.from_settings()
+
+
+class CachedFragmentMixin:
+    """
+    Serializer mixin serving the representation of each instance from fragment_cache when the context has
+    CACHE_FRAGMENTS set.
+
+    fragment_version() has to change whenever the representation does. Fields in uncached_fields read rows that no
+    version covers, they are left out of the fragment and rendered on every request. load_related() loads what a
+    fresh representation reads, and is only called for the misses.
+    """
+    fragment_kind = None
+    uncached_fields = ()
+
+    def fragment_version(self, instance):
+        raise NotImplementedError
+
+    def load_related(self, instances):
+        pass
+
+    def fragment_key(self, instance):
+        return f'fragment:{self.fragment_kind}:{self.fragment_version(instance)}:{self.fields_signature}'
+
+    @property
+    def fields_signature(self):
+        """Short digest of the fields rendered, ?fields= gives a fragment of its own"""
+        if not hasattr(self, '_fields_signature'):
+            names = ','.join(field.field_name for field in self._readable_fields)
+            self._fields_signature = hashlib.md5(names.encode()).hexdigest()[:12]
+        return self._fields_signature
+
+    def load_fragments(self, instances):
+        """Look up the fragments of the instances in one round trip, and load the related rows of the misses"""
+        fragments = self.context.setdefault(FRAGMENTS, {})
+        wanted = OrderedDict()
+        for instance in instances:
+            key = self.fragment_key(instance)
+            if key not in fragments:
+                wanted[key] = instance
+        found = fragment_cache.get_many(self.fragment_kind, list(wanted))
+        for key in wanted:
+            fragments[key] = found.get(key)
+        self.load_related([instance for key, instance in wanted.items() if key not in found])
+
+    def to_representation(self, instance):
+        if not self.context.get(CACHE_FRAGMENTS):
+            return super().to_representation(instance)
+
+        key = self.fragment_key(instance)
+        fragments = self.context.setdefault(FRAGMENTS, {})
+        if key not in fragments:
+            self.load_fragments([instance])
+        fragment = fragments[key]
+        if fragment is not None:
+            return self.from_fragment(instance, fragment)
+
+        representation = super().to_representation(instance)
+        fragment = OrderedDict((name, value) for name, value in representation.items()
+                               if name not in self.uncached_fields)
+        fragment_cache.set(key, fragment)
+        fragments[key] = fragment
+        return representation
+
+    def from_fragment(self, instance, fragment):
+        """Return the representation of the instance from its fragment and its uncached fields"""
+        representation = OrderedDict()
+        for field in self._readable_fields:
+            if field.field_name in fragment:
+                representation[field.field_name] = fragment[field.field_name]
+                continue
+            # rendered the way Serializer.to_representation() does
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                continue
+            check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            representation[field.field_name] = None if check_for_none is None else field.to_representation(attribute)
+        return representation
+
+
+class CachedFragmentListSerializer(BatchedRelatedListSerializer):
+    """List serializer looking up the fragments of a whole page at once, before any of them is rendered"""
+
+    def to_representation(self, data):
+        if self.child.context.get(CACHE_FRAGMENTS):
+            data = list(data.all() if isinstance(data, Manager) else data)
+            self.child.load_fragments(data)
+        return super().to_representation(data)
@@ -0,0 +1,271 @@
+"""
+Streaming import of applications and estates from CSV or JSON lines.
+
+Records are parsed lazily from an iterable of lines and handled CHUNK_SIZE at a time: the related ids of a chunk are
+resolved with one query per field, each record is validated by the API's own serializer, and the valid ones are
+bulk inserted in one transaction per chunk, so memory stays flat whatever the size of the input.
+Invalid records are reported by their number and skipped. After each chunk a progress report gives the number of
+records handled so far, an import stopped part way is resumed by skipping that many.
+"""
+import codecs
+import csv
+import json
+import logging
+from collections import defaultdict
+from itertools import chain, groupby, islice
+
+from rest_framework import serializers as drf_serializers
+
+from core import audit
+from core.models import Application, Estate, Asset, Expense, Dispute, PortfolioSummary, portfolio_keys
+from loan import serializers
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+
+CSV, JSONL = 'csv', 'jsonl'
+FORMATS = {
+    'text/csv': CSV,
+    'application/x-ndjson': JSONL,
+    'application/jsonl': JSONL,
+}
+
+# columns of an estate CSV, one row per line item, consecutive rows with the same application make one estate
+LINE_ITEM_COLUMNS = ('item_type', 'section', 'title', 'description', 'value')
+LINE_ITEM_SETS = {'asset': 'asset_set', 'expense': 'expense_set', 'dispute': 'dispute_set'}
+
+
+def decode_lines(lines, encoding='utf-8-sig'):
+    """Decode an iterable of byte lines, such as a request or a file opened in binary mode"""
+    return codecs.iterdecode(lines, encoding)
+
+
+def parse_jsonl(lines):
+    """Yield (payload, errors) for each non blank line of JSON, errors is None when the line parsed"""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line), None
+        except ValueError as exc:
+            yield None, {'non_field_errors': [f'Invalid JSON: {exc}']}
+
+
+def parse_csv(lines):
+    """Yield (payload, None) for each row of a CSV with a header, empty cells are left out of the payload"""
+    for row in csv.DictReader(lines):
+        yield {column: value for column, value in row.items() if column and value not in ('', None)}, None
+
+
+def read_header(lines):
+    """Return the columns of the first non blank CSV line, None for an empty input, and the lines with it put back"""
+    lines = iter(lines)
+    for line in lines:
+        if line.strip():
+            return next(csv.reader([line])), chain([line], lines)
+    return None, lines
+
+
+def report_lines(reports, committed=0):
+    """
+    Yield the reports of Importer.run() as JSON lines. An import stopped part way ends with a line
+    {'error': message, 'committed': rows}, the rows committed before it to resume from.
+    """
+    try:
+        for report in reports:
+            committed = report.get('committed', committed)
+            yield json.dumps(report) + '\n'
+    except (UnicodeDecodeError, csv.Error) as exc:
+        yield json.dumps({'error': f'Unreadable input: {exc}', 'committed': committed}) + '\n'
+    except Exception:
+        logger.exception('Import stopped after %s records', committed)
+        yield json.dumps({'error': 'Import stopped by a server error', 'committed': committed}) + '\n'
+
+
+def group_estate_rows(records):
+    """Turn line item rows of an estate CSV into estate payloads, one for each run of rows with the same application"""
+    for application, rows in groupby(records, key=lambda record: record[0].get('application')):
+        estate = {'application': application, 'asset_set': [], 'expense_set': [], 'dispute_set': []}
+        errors = []
+        for row, _ in rows:
+            item_type = row.get('item_type')
+            if item_type is None:
+                # a row without an item type only names the application, for an estate without line items
+                continue
+            if item_type not in LINE_ITEM_SETS:
+                errors.append(f'Unknown item_type: {item_type}')
+                continue
+            estate[LINE_ITEM_SETS[item_type]].append(
+                {column: row[column] for column in LINE_ITEM_COLUMNS[1:] if column in row})
+        yield estate, {'non_field_errors': errors} if errors else None
+
+
+def application_keys(application):
+    return portfolio_keys(application.application_status_id, application.agency_id, application.user_id,
+                          application.date_submitted)
+
+
+class Importer:
+    """Validates and writes the records of one import, a chunk at a time"""
+    serializer_class = None
+
+    def __init__(self, user=None, chunk_size=CHUNK_SIZE):
+        self.user = user
+        self.chunk_size = chunk_size
+
+    def parse(self, lines, file_format):
+        """Return the (payload, errors) records of the decoded lines"""
+        if file_format == CSV:
+            return parse_csv(lines)
+        if file_format == JSONL:
+            return parse_jsonl(lines)
+        raise ValueError(f'Unknown format: {file_format}')
+
+    def columns(self):
+        """Return the columns a CSV may have and those it must have"""
+        fields = self.serializer_class().fields
+        return ({name for name, field in fields.items() if not field.read_only},
+                [name for name, field in fields.items() if field.required and not field.read_only])
+
+    def check_header(self, lines, file_format):
+        """
+        Return the lines after checking the header of a CSV, before any record is imported.
+        Raises ValidationError for a CSV without a header row or with unknown or missing columns.
+        """
+        if file_format != CSV:
+            return lines
+        try:
+            header, lines = read_header(lines)
+        except (UnicodeDecodeError, csv.Error) as exc:
+            raise drf_serializers.ValidationError({'header': [f'Unreadable header row: {exc}']})
+        if header is None:
+            raise drf_serializers.ValidationError({'header': ['A header row naming the columns is required.']})
+        known, required = self.columns()
+        errors = [f'Unknown column: {column}' for column in header if column not in known]
+        errors += [f'Missing column: {column}' for column in required if column not in header]
+        if errors:
+            raise drf_serializers.ValidationError({'header': errors})
+        return lines
+
+    def run(self, records, skip=0):
+        """
+        Import the records after the first skip of them.
+        Yields {'row': number, 'errors': ...} for each invalid record, numbered from 1,
+        and {'committed': rows, 'created': count, 'failed': count} once each chunk is committed.
+        """
+        records = enumerate(islice(records, skip, None), start=skip + 1)
+        committed = skip
+        while True:
+            chunk = list(islice(records, self.chunk_size))
+            if not chunk:
+                break
+            valid, failed = self.validate(chunk)
+            yield from failed
+            if valid:
+                with audit.buffered_audit():
+                    self.create(valid)
+            committed = chunk[-1][0]
+            yield {'committed': committed, 'created': len(valid), 'failed': len(failed)}
+
+    def validate(self, chunk):
+        """Return the validated data of the valid records and the error reports of the others"""
+        serializer = self.serializer_class(context={})
+        serializer.resolve_related([payload for number, (payload, errors) in chunk if errors is None])
+        valid, failed = [], []
+        for number, (payload, errors) in chunk:
+            if errors is None:
+                try:
+                    valid.append(self.validate_record(serializer.run_validation(payload)))
+                    continue
+                except drf_serializers.ValidationError as exc:
+                    errors = exc.detail
+            failed.append({'row': number, 'errors': errors})
+        return valid, failed
+
+    def validate_record(self, data):
+        """Check the validated data of a record against the others of its chunk, raise ValidationError to refuse it"""
+        return data
+
+    def create(self, validated):
+        raise NotImplementedError
+
+
+class ApplicationImporter(Importer):
+    """Imports applications, one record per application in the ApplicationSerializer payload shape"""
+    serializer_class = serializers.ApplicationSerializer
+
+    def create(self, validated):
+        applications = Application.objects.bulk_create(
+            [Application(created_by=self.user, last_updated_by=self.user, **data) for data in validated],
+            batch_size=audit.BULK_BATCH_SIZE)
+
+        # bulk inserts send no post_save, the portfolio summary is moved by the whole chunk at once instead
+        changes = defaultdict(lambda: (0, 0, 0, 0))
+        for application in applications:
+            keys = application_keys(application)
+            count, amount, term, estate_value = changes[keys]
+            changes[keys] = (count + 1, amount + application.amount, term + application.term, estate_value)
+        PortfolioSummary.objects.add_many(changes)
+        return applications
+
+
+class EstateImporter(Importer):
+    """
+    Imports estates with their line items, in the EstateSerializer payload shape.
+    In a CSV each row is one line item of the estate of its application, see group_estate_rows().
+    """
+    serializer_class = serializers.EstateSerializer
+
+    def parse(self, lines, file_format):
+        records = super().parse(lines, file_format)
+        return group_estate_rows(records) if file_format == CSV else records
+
+    def columns(self):
+        return {'application', *LINE_ITEM_COLUMNS}, ['application']
+
+    def validate(self, chunk):
+        self.applications = set()
+        return super().validate(chunk)
+
+    def validate_record(self, data):
+        # the serializer refuses applications that have an estate already, not those of an earlier record of the chunk
+        application = data.get('application')
+        if application is not None:
+            if application.pk in self.applications:
+                raise drf_serializers.ValidationError({'application': ['This application already has an estate.']})
+            self.applications.add(application.pk)
+        return data
+
+    def create(self, validated):
+        estates = []
+        line_items = {Asset: [], Expense: [], Dispute: []}
+        for data in validated:
+            estate = Estate(application=data.get('application'))
+            items = {model: [model(estate=estate, **item) for item in data[name]]
+                     for model, name in ((Asset, 'asset_set'), (Expense, 'expense_set'), (Dispute, 'dispute_set'))}
+            # line items are bulk inserted without signals, so the totals are set up front
+            estate.count_line_items(items[Asset], items[Expense], items[Dispute])
+            estates.append(estate)
+            for model, model_items in items.items():
+                line_items[model] += model_items
+
+        Estate.objects.bulk_create(estates, batch_size=audit.BULK_BATCH_SIZE)
+        created = list(estates)
+        for model, items in line_items.items():
+            created += model.objects.bulk_create(items, batch_size=audit.BULK_BATCH_SIZE)
+
+        estate_values = defaultdict(int)
+        for estate in estates:
+            if estate.application is not None and estate.net_value:
+                estate_values[application_keys(estate.application)] += estate.net_value
+        PortfolioSummary.objects.add_many({keys: (0, 0, 0, value) for keys, value in estate_values.items()})
+
+        audit.log_bulk_create(created)
+        return estates
+
+
+IMPORTERS = {
+    'applications': ApplicationImporter,
+    'estates': EstateImporter,
+}
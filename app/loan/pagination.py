@@ -0,0 +1,69 @@
+"""
+Pagination for loan APIs
+"""
+from collections import OrderedDict
+
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class LoanCursorPagination(CursorPagination):
+    """
+    Keyset pagination, the cost of a page does not depend on how deep it is.
+    The cursor holds the value of the first ordering field only, the rows sharing it with the last row of the
+    previous page are stepped over by an offset.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = '-id'
+
+
+class ApplicationPagination(LoanCursorPagination):
+    pass
+
+
+class EstatePagination(LoanCursorPagination):
+    pass
+
+
+class SolicitorPagination(LoanCursorPagination):
+    # pages start after a last name, the id only fixes the order of solicitors sharing one
+    ordering = ('last_name', 'id')
+
+
+class AgencyPagination(LoanCursorPagination):
+    # pages start after a name, the id only fixes the order of agencies sharing one
+    ordering = ('name', 'id')
+
+
+class SearchPagination(LimitOffsetPagination):
+    """
+    Offset pagination for ranked search results, which have no key to page on.
+    It looks one row ahead instead of counting every match.
+    """
+    default_limit = 50
+    max_limit = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.offset = self.get_offset(request)
+        rows = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(rows) > self.limit
+        return rows[:self.limit]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
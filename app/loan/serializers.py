@@ -1,8 +1,16 @@
 """
 Serializers for loan APIs
 """
+import copy
+from collections import Counter
+
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
+from core import audit
+from core.db import delete_rows
+from loan.fields import BatchedPrimaryKeyRelatedField, BatchedRelatedFieldsMixin, BatchedRelatedListSerializer
+from loan.fragments import CachedFragmentMixin, CachedFragmentListSerializer
 from core.models import (Solicitor,
                          Agency,
                          ApplicationStatus,
@@ -11,8 +19,9 @@ from core.models import (Solicitor,
                          Estate,
                          Asset,
                          Expense,
-                         Dispute)
-from user.serializers import UserSerializer
+                         Dispute,
+                         PortfolioSummary)
+from user.serializers import UserListSerializer
 
 
 class AgencyNameSerializer(serializers.ModelSerializer):
@@ -21,13 +30,14 @@ class AgencyNameSerializer(serializers.ModelSerializer):
         fields = ['name']
 
 
-class SolicitorSerializer(serializers.ModelSerializer):
-    agency = serializers.PrimaryKeyRelatedField(queryset=Agency.objects.all())
+class SolicitorSerializer(BatchedRelatedFieldsMixin, serializers.ModelSerializer):
+    agency = BatchedPrimaryKeyRelatedField(queryset=Agency.objects.all())
 
     class Meta:
         model = Solicitor
         fields = '__all__'
         read_only_fields = ('id',)
+        list_serializer_class = BatchedRelatedListSerializer
 
 
 class ApplicationStatusSerializer(serializers.ModelSerializer):
@@ -46,70 +56,260 @@ class AgencySerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class AgencySummarySerializer(serializers.ModelSerializer):
+    """Agency without its solicitors, used when an agency is expanded inside another object"""
+
+    class Meta:
+        model = Agency
+        fields = '__all__'
+        read_only_fields = ('id',)
+
+
 class AssetSerializer(serializers.ModelSerializer):
     class Meta:
         model = Asset
-        fields = '__all__'
+        exclude = ('search_vector',)
         read_only_fields = ('id', 'estate')
 
 
 class ExpensesSerializer(serializers.ModelSerializer):
     class Meta:
         model = Expense
-        fields = '__all__'
+        exclude = ('search_vector',)
         read_only_fields = ('id', 'estate')
 
 
 class DisputeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Dispute
-        fields = '__all__'
+        exclude = ('search_vector',)
         read_only_fields = ('id', 'estate')
 
 
-class EstateSerializer(serializers.ModelSerializer):
-    asset_set = AssetSerializer(many=True)
-    expense_set = ExpensesSerializer(many=True)
-    dispute_set = DisputeSerializer(many=True)
+class LineItemSearchResultSerializer(serializers.Serializer):
+    """A ranked asset, expense or dispute matching a search"""
+    type = serializers.CharField(source='result_type')
+    id = serializers.IntegerField(source='result_id')
+    estate = serializers.IntegerField(source='result_estate', allow_null=True)
+    application = serializers.IntegerField(source='result_application', allow_null=True)
+    title = serializers.CharField(source='result_title', allow_null=True)
+    description = serializers.CharField(source='result_description')
+    rank = serializers.FloatField()
+
+
+class PortfolioKeyField(serializers.IntegerField):
+    """Id of a portfolio summary group, null for applications without one"""
+
+    def to_representation(self, value):
+        return None if value == PortfolioSummary.NONE_KEY else super().to_representation(value)
+
+
+class PortfolioReportRowSerializer(serializers.Serializer):
+    """Totals of one portfolio report group, the group columns present are the ones in context['group_by']"""
+    application_status = PortfolioKeyField(source='status_key')
+    agency = PortfolioKeyField(source='agency_key')
+    user = PortfolioKeyField(source='user_key')
+    month = serializers.DateField(format='%Y-%m')
+    application_count = serializers.IntegerField()
+    total_amount = serializers.DecimalField(max_digits=18, decimal_places=2)
+    average_term = serializers.SerializerMethodField()
+    total_estate_value = serializers.DecimalField(max_digits=18, decimal_places=2)
+
+    group_fields = ('application_status', 'agency', 'user', 'month')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for field_name in set(self.group_fields) - set(self.context.get('group_by', ())):
+            self.fields.pop(field_name)
+
+    def get_average_term(self, row):
+        if not row['application_count']:
+            return None
+        return round(row['total_term'] / row['application_count'], 2)
+
+
+def line_item_totals(model, created=(), deleted=(), changed=()):
+    """Return the Estate.objects.add_to_totals() arguments for line items written without signals"""
+    totals = {f'{model._meta.model_name}_count': len(created) - len(deleted)}
+    if model is not Dispute:
+        totals['assets' if model is Asset else 'expenses'] = (
+            sum((item.value for item in created), 0) - sum((item.value for item in deleted), 0) +
+            sum((item.value - old.value for old, item in changed), 0))
+    return totals
+
+
+class NestedLineItemMixin:
+    """
+    Line item nested in an estate payload. Its id is writable, so an estate update can tell the items it changes
+    from the ones it adds. An item without an id is new and needs every required field, also in a PATCH.
+    """
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if 'id' not in attrs:
+            missing = [name for name, field in self.fields.items()
+                       if field.required and not field.read_only and name not in attrs]
+            if missing:
+                raise serializers.ValidationError({name: [serializers.Field.default_error_messages['required']]
+                                                   for name in missing})
+        return attrs
+
+
+class EstateAssetSerializer(NestedLineItemMixin, AssetSerializer):
+    id = serializers.IntegerField(required=False)
+
+
+class EstateExpenseSerializer(NestedLineItemMixin, ExpensesSerializer):
+    id = serializers.IntegerField(required=False)
+
+
+class EstateDisputeSerializer(NestedLineItemMixin, DisputeSerializer):
+    id = serializers.IntegerField(required=False)
+
+
+class EstateSerializer(CachedFragmentMixin, BatchedRelatedFieldsMixin, serializers.ModelSerializer):
+    # the estate of each application is joined, to tell the applications that already have one
+    application = BatchedPrimaryKeyRelatedField(queryset=Application.objects.select_related('estate'),
+                                                allow_null=True, required=False)
+    asset_set = EstateAssetSerializer(many=True)
+    expense_set = EstateExpenseSerializer(many=True)
+    dispute_set = EstateDisputeSerializer(many=True)
+
+    line_item_sets = ((Asset, 'asset_set'), (Expense, 'expense_set'), (Dispute, 'dispute_set'))
+    fragment_kind = 'estate'
 
     class Meta:
         model = Estate
-        fields = ['id', 'application', 'asset_set', 'expense_set', 'dispute_set']
-        read_only_fields = ('id',)
+        fields = ['id', 'application', 'asset_set', 'expense_set', 'dispute_set',
+                  'total_assets', 'total_expenses', 'net_value', 'asset_count', 'expense_count', 'dispute_count']
+        read_only_fields = ('id', 'total_assets', 'total_expenses', 'net_value',
+                            'asset_count', 'expense_count', 'dispute_count')
+        list_serializer_class = CachedFragmentListSerializer
+
+    @classmethod
+    def line_item_prefetches(cls):
+        return [Prefetch(name, queryset=model.objects.order_by('id')) for model, name in cls.line_item_sets]
+
+    def fragment_version(self, instance):
+        # the version is bumped by every write to the estate and to its line items
+        return f'{instance.pk}.{instance.version}'
 
+    def load_related(self, instances):
+        prefetch_related_objects(instances, *self.line_item_prefetches())
+
+    @audit.buffered_audit()
     def create(self, validated_data):
         assets_data = validated_data.pop('asset_set')
         expenses_data = validated_data.pop('expense_set')
         disputes_data = validated_data.pop('dispute_set')
 
-        estate = Estate.objects.create(**validated_data)
-
-        for asset_data in assets_data:
-            Asset.objects.create(estate=estate, **asset_data)
+        estate = Estate(**validated_data)
+        assets = [Asset(estate=estate, **asset_data) for asset_data in assets_data]
+        expenses = [Expense(estate=estate, **expense_data) for expense_data in expenses_data]
+        disputes = [Dispute(estate=estate, **dispute_data) for dispute_data in disputes_data]
 
-        for expense_data in expenses_data:
-            Expense.objects.create(estate=estate, **expense_data)
+        # line items are bulk inserted without signals, so the totals are set up front
+        estate.count_line_items(assets, expenses, disputes)
+        estate.save()
 
-        for dispute_data in disputes_data:
-            Dispute.objects.create(estate=estate, **dispute_data)
+        line_items = []
+        for model, items in ((Asset, assets), (Expense, expenses), (Dispute, disputes)):
+            line_items += model.objects.bulk_create(items, batch_size=audit.BULK_BATCH_SIZE)
+        audit.log_bulk_create(line_items)
         return estate
 
+    @audit.buffered_audit()
+    def update(self, instance, validated_data):
+        """
+        Apply the line item sets given against the stored ones: items with an id are updated, items without one
+        are added and stored items left out are deleted, each with one bulk statement. A set left out of a PATCH
+        is not touched, and items that do not change cost no writes.
+        """
+        totals = {}
+        for model, field_name in self.line_item_sets:
+            if field_name in validated_data:
+                self.update_line_items(instance, model, field_name, validated_data.pop(field_name), totals)
+        Estate.objects.add_to_totals(instance.pk, **totals)
+
+        application = validated_data.get('application', instance.application_id)
+        if getattr(application, 'pk', application) != instance.application_id:
+            instance.application = application
+            instance.save()
+        instance.refresh_from_db(fields=Estate.totals_fields)
+        return instance
+
+    @staticmethod
+    def update_line_items(estate, model, field_name, items_data, totals):
+        """Insert, update and delete the items of one set, adding the change they make to the totals"""
+        stored = {item.pk: item for item in model.objects.select_for_update().filter(estate=estate).order_by('id')}
+        ids = Counter(data['id'] for data in items_data if 'id' in data)
+        unknown = [pk for pk in ids if pk not in stored]
+        duplicated = [pk for pk, count in ids.items() if count > 1]
+        if unknown or duplicated:
+            raise serializers.ValidationError({field_name: [f"Not an item of this estate: {pk}" for pk in unknown] +
+                                               [f"Listed more than once: {pk}" for pk in duplicated]})
+
+        created, changed, changed_fields = [], [], set()
+        for data in items_data:
+            data = dict(data)
+            if 'id' not in data:
+                created.append(model(estate=estate, **data))
+                continue
+            item = stored.pop(data.pop('id'))
+            changes = {name: value for name, value in data.items() if getattr(item, name) != value}
+            if changes:
+                changed.append((copy.copy(item), item))
+                for name, value in changes.items():
+                    setattr(item, name, value)
+                changed_fields.update(changes)
+        deleted = list(stored.values())
+
+        # bulk writes send no signals, the totals they would have moved are collected for one UPDATE
+        if created:
+            model.objects.bulk_create(created, batch_size=audit.BULK_BATCH_SIZE)
+            audit.log_bulk_create(created)
+        if changed:
+            model.objects.bulk_update([item for old, item in changed], changed_fields,
+                                      batch_size=audit.BULK_BATCH_SIZE)
+            audit.log_bulk_update(changed)
+        if deleted:
+            audit.log_bulk_delete(deleted)
+            delete_rows(model, [item.pk for item in deleted])
+
+        totals.update(line_item_totals(model, created, deleted, changed))
+
+    @staticmethod
+    @audit.buffered_audit()
+    def append_line_items(estate, model, items_data):
+        """Bulk insert new items into one set of the estate and move its totals by them"""
+        items = model.objects.bulk_create([model(estate=estate, **data) for data in items_data],
+                                          batch_size=audit.BULK_BATCH_SIZE)
+        audit.log_bulk_create(items)
+        Estate.objects.add_to_totals(estate.pk, **line_item_totals(model, created=items))
+        return items
+
+    def validate_application(self, application):
+        if application is not None:
+            estate = ApplicationSerializer.get_estate(application)
+            if estate is not None and estate.pk != getattr(self.instance, 'pk', None):
+                raise serializers.ValidationError("This application already has an estate.")
+        return application
+
     def validate(self, attrs):
-        try:
-            serializers.ModelSerializer.validate(self, attrs)
-        except serializers.ValidationError as e:
-            print(e.args)
-            raise e
+        if self.instance is None:
+            for model, field_name in self.line_item_sets:
+                if any('id' in item for item in attrs.get(field_name, ())):
+                    raise serializers.ValidationError({field_name: ["Line items of a new estate can not have an id"]})
         return attrs
 
 
-class ApplicationSerializer(serializers.ModelSerializer):
-    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), required=False, default=None)
+class ApplicationSerializer(CachedFragmentMixin, BatchedRelatedFieldsMixin, serializers.ModelSerializer):
+    user = BatchedPrimaryKeyRelatedField(queryset=User.objects.all(), required=False, default=None)
     created_by = serializers.SerializerMethodField()
     last_modified_by = serializers.SerializerMethodField()
-    agency = serializers.PrimaryKeyRelatedField(queryset=Agency.objects.all())
-    application_status = serializers.PrimaryKeyRelatedField(queryset=ApplicationStatus.objects.all())
-    lead_solicitor = serializers.PrimaryKeyRelatedField(queryset=Solicitor.objects.all())
+    agency = BatchedPrimaryKeyRelatedField(queryset=Agency.objects.all())
+    application_status = BatchedPrimaryKeyRelatedField(queryset=ApplicationStatus.objects.all(), reference=True)
+    lead_solicitor = BatchedPrimaryKeyRelatedField(queryset=Solicitor.objects.all())
     estate = EstateSerializer(read_only=True)
 
     class Meta:
@@ -118,6 +318,46 @@ class ApplicationSerializer(serializers.ModelSerializer):
                   'lead_solicitor',
                   'estate']
         read_only_fields = ('id', 'created_by', 'last_modified_by', 'date_submitted', 'estate')
+        list_serializer_class = CachedFragmentListSerializer
+
+    fragment_kind = 'application'
+    # the emails of other rows, rendered on every request, as are the ?expand= fields
+    uncached_fields = ('created_by', 'last_modified_by')
+
+    # related fields that ?expand= can embed in place of their id
+    expandable_fields = {
+        'agency': AgencySummarySerializer,
+        'lead_solicitor': SolicitorSerializer,
+        'application_status': ApplicationStatusSerializer,
+        'user': UserListSerializer,
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        if fields:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+    @classmethod
+    def get_representation_options(cls, query_params):
+        """Parse and validate the ?fields= and ?expand= query parameters"""
+        fields = [name for name in query_params.get('fields', '').split(',') if name]
+        expand = [name for name in query_params.get('expand', '').split(',') if name]
+
+        errors = {}
+        unknown_fields = [name for name in fields if name not in cls.Meta.fields]
+        if unknown_fields:
+            errors['fields'] = [f"Unknown field: {name}" for name in unknown_fields]
+        unknown_expand = [name for name in expand if name not in cls.expandable_fields]
+        if unknown_expand:
+            errors['expand'] = [f"Field can not be expanded: {name}" for name in unknown_expand]
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        if fields:
+            expand = [name for name in expand if name in fields]
+        return fields, expand
 
     @transaction.atomic
     def create(self, validated_data):
@@ -134,30 +374,69 @@ class ApplicationSerializer(serializers.ModelSerializer):
     @transaction.atomic
     def update(self, instance, validated_data):
 
-        # Update 'agency' and 'application_status' with given IDs
-        if 'agency' in validated_data:
-            instance.agency_id = validated_data.pop('agency')
-        if 'application_status' in validated_data:
-            instance.application_status_id = validated_data.pop('application_status')
-
-        # Update remaining validated data
+        # Update remaining validated data, related fields are already resolved to instances
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
 
         instance.save()
         return instance
 
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None, expand=(), line_items=True):
+        """
+        Join and prefetch what the representation touches, so a page costs a fixed number of queries.
+        Relations that are neither requested nor expanded are left alone. line_items=False leaves the line items
+        of the estates to the fragment cache, which loads them for the estates it misses only.
+        """
+        fields = fields or cls.Meta.fields
+        related = list(expand)
+        if 'created_by' in fields:
+            related.append('created_by')
+        if 'last_modified_by' in fields:
+            related.append('last_updated_by')
+        if related:
+            queryset = queryset.select_related(*related)
+
+        if 'estate' in fields:
+            # the estate is joined in the same query as the applications, only its line items are prefetched
+            queryset = queryset.select_related('estate')
+            if line_items:
+                queryset = queryset.prefetch_related(
+                    *(Prefetch(f'estate__{name}', queryset=model.objects.order_by('id'))
+                      for model, name in EstateSerializer.line_item_sets))
+        return queryset
+
+    def fragment_version(self, instance):
+        # an estate write gives the application a new key too, through the version of its estate
+        if 'estate' not in self.fields:
+            return f'{instance.pk}.{instance.version}'
+        estate = self.get_estate(instance)
+        estate_version = self.fields['estate'].fragment_version(estate) if estate is not None else '-'
+        return f'{instance.pk}.{instance.version}.{estate_version}'
+
+    def load_related(self, instances):
+        if 'estate' in self.fields:
+            estates = [estate for estate in map(self.get_estate, instances) if estate is not None]
+            self.fields['estate'].load_fragments(estates)
+
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        estate = Estate.objects.filter(application=instance)
 
-        if estate.exists():
-            representation['estate'] = EstateSerializer(estate.first()).data
-        else:
-            representation['estate'] = None
+        for field_name in self.context.get('expand', ()):
+            related = getattr(instance, field_name)
+            serializer_class = self.expandable_fields[field_name]
+            representation[field_name] = serializer_class(related).data if related is not None else None
 
         return representation
 
+    @staticmethod
+    def get_estate(instance):
+        """Return the estate of the application, None when it has none"""
+        try:
+            return instance.estate
+        except Estate.DoesNotExist:
+            return None
+
     def get_created_by(self, obj):
         if obj.created_by:
             return obj.created_by.email
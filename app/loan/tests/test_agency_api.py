@@ -68,9 +68,9 @@ class PrivateAgencyAPITestCase(APITestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
 
-        response_names = [agency['name'] for agency in response.data]
+        response_names = [agency['name'] for agency in response.data['results']]
         self.assertIn(agency1.name, response_names)
         self.assertIn(agency2.name, response_names)
 
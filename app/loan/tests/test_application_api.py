@@ -4,15 +4,17 @@ Tests for application api
 from decimal import Decimal
 
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.db.models import ProtectedError
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 
 import user
-from core.models import (Application, ApplicationStatus, Agency, Solicitor, User, )
+from core.models import (Application, ApplicationStatus, Agency, Solicitor, User, Estate, )
 
 from loan import serializers
 from user.serializers import UserSerializer
@@ -53,6 +55,17 @@ def create_loan_application_model(user, **params):
     return application
 
 
+def create_application_with_estate(user, items=3):
+    """Create and return an application with an estate holding the given number of line items"""
+    application = create_loan_application_model(user=user)
+    estate = Estate.objects.create(application=application)
+    for i in range(items):
+        estate.asset_set.create(description=f"Asset {i}", value=Decimal("100.00"))
+        estate.expense_set.create(description=f"Expense {i}", value=Decimal("10.00"))
+        estate.dispute_set.create(description=f"Dispute {i}")
+    return application
+
+
 # endregion
 
 class PublicApplicationApiTestCase(APITestCase):
@@ -86,8 +99,149 @@ class PrivateApplicationApiTestCase(APITestCase):
         applications = Application.objects.all().order_by('-id')
         serializer = serializers.ApplicationSerializer(applications, many=True)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['results'], serializer.data)
+
+    def test_retrieve_application_list_query_count_does_not_grow_with_rows(self):
+        """Test the list costs the same number of queries for one and for many applications"""
+        create_application_with_estate(user=self.user)
+        # applications joined with their estate, assets, expenses, disputes
+        with self.assertNumQueries(4):
+            response = self.client.get(self.APPLICATION_URL)
+        self.assertEqual(len(response.data['results']), 1)
+
+        for _ in range(5):
+            create_application_with_estate(user=self.user)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.APPLICATION_URL)
+        self.assertEqual(len(response.data['results']), 6)
+
+        applications = serializers.ApplicationSerializer.setup_eager_loading(Application.objects.order_by('-id'))
+        serializer = serializers.ApplicationSerializer(applications, many=True)
+        self.assertEqual(response.data['results'], serializer.data)
+
+    def test_application_list_is_cursor_paginated(self):
+        """Test following the next cursor walks every application exactly once, newest first"""
+        applications = [create_loan_application_model(user=self.user) for _ in range(5)]
+
+        response = self.client.get(self.APPLICATION_URL, {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['previous'])
+        ids = [application['id'] for application in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [application['id'] for application in response.data['results']]
+
+        self.assertEqual(ids, sorted((application.id for application in applications), reverse=True))
+
+    def test_application_list_rejects_tampered_cursor(self):
+        """Test an invalid cursor is reported rather than silently ignored"""
+        response = self.client.get(self.APPLICATION_URL, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_application_detail_query_count(self):
+        """Test the detail joins the estate and prefetches its line items"""
+        application = create_application_with_estate(user=self.user, items=10)
+        with self.assertNumQueries(4):
+            response = self.client.get(detail_url(application.id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['estate']['asset_set']), 10)
+        application = serializers.ApplicationSerializer.setup_eager_loading(Application.objects).get(id=application.id)
+        self.assertEqual(response.data, serializers.ApplicationDetailSerializer(application).data)
+
+    def test_application_list_sparse_fields(self):
+        """Test ?fields= trims the payload and skips the estate prefetch"""
+        create_application_with_estate(user=self.user)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.APPLICATION_URL, {'fields': 'id,amount,application_status'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'amount', 'application_status'})
+
+    def test_application_list_unknown_field_returns_error(self):
+        """Test unknown ?fields= and ?expand= names are rejected"""
+        response = self.client.get(self.APPLICATION_URL, {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(self.APPLICATION_URL, {'expand': 'estate'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_application_list_expand_related_objects(self):
+        """Test ?expand= embeds the related objects without extra queries per row"""
+        agency = Agency.objects.create(name="Test Agency")
+        solicitor = Solicitor.objects.create(title="Mr", first_name="Test", last_name="Name", agency=agency)
+        for _ in range(3):
+            application = create_loan_application_model(user=self.user)
+            application.agency = agency
+            application.lead_solicitor = solicitor
+            application.user = self.user
+            application.save()
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.APPLICATION_URL, {
+                'fields': 'id,agency,lead_solicitor,application_status,user',
+                'expand': 'agency,lead_solicitor,application_status,user',
+            })
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        row = response.data['results'][0]
+        self.assertEqual(row['agency'], serializers.AgencySummarySerializer(agency).data)
+        self.assertEqual(row['lead_solicitor'], serializers.SolicitorSerializer(solicitor).data)
+        self.assertEqual(row['application_status']['name'], "Test Status")
+        self.assertEqual(row['user'], {'id': self.user.id, 'email': self.user.email})
+
+    def test_application_detail_expand_missing_relation(self):
+        """Test expanding an empty relation returns null"""
+        application = create_loan_application_model(user=self.user)
+        response = self.client.get(detail_url(application.id), {'expand': 'agency'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['agency'])
+        self.assertIn('estate', response.data)
+
+    def test_application_list_filter_and_sort_on_estate_totals(self):
+        """Test applications can be filtered and ordered on the stored estate net value"""
+        small = create_application_with_estate(user=self.user, items=1)
+        large = create_application_with_estate(user=self.user, items=5)
+        without_estate = create_loan_application_model(user=self.user)
+        Application.objects.filter(id=large.id).update(amount=Decimal("100"))
+
+        response = self.client.get(self.APPLICATION_URL, {'ordering': '-estate_net_value'})
+        self.assertEqual([row['id'] for row in response.data['results']], [large.id, small.id, without_estate.id])
+
+        response = self.client.get(self.APPLICATION_URL, {'net_value_min': '50', 'net_value_max': '100'})
+        self.assertEqual([row['id'] for row in response.data['results']], [small.id])
+
+        response = self.client.get(self.APPLICATION_URL, {'covers_amount': 'true'})
+        self.assertEqual([row['id'] for row in response.data['results']], [large.id])
+
+        response = self.client.get(self.APPLICATION_URL, {'net_value_min': 'lots'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_application_list_reads_estate_totals_only_when_asked(self):
+        """Test the estate totals are computed only for a filter or an ordering on them"""
+        create_application_with_estate(user=self.user)
+
+        for params, annotated in (({}, False), ({'ordering': 'amount'}, False),
+                                  ({'covers_amount': 'true'}, True), ({'ordering': '-estate_surplus'}, True)):
+            with self.subTest(params=params), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.APPLICATION_URL, params)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual('"estate_net_value"' in queries[0]['sql'], annotated)
+
+    def test_application_list_ordered_on_estate_totals_is_paginated(self):
+        """Test the cursor walks an ordering on estate totals without repeats"""
+        applications = [create_application_with_estate(user=self.user, items=i % 3) for i in range(6)]
+
+        response = self.client.get(self.APPLICATION_URL, {'ordering': 'estate_net_value', 'page_size': 2})
+        ids = [row['id'] for row in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [row['id'] for row in response.data['results']]
+
+        self.assertEqual(sorted(ids), sorted(application.id for application in applications))
+        self.assertEqual(len(ids), len(set(ids)))
 
     def test_get_application_detail(self):
         """Test get recipe detail"""
@@ -0,0 +1,151 @@
+"""
+Tests for application list filters
+"""
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core.models import Application, ApplicationStatus, Agency, Solicitor
+from loan.views import ApplicationViewSet
+
+APPLICATION_URL = reverse('loan:application-list')
+
+
+def create_application(**params):
+    defaults = {
+        "amount": Decimal("350000"),
+        "term": 12,
+    }
+    defaults.update(params)
+    return Application.objects.create(**defaults)
+
+
+class ApplicationFilterAPITestCase(TestCase):
+    """Test filtering the application list"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(email='test@example.com', password='testpass')
+        self.client.force_authenticate(self.user)
+
+        self.active = ApplicationStatus.objects.create(name="Active")
+        self.settled = ApplicationStatus.objects.create(name="Settled")
+        self.agency = Agency.objects.create(name="Test Agency")
+        self.solicitor = Solicitor.objects.create(first_name="Test", last_name="Name", agency=self.agency)
+
+    def get_ids(self, **params):
+        response = self.client.get(APPLICATION_URL, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return [application['id'] for application in response.data['results']]
+
+    def test_filter_on_related_ids(self):
+        """Test filtering on each related id, alone and as a list"""
+        first = create_application(application_status=self.active, agency=self.agency, user=self.user)
+        second = create_application(application_status=self.settled, lead_solicitor=self.solicitor,
+                                    created_by=self.user)
+
+        self.assertEqual(self.get_ids(application_status=self.active.id), [first.id])
+        self.assertEqual(self.get_ids(application_status=f'{self.active.id},{self.settled.id}'),
+                         [second.id, first.id])
+        self.assertEqual(self.get_ids(agency=self.agency.id), [first.id])
+        self.assertEqual(self.get_ids(lead_solicitor=self.solicitor.id), [second.id])
+        self.assertEqual(self.get_ids(user=self.user.id), [first.id])
+        self.assertEqual(self.get_ids(created_by=self.user.id), [second.id])
+        self.assertEqual(self.get_ids(user=self.user.id, application_status=self.settled.id), [])
+
+    def test_filter_on_ranges(self):
+        """Test filtering on the date submitted and amount ranges"""
+        old = create_application(amount=Decimal("1000"))
+        new = create_application(amount=Decimal("5000"))
+        Application.objects.filter(id=old.id).update(date_submitted=timezone.now() - timedelta(days=30))
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+
+        self.assertEqual(self.get_ids(date_submitted_after=since), [new.id])
+        self.assertEqual(self.get_ids(date_submitted_before=since), [old.id])
+        self.assertEqual(self.get_ids(amount_min="2000"), [new.id])
+        self.assertEqual(self.get_ids(amount_max="2000"), [old.id])
+        self.assertEqual(self.get_ids(amount_min="500", amount_max="6000"), [new.id, old.id])
+
+    def test_invalid_filter_values_return_error(self):
+        """Test malformed filter values are rejected"""
+        for params in ({'agency': 'abc'}, {'user': '0'}, {'date_submitted_after': 'yesterday'}, {'amount_min': 'x'}):
+            response = self.client.get(APPLICATION_URL, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+            self.assertIn(list(params)[0], response.data)
+
+
+class ApplicationFilterIndexTestCase(TestCase):
+    """Test every supported filter can be answered from an index"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # plans follow the table statistics, so give the planner a spread of values to estimate from instead of
+        # whatever it last saw of the rows other tests wrote and rolled back. Each user, agency, solicitor and status
+        # has 1% of the applications, walking every id for the first page of one would cost more than its index
+        users = [get_user_model().objects.create_user(email=f'user{i}@example.com') for i in range(100)]
+        agencies = Agency.objects.bulk_create([
+            Agency(name=f'Agency {i}', house_number='1', street='Main Street', town='Cork', county='Cork',
+                   eircode='T12AB34') for i in range(100)
+        ])
+        solicitors = Solicitor.objects.bulk_create([
+            Solicitor(title='Mr', first_name='John', last_name=f'Smith {i}', email='john@example.com',
+                      phone_number='123', agency=agency) for i, agency in enumerate(agencies)
+        ])
+        statuses = ApplicationStatus.objects.bulk_create([ApplicationStatus(name=f'Status {i}') for i in range(100)])
+        rows = random.Random(0)
+        Application.objects.bulk_create([
+            Application(amount=Decimal(i * 37 % 50000), term=12, user=rows.choice(users),
+                        created_by=rows.choice(users), agency=rows.choice(agencies),
+                        lead_solicitor=rows.choice(solicitors), application_status=rows.choice(statuses))
+            for i in range(5000)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE core_application "
+                           "SET date_submitted = date_submitted - (id % 730) * interval '1 day'")
+            cursor.execute('ANALYZE core_application')
+        cls.ids = {'user': users[0].id, 'agency': agencies[0].id, 'lead_solicitor': solicitors[0].id,
+                   'application_status': statuses[0].id}
+
+    def explain(self, **params):
+        """EXPLAIN the first page of the application list, as the viewset reads it"""
+        request = Request(APIRequestFactory().get(APPLICATION_URL, params))
+        view = ApplicationViewSet(request=request, action='list', format_kwarg=None, args=(), kwargs={})
+        queryset = view.filter_queryset(view.get_queryset())
+        paginator = view.paginator
+        ordering = paginator.get_ordering(request, queryset, view)
+        return queryset.order_by(*ordering)[:paginator.get_page_size(request) + 1].explain()
+
+    def test_filters_use_an_index(self):
+        """Test the EXPLAIN plan of each filter, with the list's ordering and page size, scans an application index"""
+        # a few days of applications, a wider range is read sooner walking the ids
+        since = (timezone.now() - timedelta(days=5)).isoformat()
+        ids = {name: str(pk) for name, pk in self.ids.items()}
+        cases = [
+            ({'application_status': ids['application_status']}, 'application_status_page_idx'),
+            ({'application_status': ids['application_status'], 'date_submitted_after': since},
+             'application_status_page_idx'),
+            ({'user': ids['user'], 'application_status': ids['application_status']}, 'application_user_status_idx'),
+            ({'agency': ids['agency']}, 'application_agency_page_idx'),
+            ({'lead_solicitor': ids['lead_solicitor']}, 'application_solicitor_page_idx'),
+            ({'created_by': ids['user']}, 'application_creator_page_idx'),
+            # the foreign key has no index of its own, the one it leads answers it
+            ({'user': ids['user']}, 'application_user_status_idx'),
+            ({'date_submitted_after': since}, 'application_date_idx'),
+            ({'amount_min': '100', 'amount_max': '200'}, 'application_amount_idx'),
+        ]
+        for params, expected in cases:
+            with self.subTest(params=params):
+                plan = self.explain(**params)
+                self.assertIn(expected, plan)
+                # the small tables the page joins may be scanned, the applications may not
+                self.assertNotIn('Seq Scan on core_application', plan)
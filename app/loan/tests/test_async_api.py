@@ -0,0 +1,125 @@
+"""
+Tests for the async read api
+"""
+import json
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TransactionTestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Application, ApplicationStatus, Agency, Solicitor, Estate, Asset, Expense, Dispute
+from loan.fragments import fragment_cache
+from user.authentication import token_cache
+
+
+class AsyncReadAPITestCase(TransactionTestCase):
+    """
+    Test the async views return what their synchronous counterparts return.
+    The async views query from worker threads with their own connections, so the data has to be committed.
+    """
+
+    def setUp(self):
+        # let the worker threads close their connections after each query, so the test database can be dropped
+        self.conn_max_age = connection.settings_dict['CONN_MAX_AGE']
+        connection.settings_dict['CONN_MAX_AGE'] = 0
+        token_cache.clear()
+        fragment_cache.clear()
+
+        self.user = get_user_model().objects.create_user(email='test@example.com', password='testpass')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+
+        status_new = ApplicationStatus.objects.create(name="New")
+        self.agency = Agency.objects.create(name="Agency", house_number="1", street="Main Street", town="Cork",
+                                            county="Cork", eircode="T12AB34")
+        Agency.objects.create(name="Other agency", house_number="2", street="Main Street", town="Cork",
+                              county="Cork", eircode="T12AB35")
+        solicitor = Solicitor.objects.create(title="Mr", first_name="John", last_name="Smith",
+                                             email="john@example.com", phone_number="123", agency=self.agency)
+        for i in range(3):
+            application = Application.objects.create(amount=Decimal(1000 + i), term=12,
+                                                     application_status=status_new, agency=self.agency,
+                                                     lead_solicitor=solicitor, user=self.user,
+                                                     created_by=self.user, last_updated_by=self.user)
+            estate = Estate.objects.create(application=application)
+            Asset.objects.create(description="House", value=Decimal("250000"), estate=estate)
+            Asset.objects.create(description="Car", value=Decimal("5000"), estate=estate)
+            Expense.objects.create(description="Funeral", value=Decimal("4000"), estate=estate)
+            Dispute.objects.create(description="Will contested", estate=estate)
+        Application.objects.create(amount=Decimal("500"), term=6)
+        self.application = application
+        self.estate = estate
+
+    def tearDown(self):
+        connection.settings_dict['CONN_MAX_AGE'] = self.conn_max_age
+
+    def assertSameResponse(self, sync_url, async_url, params=None):
+        expected = self.client.get(sync_url, params)
+        response = self.client.get(async_url, params)
+
+        self.assertEqual(response.status_code, expected.status_code)
+        # pagination links point back at the endpoint that served the page
+        self.assertEqual(json.loads(response.content.decode().replace('/api/async/', '/api/')), expected.json())
+        return response
+
+    def test_application_list(self):
+        """Test the async application list matches the sync one, with and without ?fields= and ?expand="""
+        sync_url, async_url = reverse('loan:application-list'), reverse('loan:async-application-list')
+
+        response = self.assertSameResponse(sync_url, async_url)
+        self.assertEqual(len(response.json()['results']), 4)
+        self.assertEqual(len(response.json()['results'][1]['estate']['asset_set']), 2)
+        self.assertSameResponse(sync_url, async_url, {'expand': 'user,agency,lead_solicitor,application_status'})
+        self.assertSameResponse(sync_url, async_url, {'fields': 'id,created_by', 'agency': self.agency.id})
+        self.assertSameResponse(sync_url, async_url, {'page_size': 2, 'ordering': 'amount'})
+
+    def test_application_list_from_fragments(self):
+        """Test the async list renders the fragments the sync list cached, without loading line items"""
+        self.client.get(reverse('loan:application-list'))
+
+        response = self.client.get(reverse('loan:async-application-list'))
+
+        self.assertEqual(fragment_cache.stats()['hits'], 4)
+        # page joined with the estates and users, the token was cached by the sync request
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+
+    def test_server_timing_counts_worker_queries(self):
+        """Test the queries the async views run on worker threads are reported in Server-Timing"""
+        response = self.client.get(reverse('loan:async-application-list'))
+
+        # token, page joined with the estates, assets, expenses, disputes and users
+        self.assertIn('desc="6 queries"', response['Server-Timing'])
+
+    def test_application_detail(self):
+        """Test the async application detail matches the sync one"""
+        self.assertSameResponse(reverse('loan:application-detail', args=[self.application.id]),
+                                reverse('loan:async-application-detail', args=[self.application.id]),
+                                {'expand': 'user'})
+
+    def test_estate_list_and_detail(self):
+        """Test the async estate list and detail match the sync ones"""
+        self.assertSameResponse(reverse('loan:estate-list'), reverse('loan:async-estate-list'))
+        self.assertSameResponse(reverse('loan:estate-detail', args=[self.estate.id]),
+                                reverse('loan:async-estate-detail', args=[self.estate.id]))
+
+    def test_agency_list(self):
+        """Test the async agency list matches the sync one, solicitors included"""
+        response = self.assertSameResponse(reverse('loan:agency-list'), reverse('loan:async-agency-list'))
+        self.assertEqual(len(response.json()['results'][0]['solicitors']), 1)
+
+    def test_errors(self):
+        """Test the async views report missing credentials, bad parameters and missing objects like DRF"""
+        self.assertSameResponse(reverse('loan:application-list'), reverse('loan:async-application-list'),
+                                {'expand': 'estate'})
+        self.assertSameResponse(reverse('loan:estate-detail', args=[0]), reverse('loan:async-estate-detail', args=[0]))
+
+        self.client.credentials()
+        response = self.client.get(reverse('loan:async-application-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
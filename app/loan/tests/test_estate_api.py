@@ -2,9 +2,13 @@
 tests for estate api
 """
 from decimal import Decimal
+from unittest import mock
 
 from django.contrib.auth import get_user_model
+from auditlog.models import LogEntry
+from django.db import connection, IntegrityError
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
@@ -42,6 +46,16 @@ def create_application():
     return application
 
 
+def estate_payload(application, items):
+    """Return an estate payload with the given number of each kind of line item"""
+    return {
+        'application': application.id,
+        'asset_set': [{'description': f'Asset {i}', 'value': '100.00'} for i in range(items)],
+        'expense_set': [{'description': f'Expense {i}', 'value': '10.00'} for i in range(items)],
+        'dispute_set': [{'description': f'Dispute {i}'} for i in range(items)],
+    }
+
+
 class PublicEstateAPITestCase(APITestCase):
     """Test the unauthenticated Estate API requests"""
 
@@ -69,15 +83,14 @@ class PrivateEstateAPITestCase(APITestCase):
 
     def test_retrieve_Estate_list(self):
         """Test retrieving a list of Estate"""
-        application = create_application()
-        estate1 = Estate.objects.create(application=application)
-        estate2 = Estate.objects.create(application=application)
+        Estate.objects.create(application=create_application())
+        Estate.objects.create(application=create_application())
 
         response = self.client.get(self.ESTATES_URL)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         estates = Estate.objects.all().order_by('-id')
         serializer = EstateSerializer(estates, many=True)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
 
     def test_create_Estate_with_assets_expenses_and_dispute(self):
         """Test creating a new Estate"""
@@ -117,6 +130,49 @@ class PrivateEstateAPITestCase(APITestCase):
         self.assertEqual(response.data, serializer.data)
         self.assertEqual(response_data["application"], application.id)
 
+    def test_create_Estate_inserts_line_items_in_batches(self):
+        """Test the number of queries does not grow with the number of line items"""
+        self.client.post(self.ESTATES_URL, estate_payload(create_application(), 1), format='json')
+
+        with CaptureQueriesContext(connection) as few_items:
+            self.client.post(self.ESTATES_URL, estate_payload(create_application(), 2), format='json')
+        with CaptureQueriesContext(connection) as many_items:
+            response = self.client.post(self.ESTATES_URL, estate_payload(create_application(), 150), format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(many_items), len(few_items))
+
+        estate = Estate.objects.get(id=response.data['id'])
+        self.assertEqual(estate.asset_count, 150)
+        self.assertEqual(estate.total_assets, Decimal('15000'))
+        self.assertEqual(estate.net_value, Decimal('13500'))
+        self.assertEqual(response.data['net_value'], '13500.00')
+        asset_ids = [str(asset_id) for asset_id in estate.asset_set.values_list('id', flat=True)]
+        self.assertEqual(LogEntry.objects.get_for_model(Asset).filter(object_pk__in=asset_ids,
+                                                                      action=LogEntry.Action.CREATE).count(), 150)
+
+    def test_create_Estate_is_not_left_half_written(self):
+        """Test a failing line item insert rolls back the estate"""
+        application = create_application()
+
+        with mock.patch.object(Dispute.objects, 'bulk_create', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.client.post(self.ESTATES_URL, estate_payload(application, 2), format='json')
+
+        self.assertFalse(Estate.objects.exists())
+        self.assertFalse(Asset.objects.exists())
+
+    def test_create_second_Estate_of_application_is_refused(self):
+        """Test an application has at most one estate"""
+        application = create_application()
+        Estate.objects.create(application=application)
+
+        response = self.client.post(self.ESTATES_URL, estate_payload(application, 1), format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('application', response.data)
+        self.assertEqual(Estate.objects.count(), 1)
+
     def test_retrieve_Estate_by_id(self):
         """Test retrieving the Estate by id"""
         estate = Estate.objects.create(application=create_application())
@@ -157,3 +213,191 @@ class PrivateEstateAPITestCase(APITestCase):
         self.assertFalse(Asset.objects.filter(estate=estate).exists())
         self.assertFalse(Expense.objects.filter(estate=estate).exists())
         self.assertFalse(Dispute.objects.filter(estate=estate).exists())
+
+
+def write_queries(queries):
+    return [query['sql'] for query in queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE')) and 'auditlog_logentry' not in query['sql']]
+
+
+class EstateUpdateAPITestCase(APITestCase):
+    """Test the nested estate updates"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(email='test@example.com',
+                                                                            password='testpass'))
+        self.application = create_application()
+        response = self.client.post(reverse('loan:estate-list'), estate_payload(self.application, 3), format='json')
+        self.estate = Estate.objects.get(id=response.data['id'])
+        self.payload = response.data
+
+    def items(self, field_name):
+        return [dict(item) for item in self.payload[field_name]]
+
+    def put(self, **sets):
+        data = {'application': self.application.id, 'asset_set': self.items('asset_set'),
+                'expense_set': self.items('expense_set'), 'dispute_set': self.items('dispute_set'), **sets}
+        return self.client.put(detail_url(self.estate.id), data, format='json')
+
+    def assertTotalsMatchRebuild(self):
+        estate = Estate.objects.get(id=self.estate.id)
+        Estate.objects.rebuild_totals([estate.id])
+        rebuilt = Estate.objects.get(id=estate.id)
+        for name in Estate.totals_fields:
+            self.assertEqual(getattr(estate, name), getattr(rebuilt, name), name)
+
+    def test_unchanged_put_writes_nothing(self):
+        """Test sending the stored estate back costs no inserts, updates or deletes"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.put()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(write_queries(queries), [])
+        self.assertFalse(LogEntry.objects.filter(action__in=[LogEntry.Action.UPDATE, LogEntry.Action.DELETE]).exists())
+
+    def test_put_applies_the_difference(self):
+        """Test changed items are updated, new ones added and missing ones deleted, with the totals following"""
+        assets = self.items('asset_set')
+        unchanged, changed, removed = assets
+        changed['value'] = '250.00'
+        new = {'description': 'Car', 'value': '40.00'}
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.put(asset_set=[unchanged, changed, new])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # one insert, update and delete of assets, then the estate totals and the portfolio summary
+        self.assertEqual(len(write_queries(queries)), 5)
+        self.assertEqual(set(self.estate.asset_set.values_list('value', flat=True)),
+                         {Decimal('100'), Decimal('250'), Decimal('40')})
+        self.assertFalse(Asset.objects.filter(id=removed['id']).exists())
+        self.assertEqual(response.data['total_assets'], '390.00')
+        self.assertEqual(response.data['asset_count'], 3)
+        self.assertTotalsMatchRebuild()
+        self.assertEqual(LogEntry.objects.get(object_id=changed['id'], content_type__model='asset',
+                                              action=LogEntry.Action.UPDATE).changes['value'], ['100.00', '250.00'])
+        self.assertTrue(LogEntry.objects.filter(object_id=removed['id'], content_type__model='asset',
+                                                action=LogEntry.Action.DELETE).exists())
+
+    def test_patch_leaves_other_sets_alone(self):
+        """Test a PATCH only diffs the sets it sends, and its items only need the fields they change"""
+        expense = self.items('expense_set')[0]
+
+        response = self.client.patch(detail_url(self.estate.id), {
+            'expense_set': [{'id': expense['id'], 'value': '5.00'}]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Asset.objects.filter(estate=self.estate).count(), 3)
+        self.assertEqual(Dispute.objects.filter(estate=self.estate).count(), 3)
+        self.assertEqual(list(self.estate.expense_set.values_list('description', 'value')),
+                         [(expense['description'], Decimal('5'))])
+        self.assertEqual(response.data['total_expenses'], '5.00')
+        self.assertTotalsMatchRebuild()
+
+    def test_new_items_need_their_required_fields(self):
+        """Test an item without an id is validated as a new item, also in a PATCH"""
+        response = self.client.patch(detail_url(self.estate.id), {'asset_set': [{'value': '5.00'}]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('description', response.data['asset_set'][0])
+
+    def test_items_of_other_estates_are_refused(self):
+        """Test ids that are not items of the estate, or are repeated, are refused and nothing is written"""
+        other = Estate.objects.create()
+        foreign = Asset.objects.create(description='Other', value=Decimal('1'), estate=other)
+        asset = self.items('asset_set')[0]
+
+        for asset_set in ([asset, {'id': foreign.id, 'description': 'Taken', 'value': '1.00'}], [asset, asset]):
+            with self.subTest(asset_set=asset_set):
+                response = self.put(asset_set=asset_set)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Asset.objects.get(id=foreign.id).estate, other)
+        self.assertEqual(self.estate.asset_set.count(), 3)
+
+    def test_create_refuses_item_ids(self):
+        """Test the items of a new estate can not name existing rows"""
+        payload = estate_payload(self.application, 1)
+        payload['asset_set'][0]['id'] = self.items('asset_set')[0]['id']
+
+        response = self.client.post(reverse('loan:estate-list'), payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_move_to_another_application(self):
+        """Test the estate can be moved to another application"""
+        other = Application.objects.create(amount='1000', term=6)
+
+        response = self.put(application=other.id)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Estate.objects.get(id=self.estate.id).application, other)
+
+    def test_move_to_application_with_an_estate_is_refused(self):
+        """Test the estate can not be moved to an application that has one"""
+        other = Application.objects.create(amount='1000', term=6)
+        Estate.objects.create(application=other)
+
+        response = self.put(application=other.id)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('application', response.data)
+
+
+def bulk_url(estate_id, kind):
+    """Return the bulk append url of a line item set of an estate"""
+    return reverse('loan:estate-line-items-bulk', args=[estate_id, kind])
+
+
+class EstateBulkLineItemsAPITestCase(APITestCase):
+    """Test appending line items to an estate in bulk"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(email='test@example.com',
+                                                                            password='testpass'))
+        self.estate = Estate.objects.create(application=create_application())
+
+    def test_append_assets(self):
+        """Test the items are inserted with the estate totals moved by them, and their ids returned in order"""
+        items = [{'section': 'Property', 'description': f'Asset {i}', 'value': '10.50'} for i in range(600)]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(bulk_url(self.estate.id, 'assets'), items, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ids = response.data['ids']
+        self.assertEqual(ids, list(self.estate.asset_set.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT INTO "core_asset"')]), 2)
+        estate = Estate.objects.get(id=self.estate.id)
+        self.assertEqual((estate.asset_count, estate.total_assets, estate.net_value),
+                         (600, Decimal('6300'), Decimal('6300')))
+        self.assertEqual(LogEntry.objects.get_for_model(Asset).count(), 600)
+
+    def test_append_expenses_and_disputes(self):
+        """Test the other sets move their own totals"""
+        self.client.post(bulk_url(self.estate.id, 'expenses'), [{'description': 'Fees', 'value': '20.00'}] * 3,
+                         format='json')
+        self.client.post(bulk_url(self.estate.id, 'disputes'), [{'description': 'Contested'}] * 2, format='json')
+
+        estate = Estate.objects.get(id=self.estate.id)
+        self.assertEqual((estate.expense_count, estate.total_expenses, estate.net_value, estate.dispute_count),
+                         (3, Decimal('60'), Decimal('-60'), 2))
+
+    def test_invalid_items_add_nothing(self):
+        """Test one invalid item refuses the whole list, with the errors at its position"""
+        items = [{'description': 'House', 'value': '100.00'}, {'description': 'Car'}]
+
+        response = self.client.post(bulk_url(self.estate.id, 'assets'), items, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('value', response.data[1])
+        self.assertFalse(Asset.objects.exists())
+
+    def test_payload_must_be_a_list(self):
+        """Test a single object is refused"""
+        response = self.client.post(bulk_url(self.estate.id, 'assets'), {'description': 'House', 'value': '1.00'},
+                                    format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,92 @@
+"""
+tests for the streaming application export
+"""
+import csv
+import io
+import json
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Application, ApplicationStatus, Agency, Estate
+from loan import export
+from loan.filters import annotate_estate_totals
+
+EXPORT_URL = reverse('loan:application-export')
+
+
+def read_content(response):
+    return b''.join(response.streaming_content).decode()
+
+
+class ExportAPITestCase(TestCase):
+    """Test the application export"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(email='test@example.com',
+                                                                            password='testpass'))
+        self.status = ApplicationStatus.objects.create(name='New')
+        self.agency = Agency.objects.create(name='Agency')
+        self.applications = [
+            Application.objects.create(amount=Decimal(1000 * (i + 1)), term=12, application_status=self.status,
+                                       agency=self.agency if i % 2 else None)
+            for i in range(4)
+        ]
+        Estate.objects.create(application=self.applications[0], total_assets=Decimal('5000'),
+                              net_value=Decimal('5000'))
+
+    def test_login_required(self):
+        """Test an anonymous export is refused"""
+        response = APIClient().get(EXPORT_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_export_csv(self):
+        """Test every application is exported as a CSV row with its estate totals"""
+        response = self.client.get(EXPORT_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('applications.csv', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(read_content(response))))
+        self.assertEqual([int(row['id']) for row in rows], [a.id for a in reversed(self.applications)])
+        first = rows[-1]
+        self.assertEqual((first['amount'], first['estate_net_value'], first['estate_surplus']),
+                         ('1000.00', '5000.00', '4000.00'))
+        self.assertEqual(first['application_status_name'], 'New')
+        self.assertEqual(rows[0]['agency_name'], 'Agency')
+
+    def test_export_jsonl_with_list_filters(self):
+        """Test ?format=jsonl streams JSON lines, filtered and ordered like the list"""
+        response = self.client.get(EXPORT_URL, {'format': 'jsonl', 'agency': self.agency.id, 'ordering': 'amount'})
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in read_content(response).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [self.applications[1].id, self.applications[3].id])
+        self.assertEqual(rows[0]['amount'], '2000.00')
+        self.assertEqual(rows[0]['estate_net_value'], '0.00')
+
+    def test_invalid_filter_is_answered_in_json(self):
+        """Test filter errors are reported as JSON whatever the export format"""
+        response = self.client.get(EXPORT_URL, {'agency': 'x'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('agency', response.json())
+
+    def test_rows_are_read_in_chunks(self):
+        """Test the export runs one query however many chunks it fetches and renders"""
+        queryset = Application.objects.order_by('id')
+        with CaptureQueriesContext(connection) as queries:
+            blocks = list(export.stream_jsonl(export.read_rows(
+                annotate_estate_totals(queryset), chunk_size=1), chunk_size=1))
+
+        self.assertEqual(len(blocks), len(self.applications) + 1)
+        self.assertEqual(len([query for query in queries if 'SELECT' in query['sql']]), 1)
@@ -0,0 +1,145 @@
+"""
+Tests for the row versions and the fragment cache of serialized applications and estates
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.models import Application, Estate, Asset, Expense
+from loan.fragments import fragment_cache
+
+APPLICATIONS_URL = reverse('loan:application-list')
+ESTATES_URL = reverse('loan:estate-list')
+
+
+def version(instance):
+    return type(instance).objects.values_list('version', flat=True).get(pk=instance.pk)
+
+
+def create_application_with_estate(user, items=2):
+    application = Application.objects.create(amount=Decimal('1000'), term=12, created_by=user)
+    estate = Estate.objects.create(application=application)
+    for i in range(items):
+        estate.asset_set.create(description=f'Asset {i}', value=Decimal('100.00'))
+        estate.expense_set.create(description=f'Expense {i}', value=Decimal('10.00'))
+    return application
+
+
+class RowVersionTestCase(TestCase):
+    """Test the database triggers keeping the row versions"""
+
+    def setUp(self):
+        self.application = Application.objects.create(amount=Decimal('1000'), term=12)
+        self.estate = Estate.objects.create(application=self.application)
+
+    def test_update_bumps_version(self):
+        """Test any update of an application or an estate bumps its version, whatever it sets"""
+        self.application.term = 6
+        self.application.save()
+        Estate.objects.add_to_totals(self.estate.pk, assets=Decimal('10'))
+
+        self.assertEqual((version(self.application), version(self.estate)), (1, 1))
+
+    def test_line_item_writes_bump_estate_version(self):
+        """Test inserting, changing and deleting line items bumps the version of their estate"""
+        asset = Asset.objects.create(estate=self.estate, description='House', value=Decimal('10'))
+        after_insert = version(self.estate)
+        Asset.objects.filter(pk=asset.pk).update(description='Cottage')
+        after_update = version(self.estate)
+        Asset.objects.filter(pk=asset.pk).delete()
+
+        self.assertGreater(after_insert, 0)
+        self.assertGreater(after_update, after_insert)
+        self.assertGreater(version(self.estate), after_update)
+
+    def test_bulk_insert_bumps_once(self):
+        """Test a bulk insert touches its estate once, not once per row"""
+        Expense.objects.bulk_create([Expense(estate=self.estate, description=f'Expense {i}', value=Decimal('1'))
+                                     for i in range(100)])
+
+        self.assertEqual(version(self.estate), 1)
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test reads render unchanged applications and estates from their cached fragments"""
+
+    def setUp(self):
+        fragment_cache.clear()
+        self.user = get_user_model().objects.create_user(email='test@example.com', password='testpass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.applications = [create_application_with_estate(self.user) for _ in range(3)]
+
+    def test_hit_skips_line_items(self):
+        """Test a second list renders from the cache, with the page query only"""
+        first = self.client.get(APPLICATIONS_URL)
+        with self.assertNumQueries(1):
+            second = self.client.get(APPLICATIONS_URL)
+
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(fragment_cache.stats()['hits'], 3)
+
+    def test_line_item_change_renders_its_application_only(self):
+        """Test a line item write re-renders its estate and application, the others stay cached"""
+        self.client.get(APPLICATIONS_URL)
+        changed = self.applications[1]
+        asset = changed.estate.asset_set.first()
+        asset.description = 'Changed'
+        asset.save()
+        fragment_cache.clear()
+        self.client.get(APPLICATIONS_URL)
+        hits, misses = fragment_cache.hits, fragment_cache.misses
+        asset.description = 'Changed again'
+        asset.save()
+
+        response = self.client.get(APPLICATIONS_URL)
+
+        # one application and its estate miss, the two other applications hit
+        self.assertEqual((fragment_cache.hits - hits, fragment_cache.misses - misses), (2, 2))
+        estate = next(result['estate'] for result in response.json()['results'] if result['id'] == changed.id)
+        self.assertEqual(estate['asset_set'][0]['description'], 'Changed again')
+
+    def test_estate_change_is_seen_in_application_detail(self):
+        """Test a change of the totals gives the application a new fragment"""
+        url = reverse('loan:application-detail', args=[self.applications[0].id])
+        self.client.get(url)
+        Asset.objects.create(estate=self.applications[0].estate, description='Car', value=Decimal('5000.00'))
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.json()['estate']['asset_count'], 3)
+        self.assertEqual(response.json()['estate']['total_assets'], '5200.00')
+
+    def test_other_rows_are_rendered_fresh(self):
+        """Test the emails of the users and the expanded fields are not served from the fragment"""
+        self.client.get(APPLICATIONS_URL)
+        self.user.email = 'renamed@example.com'
+        self.user.save()
+
+        response = self.client.get(APPLICATIONS_URL, {'expand': 'user'})
+
+        self.assertTrue(all(result['created_by'] == 'renamed@example.com' for result in response.json()['results']))
+        self.assertTrue(all(result['user'] is None for result in response.json()['results']))
+        # the three applications and their estates missed on the first list, the applications hit on the second
+        self.assertEqual(fragment_cache.stats()['misses'], 6)
+        self.assertEqual(fragment_cache.stats()['hits'], 3)
+
+    def test_sparse_fields_have_their_own_fragments(self):
+        """Test ?fields= is not answered with the fragment of the full representation"""
+        self.client.get(APPLICATIONS_URL)
+
+        response = self.client.get(APPLICATIONS_URL, {'fields': 'id,amount'})
+
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'amount'})
+
+    def test_estate_list(self):
+        """Test the estate list is served from the estate fragments"""
+        first = self.client.get(ESTATES_URL)
+        with self.assertNumQueries(1):
+            second = self.client.get(ESTATES_URL)
+
+        self.assertEqual(second.json(), first.json())
@@ -0,0 +1,287 @@
+"""
+tests for the bulk import api and the import_data command
+"""
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from auditlog.models import LogEntry
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import (Application, ApplicationStatus, Agency, Solicitor, Estate, Asset, Expense, Dispute,
+                         PortfolioSummary)
+from loan.fields import reference_cache
+from loan.importer import IMPORTERS, ApplicationImporter, EstateImporter
+
+
+def import_url(kind):
+    return reverse('loan:import', args=[kind])
+
+
+def read_reports(response):
+    return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+
+class ImportAPITestCase(TestCase):
+    """Test the streaming import of applications and estates"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@example.com', password='testpass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.status = ApplicationStatus.objects.create(name='New')
+        self.agency = Agency.objects.create(name='Agency')
+        self.solicitor = Solicitor.objects.create(title='Mr', first_name='John', last_name='Smith',
+                                                  email='john@example.com', phone_number='123', agency=self.agency)
+
+    def application_row(self, amount='1000.00', term=12):
+        return {'amount': amount, 'term': term, 'application_status': self.status.id, 'agency': self.agency.id,
+                'lead_solicitor': self.solicitor.id, 'user': self.user.id}
+
+    def post(self, kind, body, content_type, **params):
+        url = import_url(kind)
+        if params:
+            url += '?' + '&'.join(f'{name}={value}' for name, value in params.items())
+        return self.client.post(url, body, content_type=content_type)
+
+    def post_jsonl(self, kind, rows, **params):
+        return self.post(kind, ''.join(json.dumps(row) + '\n' for row in rows), 'application/x-ndjson', **params)
+
+    def test_login_required(self):
+        """Test an anonymous import is refused"""
+        response = APIClient().post(import_url('applications'), '', content_type='text/csv')
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_unknown_kind_and_format(self):
+        """Test only applications and estates in CSV or JSON lines are accepted"""
+        self.assertEqual(self.post('agencies', '', 'text/csv').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.post('applications', '[]', 'application/json').status_code,
+                         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        self.assertEqual(self.post('applications', '', 'text/csv', skip='-1').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_content_type_parameters_are_ignored(self):
+        """Test a charset parameter does not make the content type unsupported"""
+        header = 'amount,term,application_status,agency,lead_solicitor\n'
+        row = f'1000.00,12,{self.status.id},{self.agency.id},{self.solicitor.id}\n'
+
+        reports = read_reports(self.post('applications', header + row, 'text/csv; charset=utf-8'))
+
+        self.assertEqual(reports, [{'committed': 1, 'created': 1, 'failed': 0}])
+
+    def test_csv_header_is_checked_before_the_import(self):
+        """Test a missing header, unknown columns or missing required ones are refused up front"""
+        row = f'1000.00,12,{self.status.id},{self.agency.id},{self.solicitor.id}\n'
+
+        empty = self.post('applications', '\n', 'text/csv')
+        headless = self.post('applications', row, 'text/csv')
+        unknown = self.post('estates', 'application,colour\n1,red\n', 'text/csv')
+
+        self.assertEqual(empty.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(headless.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Missing column: amount', headless.json()['header'])
+        self.assertEqual(unknown.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(unknown.json(), {'header': ['Unknown column: colour']})
+        self.assertFalse(Application.objects.exists())
+
+    def test_failure_while_streaming_ends_with_an_error_line(self):
+        """Test an import stopped part way reports it with the records committed so far"""
+        rows = [self.application_row(amount=f'{1000 + i}.00') for i in range(3)]
+        create = ApplicationImporter.create
+        calls = []
+
+        def fail_second_chunk(records_importer, validated):
+            calls.append(validated)
+            if len(calls) > 1:
+                raise RuntimeError('disk full')
+            return create(records_importer, validated)
+
+        with mock.patch.object(ApplicationImporter, 'create', fail_second_chunk), \
+                mock.patch.dict(IMPORTERS, {'applications': lambda user: ApplicationImporter(user, 2)}), \
+                self.assertLogs('loan.importer', 'ERROR'):
+            response = self.post_jsonl('applications', rows)
+            reports = read_reports(response)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(reports[0], {'committed': 2, 'created': 2, 'failed': 0})
+        self.assertEqual(reports[-1], {'error': 'Import stopped by a server error', 'committed': 2})
+        self.assertEqual(Application.objects.count(), 2)
+
+    def test_unreadable_input_ends_with_an_error_line(self):
+        """Test bytes that are not UTF-8 after the header stop the import with an error line"""
+        header = b'amount,term,application_status,agency,lead_solicitor\n'
+        row = f'1000.00,12,{self.status.id},{self.agency.id},{self.solicitor.id}\n'.encode()
+
+        reports = read_reports(self.post('applications', header + row + b'\xff\xfe,12\n', 'text/csv'))
+
+        self.assertIn('Unreadable input', reports[-1]['error'])
+        self.assertEqual(reports[-1]['committed'], 0)
+        self.assertFalse(Application.objects.exists())
+
+    def test_import_applications_csv(self):
+        """Test CSV rows are created with the importing user and counted in the portfolio summary"""
+        header = 'amount,term,application_status,agency,lead_solicitor,user\n'
+        rows = ''.join(f'{1000 + i}.00,12,{self.status.id},{self.agency.id},{self.solicitor.id},\n' for i in range(3))
+
+        response = self.post('applications', header + rows, 'text/csv')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(read_reports(response), [{'committed': 3, 'created': 3, 'failed': 0}])
+        applications = Application.objects.order_by('id')
+        self.assertEqual([application.amount for application in applications],
+                         [Decimal('1000'), Decimal('1001'), Decimal('1002')])
+        self.assertTrue(all(application.created_by == self.user and application.user is None
+                            for application in applications))
+        summary = PortfolioSummary.objects.filter(dimension='agency').aggregate(count=Sum('application_count'),
+                                                                                amount=Sum('total_amount'))
+        self.assertEqual(summary, {'count': 3, 'amount': Decimal('3003')})
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        """Test each invalid record is reported by its number while the valid ones are imported"""
+        rows = [self.application_row(), {**self.application_row(), 'agency': 999999}, self.application_row(term=99)]
+        body = ''.join(json.dumps(row) + '\n' for row in rows[:2]) + 'not json\n' + json.dumps(rows[2]) + '\n'
+
+        reports = read_reports(self.post('applications', body, 'application/x-ndjson'))
+
+        self.assertEqual([report['row'] for report in reports[:-1]], [2, 3, 4])
+        self.assertIn('agency', reports[0]['errors'])
+        self.assertIn('Invalid JSON', reports[1]['errors']['non_field_errors'][0])
+        self.assertIn('term', reports[2]['errors'])
+        self.assertEqual(reports[-1], {'committed': 4, 'created': 1, 'failed': 3})
+        self.assertEqual(Application.objects.count(), 1)
+
+    def test_resume_with_skip(self):
+        """Test ?skip= leaves out the records an earlier run committed"""
+        rows = [self.application_row(amount=f'{1000 + i}.00') for i in range(5)]
+
+        reports = read_reports(self.post_jsonl('applications', rows, skip=3))
+
+        self.assertEqual(reports, [{'committed': 5, 'created': 2, 'failed': 0}])
+        self.assertEqual(sorted(Application.objects.values_list('amount', flat=True)),
+                         [Decimal('1003'), Decimal('1004')])
+
+    def test_import_estates_jsonl(self):
+        """Test estates are created with their line items and totals, and move their application's summary row"""
+        application = Application.objects.create(amount=Decimal('500'), term=6, application_status=self.status)
+        estate = {'application': application.id,
+                  'asset_set': [{'description': 'House', 'value': '250000.00'}],
+                  'expense_set': [{'description': 'Funeral', 'value': '4000.00'}],
+                  'dispute_set': [{'description': 'Will contested'}]}
+
+        reports = read_reports(self.post_jsonl('estates', [estate]))
+
+        self.assertEqual(reports, [{'committed': 1, 'created': 1, 'failed': 0}])
+        created = Estate.objects.get(application=application)
+        self.assertEqual((created.net_value, created.asset_count, created.expense_count, created.dispute_count),
+                         (Decimal('246000'), 1, 1, 1))
+        summary = PortfolioSummary.objects.filter(dimension='agency')
+        self.assertEqual(summary.aggregate(value=Sum('total_estate_value'))['value'], Decimal('246000'))
+        for model in (Estate, Asset, Expense, Dispute):
+            self.assertEqual(LogEntry.objects.get_for_model(model).count(), 1)
+
+    def test_second_estate_of_an_application_is_refused(self):
+        """Test an estate is refused for an application that has one, in the database or earlier in the chunk"""
+        existing = Application.objects.create(amount=Decimal('500'), term=6)
+        Estate.objects.create(application=existing)
+        application = Application.objects.create(amount=Decimal('600'), term=6)
+        rows = [{'application': pk, 'asset_set': [], 'expense_set': [], 'dispute_set': []}
+                for pk in (existing.id, application.id, application.id)]
+
+        reports = read_reports(self.post_jsonl('estates', rows))
+
+        self.assertEqual([report['row'] for report in reports[:-1]], [1, 3])
+        self.assertTrue(all('application' in report['errors'] for report in reports[:-1]))
+        self.assertEqual(reports[-1], {'committed': 3, 'created': 1, 'failed': 2})
+        self.assertEqual(Estate.objects.filter(application=application).count(), 1)
+
+    def test_import_estates_csv(self):
+        """Test consecutive CSV line item rows of an application make up one estate"""
+        first = Application.objects.create(amount=Decimal('500'), term=6)
+        second = Application.objects.create(amount=Decimal('600'), term=6)
+        body = ('application,item_type,section,title,description,value\n'
+                f'{first.id},asset,Property,House,House in Cork,250000.00\n'
+                f'{first.id},expense,Legal,Fees,Solicitor fees,1000.00\n'
+                f'{second.id},,,,,\n'
+                f'{second.id},vehicle,,,Car,5000.00\n')
+
+        reports = read_reports(self.post('estates', body, 'text/csv'))
+
+        self.assertEqual(reports[0], {'row': 2, 'errors': {'non_field_errors': ['Unknown item_type: vehicle']}})
+        self.assertEqual(reports[1], {'committed': 2, 'created': 1, 'failed': 1})
+        estate = Estate.objects.get()
+        self.assertEqual(estate.application, first)
+        self.assertEqual(estate.asset_set.get().title, 'House')
+        self.assertEqual(estate.net_value, Decimal('249000'))
+
+    def test_queries_per_chunk(self):
+        """Test the queries of a chunk do not grow with the records in it"""
+
+        def count_queries(rows):
+            importer = ApplicationImporter(self.user)
+            reference_cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                list(importer.run(((row, None) for row in rows)))
+            return len(queries)
+
+        self.assertEqual(count_queries([self.application_row()]),
+                         count_queries([self.application_row() for _ in range(20)]))
+
+    def test_chunks_are_committed_separately(self):
+        """Test a progress report follows every chunk"""
+        importer = EstateImporter(self.user, chunk_size=2)
+        applications = [Application.objects.create(amount=Decimal('500'), term=6) for _ in range(5)]
+        records = ((estate, None) for estate in (
+            {'application': application.id, 'asset_set': [], 'expense_set': [], 'dispute_set': []}
+            for application in applications))
+
+        reports = list(importer.run(records))
+
+        self.assertEqual([report['committed'] for report in reports], [2, 4, 5])
+        self.assertEqual(Estate.objects.count(), 5)
+
+
+class ImportDataCommandTestCase(TestCase):
+    """Test the import_data command"""
+
+    def setUp(self):
+        self.status = ApplicationStatus.objects.create(name='New')
+        self.agency = Agency.objects.create(name='Agency')
+        self.solicitor = Solicitor.objects.create(title='Mr', first_name='John', last_name='Smith',
+                                                  email='john@example.com', phone_number='123', agency=self.agency)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'applications.jsonl')
+        with open(self.path, 'w') as data:
+            for i in range(5):
+                data.write(json.dumps({'amount': f'{1000 + i}.00', 'term': 12, 'application_status': self.status.id,
+                                       'agency': self.agency.id, 'lead_solicitor': self.solicitor.id}) + '\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_import_resumes_from_progress_file(self):
+        """Test the progress file records the committed records and a rerun starts after them"""
+        progress = os.path.join(self.directory.name, 'progress')
+        with open(progress, 'w') as progress_file:
+            progress_file.write('2')
+
+        out = StringIO()
+        call_command('import_data', 'applications', self.path, progress_file=progress, chunk_size=2, stdout=out)
+
+        self.assertIn('Resuming after 2 records', out.getvalue())
+        self.assertEqual(Application.objects.count(), 3)
+        with open(progress) as progress_file:
+            self.assertEqual(progress_file.read(), '5')
@@ -0,0 +1,145 @@
+"""
+Tests for the list response cache of the agency and solicitor lists
+"""
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.models import Agency, Solicitor
+from loan.cache import ListResponseCache, list_cache
+
+AGENCIES_URL = reverse('loan:agency-list')
+SOLICITORS_URL = reverse('loan:solicitor-list')
+
+
+def create_solicitor(agency, last_name='Smith'):
+    return Solicitor.objects.create(title='Mr', first_name='John', last_name=last_name, email='john@example.com',
+                                    phone_number='123', agency=agency)
+
+
+class ListResponseCacheTestCase(TestCase):
+    """Test cached lists are served without queries and dropped by writes"""
+
+    def setUp(self):
+        list_cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(email='test@example.com',
+                                                                            password='testpass'))
+        self.agency = Agency.objects.create(name='Agency')
+        create_solicitor(self.agency)
+
+    def test_hit_runs_no_query(self):
+        """Test the second list is served from the cache, without touching the database"""
+        first = self.client.get(AGENCIES_URL)
+        with self.assertNumQueries(0):
+            second = self.client.get(AGENCIES_URL)
+
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(list_cache.stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_query_parameters_are_cached_apart(self):
+        """Test each page size or cursor has its own entry"""
+        Agency.objects.create(name='Other agency')
+        self.client.get(AGENCIES_URL)
+
+        response = self.client.get(AGENCIES_URL, {'page_size': 1})
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_write_invalidates(self):
+        """Test saving or deleting an agency makes the next list read the database again"""
+        self.client.get(AGENCIES_URL)
+        self.agency.name = 'Renamed'
+        self.agency.save()
+
+        response = self.client.get(AGENCIES_URL)
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['results'][0]['name'], 'Renamed')
+
+        Agency.objects.create(name='Second').delete()
+        self.assertEqual(self.client.get(AGENCIES_URL)['X-Cache'], 'MISS')
+
+    def test_nested_solicitor_write_invalidates_agency_list(self):
+        """Test a solicitor write drops both lists, an agency write only the agency list"""
+        self.client.get(AGENCIES_URL)
+        self.client.get(SOLICITORS_URL)
+
+        create_solicitor(self.agency, last_name='Murphy')
+        agencies = self.client.get(AGENCIES_URL)
+        solicitors = self.client.get(SOLICITORS_URL)
+
+        self.assertEqual((agencies['X-Cache'], solicitors['X-Cache']), ('MISS', 'MISS'))
+        self.assertEqual(len(agencies.json()['results'][0]['solicitors']), 2)
+        self.assertEqual(len(solicitors.json()['results']), 2)
+
+        self.agency.save()
+        self.assertEqual(self.client.get(AGENCIES_URL)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(SOLICITORS_URL)['X-Cache'], 'HIT')
+
+    def test_api_write_invalidates(self):
+        """Test a create through the API is listed right away"""
+        self.client.get(SOLICITORS_URL)
+
+        self.client.post(SOLICITORS_URL, {'title': 'Ms', 'first_name': 'Mary', 'last_name': 'Murphy',
+                                          'email': 'mary@example.com', 'phone_number': '456',
+                                          'agency': self.agency.id})
+        response = self.client.get(SOLICITORS_URL)
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual([solicitor['last_name'] for solicitor in response.json()['results']], ['Murphy', 'Smith'])
+
+    def test_version_is_bumped_again_on_commit(self):
+        """Test a list cached before the write committed is not served after it"""
+        before = list_cache.version(Agency)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.agency.save()
+
+        self.assertEqual(list_cache.version(Agency), before + 2)
+
+    def test_lookups_are_counted_in_metrics(self):
+        """Test hits and misses are exported per list"""
+        self.client.get(SOLICITORS_URL)
+        self.client.get(SOLICITORS_URL)
+
+        text = self.client.get(reverse('metrics')).content.decode()
+
+        self.assertIn('list_response_cache_lookups_total{result="hit",view="solicitor"}', text)
+        self.assertIn('list_response_cache_lookups_total{result="miss",view="solicitor"}', text)
+
+    def test_disabled_cache_is_bypassed(self):
+        """Test the lists are read from the database when the cache is off"""
+        with mock.patch('loan.cache.list_cache', ListResponseCache(enabled=False)):
+            self.client.get(AGENCIES_URL)
+            response = self.client.get(AGENCIES_URL)
+
+        self.assertNotIn('X-Cache', response)
+        self.assertEqual(list_cache.stats()['hits'], 0)
+
+
+class ListResponseCacheSettingsTestCase(TestCase):
+    """Test the cache is only on when its version bumps reach every worker"""
+
+    @mock.patch.dict('os.environ', {'GUNICORN_WORKERS': '4'})
+    def test_disabled_with_several_workers_on_a_process_local_cache(self):
+        """Test the default LocMem cache keeps the list cache off under several workers"""
+        with self.assertLogs('loan.cache', level='WARNING'):
+            self.assertFalse(ListResponseCache.from_settings().enabled)
+
+    @mock.patch.dict('os.environ', {'GUNICORN_WORKERS': '4'})
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+                                           'LOCATION': 'memcached:11211'}})
+    def test_enabled_with_several_workers_on_a_shared_cache(self):
+        """Test memcached shared by the workers enables the list cache"""
+        self.assertTrue(ListResponseCache.from_settings().enabled)
+
+    @mock.patch.dict('os.environ', {'GUNICORN_WORKERS': '1'})
+    def test_enabled_with_a_single_worker(self):
+        """Test a single process needs no shared cache"""
+        self.assertTrue(ListResponseCache.from_settings().enabled)
@@ -0,0 +1,142 @@
+"""
+Tests for the portfolio report api
+"""
+from datetime import datetime, timezone
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Application, ApplicationStatus, Agency, Estate, Asset
+
+PORTFOLIO_URL = reverse('loan:portfolio-report')
+
+
+class PublicPortfolioAPITestCase(TestCase):
+    """Test unauthenticated API access"""
+
+    def test_login_required(self):
+        """Test that login is required for the report"""
+        response = APIClient().get(PORTFOLIO_URL)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivatePortfolioAPITestCase(TestCase):
+    """Test authenticated API access"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(email='test@example.com', password='testpass')
+        self.client.force_authenticate(self.user)
+        self.new = ApplicationStatus.objects.create(name="New")
+        self.approved = ApplicationStatus.objects.create(name="Approved")
+        self.agency = Agency.objects.create(name="Agency", house_number="1", street="Main Street",
+                                            town="Cork", county="Cork", eircode="T12AB34")
+
+        first = Application.objects.create(amount=Decimal("1000"), term=12, application_status=self.new,
+                                           agency=self.agency, user=self.user)
+        second = Application.objects.create(amount=Decimal("2000"), term=6, application_status=self.new)
+        third = Application.objects.create(amount=Decimal("500"), term=3, application_status=self.approved,
+                                           agency=self.agency)
+        Asset.objects.create(description="House", value=Decimal("250000"),
+                             estate=Estate.objects.create(application=first))
+        Asset.objects.create(description="Car", value=Decimal("5000"),
+                             estate=Estate.objects.create(application=third))
+        # date_submitted is set on create, move the last one back a month and rebuild to match
+        Application.objects.filter(id=second.id).update(date_submitted=datetime(2026, 9, 15, tzinfo=timezone.utc))
+        Application.objects.filter(id__in=[first.id, third.id]).update(
+            date_submitted=datetime(2026, 10, 2, tzinfo=timezone.utc))
+        call_command('rebuild_portfolio_summary', stdout=StringIO())
+
+    def test_totals_without_grouping(self):
+        """Test the report returns the totals of every application as one group"""
+        response = self.client.get(PORTFOLIO_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [{
+            'application_count': 3,
+            'total_amount': '3500.00',
+            'average_term': 7.0,
+            'total_estate_value': '255000.00',
+        }])
+
+    def test_group_by_status_and_month(self):
+        """Test the report breaks the totals down by the requested groups"""
+        response = self.client.get(PORTFOLIO_URL, {'group_by': 'application_status,month'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = {(row['application_status'], row['month']): row for row in response.data['results']}
+        self.assertEqual(set(rows), {(self.new.id, '2026-09'), (self.new.id, '2026-10'),
+                                     (self.approved.id, '2026-10')})
+        self.assertEqual(rows[(self.new.id, '2026-10')]['total_estate_value'], '250000.00')
+        self.assertEqual(rows[(self.new.id, '2026-09')]['total_amount'], '2000.00')
+        self.assertNotIn('agency', rows[(self.new.id, '2026-10')])
+
+    def test_applications_without_a_group_value_are_grouped_under_null(self):
+        """Test applications without an agency or user are reported with a null key"""
+        response = self.client.get(PORTFOLIO_URL, {'group_by': 'agency'})
+
+        rows = {row['agency']: row['application_count'] for row in response.data['results']}
+        self.assertEqual(rows, {self.agency.id: 2, None: 1})
+
+    def test_filter_by_month_and_agency(self):
+        """Test the report only covers the months and agencies asked for"""
+        response = self.client.get(PORTFOLIO_URL, {'month_from': '2026-10', 'agency': self.agency.id,
+                                                   'group_by': 'user'})
+
+        rows = {row['user']: row['application_count'] for row in response.data['results']}
+        self.assertEqual(rows, {self.user.id: 1, None: 1})
+
+    def test_single_dimension_reads_its_rollup(self):
+        """Test a report grouped and filtered by one dimension is read from the summary rows of that dimension"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(PORTFOLIO_URL, {'group_by': 'agency,month', 'agency': self.agency.id})
+
+        self.assertEqual([(row['agency'], row['month'], row['application_count']) for row in response.data['results']],
+                         [(self.agency.id, '2026-10', 2)])
+        self.assertIn('core_portfoliosummary', queries[0]['sql'])
+        self.assertIn("'agency'", queries[0]['sql'])
+
+    def test_several_dimensions_read_the_applications(self):
+        """Test a report combining dimensions no rollup covers is aggregated from the applications"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(PORTFOLIO_URL, {'group_by': 'agency,user', 'application_status': self.new.id})
+
+        rows = {(row['agency'], row['user']): (row['application_count'], row['total_estate_value'])
+                for row in response.data['results']}
+        self.assertEqual(rows, {(self.agency.id, self.user.id): (1, '250000.00'), (None, None): (1, '0.00')})
+        self.assertNotIn('core_portfoliosummary', queries[0]['sql'])
+
+    def test_report_follows_application_changes(self):
+        """Test a change to an application is reported without a rebuild"""
+        application = Application.objects.get(application_status=self.approved)
+        application.application_status = self.new
+        application.save()
+
+        response = self.client.get(PORTFOLIO_URL, {'group_by': 'application_status'})
+
+        self.assertEqual([(row['application_status'], row['application_count']) for row in response.data['results']],
+                         [(self.new.id, 3)])
+
+    def test_unknown_group_is_rejected(self):
+        """Test an unknown group_by or a malformed month is a validation error"""
+        response = self.client.get(PORTFOLIO_URL, {'group_by': 'solicitor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('group_by', response.data)
+
+        response = self.client.get(PORTFOLIO_URL, {'month_from': '2026-10-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('month_from', response.data)
+
+    def test_report_is_a_single_query(self):
+        """Test the report is a single query, however many applications there are"""
+        with self.assertNumQueries(1):
+            self.client.get(PORTFOLIO_URL, {'group_by': 'application_status,agency,user,month'})
@@ -0,0 +1,203 @@
+"""
+Query budgets of the loan api: every route and method declares the most queries it may run
+"""
+import json
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Application, ApplicationStatus, Agency, Solicitor, Estate, Asset, Expense, Dispute
+from core.query_budget import QueryBudget, QueryBudgetTestMixin, route_names
+from loan import urls
+from user.authentication import token_cache
+
+# rows of each list, enough for a query per row to go over a budget without one
+ROWS = 3
+
+# every request below pays one query for its token, served from the cache after that
+BUDGETS = {
+    'loan:api-root': {'GET': QueryBudget(0)},
+    'loan:line-item-search': {'GET': QueryBudget(2)},
+    'loan:portfolio-report': {'GET': QueryBudget(2)},
+    'loan:import': {'POST': QueryBudget(11)},
+    'loan:application-export': {'GET': QueryBudget(4)},
+    'loan:solicitor-list': {'GET': QueryBudget(2), 'POST': QueryBudget(6)},
+    'loan:solicitor-detail': {'GET': QueryBudget(2), 'PATCH': QueryBudget(7), 'DELETE': QueryBudget(7)},
+    'loan:agency-list': {'GET': QueryBudget(3), 'POST': QueryBudget(6)},
+    'loan:agency-detail': {'GET': QueryBudget(3), 'PATCH': QueryBudget(8), 'DELETE': QueryBudget(8)},
+    'loan:application-list': {'GET': QueryBudget(6), 'POST': QueryBudget(16)},
+    'loan:application-detail': {'GET': QueryBudget(6), 'PATCH': QueryBudget(10), 'DELETE': QueryBudget(7)},
+    'loan:estate-list': {'GET': QueryBudget(5), 'POST': QueryBudget(15)},
+    'loan:estate-detail': {'GET': QueryBudget(5), 'PUT': QueryBudget(20), 'PATCH': QueryBudget(14),
+                           'DELETE': QueryBudget(12)},
+    'loan:estate-line-items-bulk': {'POST': QueryBudget(10)},
+    'loan:asset-detail': {'GET': QueryBudget(2), 'PATCH': QueryBudget(7), 'DELETE': QueryBudget(8)},
+    'loan:expense-detail': {'GET': QueryBudget(2), 'PATCH': QueryBudget(7), 'DELETE': QueryBudget(8)},
+    'loan:dispute-detail': {'GET': QueryBudget(2), 'PATCH': QueryBudget(7), 'DELETE': QueryBudget(7)},
+    'loan:async-application-list': {'GET': QueryBudget(7)},
+    'loan:async-application-detail': {'GET': QueryBudget(7)},
+    'loan:async-estate-list': {'GET': QueryBudget(5)},
+    'loan:async-estate-detail': {'GET': QueryBudget(5)},
+    'loan:async-agency-list': {'GET': QueryBudget(3)},
+}
+
+
+def create_portfolio(user, rows=ROWS):
+    """Create agencies with solicitors and applications with estates, rows of each"""
+    application_status = ApplicationStatus.objects.create(name="New")
+    for i in range(rows):
+        agency = Agency.objects.create(name=f"Agency {i}", house_number="1", street="Main Street", town="Cork",
+                                       county="Cork", eircode="T12AB34")
+        solicitor = Solicitor.objects.create(title="Mr", first_name="John", last_name=f"Smith {i}",
+                                             email="john@example.com", phone_number="123", agency=agency)
+        Solicitor.objects.create(title="Ms", first_name="Mary", last_name=f"Murphy {i}",
+                                 email="mary@example.com", phone_number="456", agency=agency)
+        application = Application.objects.create(amount=Decimal(1000 + i), term=12,
+                                                 application_status=application_status, agency=agency,
+                                                 lead_solicitor=solicitor, user=user, created_by=user,
+                                                 last_updated_by=user)
+        estate = Estate.objects.create(application=application)
+        Asset.objects.create(title="House", description="House", value=Decimal("250000"), estate=estate)
+        Asset.objects.create(title="Car", description="Car", value=Decimal("5000"), estate=estate)
+        Expense.objects.create(title="Funeral", description="Funeral", value=Decimal("4000"), estate=estate)
+        Dispute.objects.create(description="Will contested", estate=estate)
+
+
+class QueryBudgetRequestsMixin(QueryBudgetTestMixin):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@example.com', password='testpass')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        create_portfolio(self.user)
+
+    def request(self, method, route, rows=0, args=(), data=None, content_type=None):
+        """Send a request with a cold token cache and assert it stays within the budget of its route"""
+        token_cache.clear()
+        options = {'content_type': content_type} if content_type else {'format': 'json'}
+        with self.assertQueryBudget(BUDGETS[route][method], rows, f'{method} {route}'):
+            response = getattr(self.client, method.lower())(reverse(route, args=args), data, **options)
+            # a streamed response runs its queries as it is read
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+        self.assertLess(response.status_code, 400, content)
+        return response
+
+
+class QueryBudgetTestCase(QueryBudgetRequestsMixin, TestCase):
+    """Test each route of the loan api stays within its query budget"""
+
+    def test_every_route_has_a_budget(self):
+        """Test a route added to loan/urls.py can not go without a budget"""
+        self.assertEqual(route_names(urls.urlpatterns, 'loan'), set(BUDGETS))
+
+    def test_lists(self):
+        """Test the lists cost the same whatever the number of rows"""
+        for route in ('loan:solicitor-list', 'loan:agency-list', 'loan:application-list', 'loan:estate-list'):
+            with self.subTest(route=route):
+                response = self.request('GET', route, rows=ROWS)
+                self.assertGreaterEqual(len(response.json()['results']), ROWS)
+        self.request('GET', 'loan:application-list', rows=ROWS, data={
+            'expand': 'user,agency,lead_solicitor,application_status'})
+        self.request('GET', 'loan:api-root')
+        self.request('GET', 'loan:line-item-search', rows=ROWS, data={'q': 'house'})
+        self.request('GET', 'loan:portfolio-report', data={'group_by': 'agency,month'})
+        self.request('GET', 'loan:application-export', rows=ROWS, data={'format': 'jsonl'})
+
+    def test_solicitors(self):
+        agency = Agency.objects.first()
+        solicitor = self.request('POST', 'loan:solicitor-list', data={
+            'title': 'Mr', 'first_name': 'Sean', 'last_name': 'Kelly', 'email': 'sean@example.com',
+            'phone_number': '789', 'agency': agency.id}).json()
+        self.request('GET', 'loan:solicitor-detail', args=[solicitor['id']])
+        self.request('PATCH', 'loan:solicitor-detail', args=[solicitor['id']], data={'phone_number': '000'})
+        self.request('DELETE', 'loan:solicitor-detail', args=[solicitor['id']])
+
+    def test_agencies(self):
+        agency = self.request('POST', 'loan:agency-list', data={
+            'name': 'New agency', 'house_number': '3', 'street': 'Main Street', 'town': 'Cork', 'county': 'Cork',
+            'eircode': 'T12AB36'}).json()
+        self.request('GET', 'loan:agency-detail', args=[Agency.objects.first().id])
+        self.request('PATCH', 'loan:agency-detail', args=[agency['id']], data={'town': 'Kinsale'})
+        self.request('DELETE', 'loan:agency-detail', args=[agency['id']])
+
+    def test_applications(self):
+        solicitor = Solicitor.objects.first()
+        application = self.request('POST', 'loan:application-list', data={
+            'amount': '5000.00', 'term': 12, 'user': self.user.id, 'agency': solicitor.agency_id,
+            'lead_solicitor': solicitor.id, 'application_status': ApplicationStatus.objects.get().id}).json()
+        self.request('GET', 'loan:application-detail', args=[Application.objects.first().id])
+        self.request('PATCH', 'loan:application-detail', args=[application['id']], data={'term': 24})
+        self.request('DELETE', 'loan:application-detail', args=[application['id']])
+
+    def test_estates(self):
+        application = Application.objects.create(amount=Decimal('500'), term=6)
+        estate = self.request('POST', 'loan:estate-list', data={
+            'application': application.id,
+            'asset_set': [{'description': f'Asset {i}', 'value': '100.00'} for i in range(ROWS)],
+            'expense_set': [{'description': f'Expense {i}', 'value': '10.00'} for i in range(ROWS)],
+            'dispute_set': [{'description': f'Dispute {i}'} for i in range(ROWS)],
+        }).json()
+        self.request('GET', 'loan:estate-detail', args=[estate['id']])
+        self.request('PUT', 'loan:estate-detail', rows=3 * ROWS, args=[estate['id']], data={
+            'application': application.id,
+            'asset_set': [{**asset, 'value': '200.00'} for asset in estate['asset_set']],
+            'expense_set': [{'description': f'New expense {i}', 'value': '20.00'} for i in range(ROWS)],
+            'dispute_set': estate['dispute_set'],
+        })
+        self.request('PATCH', 'loan:estate-detail', rows=ROWS, args=[estate['id']], data={'dispute_set': []})
+        self.request('POST', 'loan:estate-line-items-bulk', rows=ROWS, args=[estate['id'], 'assets'],
+                     data=[{'description': f'Bulk asset {i}', 'value': '5.00'} for i in range(ROWS)])
+        self.request('DELETE', 'loan:estate-detail', rows=3 * ROWS, args=[estate['id']])
+
+    def test_import(self):
+        solicitor = Solicitor.objects.first()
+        application = {'amount': '5000.00', 'term': 12, 'agency': solicitor.agency_id, 'lead_solicitor': solicitor.id,
+                       'application_status': ApplicationStatus.objects.get().id, 'user': self.user.id}
+        self.request('POST', 'loan:import', rows=ROWS, args=['applications'],
+                     data=''.join(json.dumps(application) + '\n' for _ in range(ROWS)),
+                     content_type='application/x-ndjson')
+        self.assertEqual(Application.objects.filter(amount=Decimal('5000')).count(), ROWS)
+
+        estate = {'asset_set': [{'description': 'House', 'value': '100.00'}],
+                  'expense_set': [{'description': 'Fees', 'value': '10.00'}], 'dispute_set': []}
+        self.request('POST', 'loan:import', rows=ROWS, args=['estates'],
+                     data=''.join(json.dumps({**estate, 'application': application_id}) + '\n'
+                                  for application_id in Application.objects.values_list('id', flat=True)[:ROWS]),
+                     content_type='application/x-ndjson')
+
+    def test_line_items(self):
+        for route, item in (('loan:asset-detail', Asset.objects.first()),
+                            ('loan:expense-detail', Expense.objects.first()),
+                            ('loan:dispute-detail', Dispute.objects.first())):
+            with self.subTest(route=route):
+                self.request('GET', route, args=[item.id])
+                self.request('PATCH', route, args=[item.id], data={'description': 'Changed'})
+                self.request('DELETE', route, args=[item.id])
+
+
+class AsyncQueryBudgetTestCase(QueryBudgetRequestsMixin, TransactionTestCase):
+    """Test the async routes stay within their query budgets, counting the queries of their worker threads"""
+
+    def setUp(self):
+        # let the worker threads close their connections after each query, so the test database can be dropped
+        self.conn_max_age = connection.settings_dict['CONN_MAX_AGE']
+        connection.settings_dict['CONN_MAX_AGE'] = 0
+        super().setUp()
+
+    def tearDown(self):
+        connection.settings_dict['CONN_MAX_AGE'] = self.conn_max_age
+
+    def test_async_routes(self):
+        for route in ('loan:async-application-list', 'loan:async-estate-list', 'loan:async-agency-list'):
+            with self.subTest(route=route):
+                self.request('GET', route, rows=ROWS)
+        self.request('GET', 'loan:async-application-list', rows=ROWS, data={
+            'expand': 'user,agency,lead_solicitor,application_status'})
+        self.request('GET', 'loan:async-application-detail', args=[Application.objects.first().id])
+        self.request('GET', 'loan:async-estate-detail', args=[Estate.objects.first().id])
@@ -0,0 +1,143 @@
+"""
+Tests for batched related field validation
+"""
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework import serializers as drf_serializers
+
+from core.models import ApplicationStatus, Agency, Solicitor
+
+from loan import serializers
+from loan.fields import BatchedPrimaryKeyRelatedField, BatchedRelatedFieldsMixin, ReferenceCache, reference_cache
+
+
+class TransferSerializer(BatchedRelatedFieldsMixin, drf_serializers.Serializer):
+    """Two fields reading the same model"""
+    from_agency = BatchedPrimaryKeyRelatedField(queryset=Agency.objects.all())
+    to_agency = BatchedPrimaryKeyRelatedField(queryset=Agency.objects.all())
+
+
+class BatchedRelatedFieldTestCase(TestCase):
+    """Test related ids are resolved with one query per model"""
+
+    def setUp(self):
+        reference_cache.clear()
+        self.user = get_user_model().objects.create_user(email='test@example.com', password='testpass')
+        self.status = ApplicationStatus.objects.create(name="Active")
+        self.agencies = [Agency.objects.create(name=f"Agency {i}") for i in range(5)]
+        self.solicitors = [Solicitor.objects.create(first_name="Test", last_name=f"Name {i}", agency=agency)
+                           for i, agency in enumerate(self.agencies)]
+
+    def payload(self, i=0, **params):
+        payload = {
+            "amount": "12345.67",
+            "term": 12,
+            "application_status": self.status.id,
+            "agency": self.agencies[i].id,
+            "lead_solicitor": self.solicitors[i].id,
+            "user": self.user.id,
+        }
+        payload.update(params)
+        return payload
+
+    def test_application_payload_validated_with_one_query_per_model(self):
+        """Test user, agency and lead solicitor cost one query each and the status comes from the cache"""
+        reference_cache.load(ApplicationStatus)
+
+        serializer = serializers.ApplicationSerializer(data=self.payload())
+        with self.assertNumQueries(3):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+
+        self.assertEqual(serializer.validated_data['agency'], self.agencies[0])
+        self.assertEqual(serializer.validated_data['application_status'], self.status)
+        self.assertEqual(serializer.validated_data['user'], self.user)
+
+    def test_application_list_payload_validated_with_one_query_per_model(self):
+        """Test the query count of a list payload does not grow with its length"""
+        reference_cache.load(ApplicationStatus)
+        payloads = [self.payload(i % 5) for i in range(20)]
+
+        serializer = serializers.ApplicationSerializer(data=payloads, many=True)
+        with self.assertNumQueries(3):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+
+        self.assertEqual([row['lead_solicitor'] for row in serializer.validated_data],
+                         [self.solicitors[i % 5] for i in range(20)])
+
+    def test_solicitor_list_payload_validated_with_one_query(self):
+        """Test solicitor agencies are resolved together"""
+        payloads = [{"title": "Mr", "first_name": "Test", "last_name": "Name", "email": "test@example.com",
+                     "phone_number": "123", "agency": agency.id} for agency in self.agencies]
+
+        serializer = serializers.SolicitorSerializer(data=payloads, many=True)
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+
+    def test_fields_of_the_same_model_share_one_query(self):
+        """Test the ids of two fields reading the same queryset are loaded together"""
+        serializer = TransferSerializer(data={'from_agency': self.agencies[0].id, 'to_agency': self.agencies[1].id})
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+
+        self.assertEqual(serializer.validated_data, {'from_agency': self.agencies[0], 'to_agency': self.agencies[1]})
+
+    def test_unknown_and_malformed_ids_are_rejected(self):
+        """Test the usual errors are reported per field"""
+        serializer = serializers.ApplicationSerializer(data=self.payload(agency=999999, lead_solicitor="abc",
+                                                                         application_status=999999))
+
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['agency'][0].code, 'does_not_exist')
+        self.assertEqual(serializer.errors['lead_solicitor'][0].code, 'incorrect_type')
+        self.assertEqual(serializer.errors['application_status'][0].code, 'does_not_exist')
+
+    def test_reference_cache_follows_status_writes(self):
+        """Test new and renamed statuses are seen by the cache"""
+        self.assertEqual(reference_cache.get(ApplicationStatus, self.status.id).name, "Active")
+
+        self.status.name = "Settled"
+        self.status.save()
+        new_status = ApplicationStatus.objects.create(name="New")
+
+        self.assertEqual(reference_cache.get(ApplicationStatus, self.status.id).name, "Settled")
+        self.assertEqual(reference_cache.get(ApplicationStatus, new_status.id), new_status)
+        with self.assertNumQueries(0):
+            reference_cache.get(ApplicationStatus, new_status.id)
+
+    def test_unknown_ids_are_remembered_for_a_while(self):
+        """Test an unknown id reloads the table once per miss timeout"""
+        reference_cache.load(ApplicationStatus)
+        with self.assertNumQueries(1):
+            self.assertIsNone(reference_cache.get(ApplicationStatus, 999999))
+            self.assertIsNone(reference_cache.get(ApplicationStatus, 999999))
+
+        later = time.monotonic() + reference_cache.miss_timeout + 1
+        with mock.patch('loan.fields.time.monotonic', return_value=later):
+            with self.assertNumQueries(1):
+                self.assertIsNone(reference_cache.get(ApplicationStatus, 999999))
+
+    def test_writes_reach_the_copies_of_other_workers(self):
+        """Test a row deleted or added through another worker's cache is seen once the version is read again"""
+        other_worker = ReferenceCache(version_check_interval=0)
+        self.assertEqual(other_worker.get(ApplicationStatus, self.status.id), self.status)
+
+        status_id = self.status.id
+        self.status.delete()
+        new_status = ApplicationStatus.objects.create(name="New")
+
+        self.assertIsNone(other_worker.get(ApplicationStatus, status_id))
+        self.assertEqual(other_worker.get(ApplicationStatus, new_status.id), new_status)
+
+    @mock.patch.dict('os.environ', {'GUNICORN_WORKERS': '4'})
+    def test_disabled_with_several_workers_on_a_process_local_cache(self):
+        """Test the copies are not kept when the version bumps would not reach the other workers"""
+        with self.assertLogs('loan.fields', level='WARNING'):
+            cache = ReferenceCache.from_settings()
+
+        self.assertFalse(cache.enabled)
+        with self.assertNumQueries(2):
+            self.assertEqual(cache.get(ApplicationStatus, self.status.id), self.status)
+            self.assertEqual(cache.get(ApplicationStatus, self.status.id), self.status)
@@ -0,0 +1,93 @@
+"""
+Tests for line item search api
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Application, Estate, Asset, Expense, Dispute
+
+SEARCH_URL = reverse('loan:line-item-search')
+
+
+class PublicSearchAPITestCase(TestCase):
+    """Test unauthenticated API access"""
+
+    def test_login_required(self):
+        """Test that login is required for searching"""
+        response = APIClient().get(SEARCH_URL, {'q': 'house'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateSearchAPITestCase(TestCase):
+    """Test authenticated API access"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(email='test@example.com', password='testpass')
+        self.client.force_authenticate(self.user)
+        self.application = Application.objects.create(amount=Decimal("350000"), term=12)
+        self.estate = Estate.objects.create(application=self.application)
+
+    def test_search_returns_ranked_matches_with_estate_and_application(self):
+        """Test matches across all line item types are ranked and linked to their estate and application"""
+        house = Asset.objects.create(title="Family house", description="Three bed house in Cork, house contents",
+                                     value=Decimal("250000"), estate=self.estate)
+        Asset.objects.create(title="Car", description="Ford Focus", value=Decimal("5000"), estate=self.estate)
+        repairs = Expense.objects.create(title="Repairs", description="Roof repairs on the house",
+                                         value=Decimal("4000"), estate=self.estate)
+        dispute = Dispute.objects.create(description="Sibling contests the house valuation", estate=self.estate)
+
+        response = self.client.get(SEARCH_URL, {'q': 'house'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual({(row['type'], row['id']) for row in results},
+                         {('asset', house.id), ('expense', repairs.id), ('dispute', dispute.id)})
+        self.assertEqual(results[0]['id'], house.id)
+        self.assertEqual([row['rank'] for row in results], sorted((row['rank'] for row in results), reverse=True))
+        self.assertTrue(all(row['estate'] == self.estate.id for row in results))
+        self.assertTrue(all(row['application'] == self.application.id for row in results))
+
+    def test_search_follows_updates(self):
+        """Test the search vector is recomputed when a description changes"""
+        asset = Asset.objects.create(description="Vintage piano", value=Decimal("100"), estate=self.estate)
+        asset.description = "Vintage violin"
+        asset.save()
+
+        self.assertEqual(self.client.get(SEARCH_URL, {'q': 'piano'}).data['results'], [])
+        self.assertEqual(len(self.client.get(SEARCH_URL, {'q': 'violin'}).data['results']), 1)
+
+    def test_search_filtered_by_type_and_paginated(self):
+        """Test the type filter and the next page link"""
+        for i in range(3):
+            Asset.objects.create(description=f"Painting number {i}", value=Decimal("10"), estate=self.estate)
+        Expense.objects.create(description="Painting restoration", value=Decimal("10"), estate=self.estate)
+
+        response = self.client.get(SEARCH_URL, {'q': 'painting', 'type': 'asset', 'limit': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertTrue(all(row['type'] == 'asset' for row in response.data['results']))
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+    def test_search_requires_valid_parameters(self):
+        """Test a missing query or unknown type is rejected"""
+        self.assertEqual(self.client.get(SEARCH_URL).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(SEARCH_URL, {'q': 'house', 'type': 'estate'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_uses_gin_index(self):
+        """Test the match condition is answered from the GIN index"""
+        query = Asset.objects.filter(search_vector='house')
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = query.explain()
+        self.assertIn('asset_search_idx', plan)
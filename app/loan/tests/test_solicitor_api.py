@@ -82,9 +82,22 @@ class PrivateSolicitorAPITestCase(APITestCase):
         create_solicitor(email="test2@example.com")
         response = self.client.get(self.SOLICITOR_URL)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        solicitors = Solicitor.objects.all().order_by('last_name')
+        solicitors = Solicitor.objects.all().order_by('last_name', 'id')
         serializer = SolicitorSerializer(solicitors, many=True)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
+
+    def test_solicitor_pages_are_stable_across_equal_last_names(self):
+        """Test paging through solicitors sharing a last name returns each one exactly once"""
+        solicitors = [create_solicitor(last_name=last_name) for last_name in ("Byrne", "Byrne", "Byrne", "Adams", "Byrne")]
+
+        response = self.client.get(self.SOLICITOR_URL, {'page_size': 2})
+        ids = [solicitor['id'] for solicitor in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [solicitor['id'] for solicitor in response.data['results']]
+
+        expected = Solicitor.objects.filter(id__in=[s.id for s in solicitors]).order_by('last_name', 'id')
+        self.assertEqual(ids, [solicitor.id for solicitor in expected])
 
     def test_create_solicitor_without_agency(self):
         """test creating a solicitor create solicitor without agency returns error"""
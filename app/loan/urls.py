@@ -6,7 +6,7 @@ from django.urls import path, include
 
 from rest_framework.routers import DefaultRouter
 
-from loan import views
+from loan import views, async_views
 
 router = DefaultRouter()
 router.register('solicitors', views.SolicitorViewSet, basename='solicitor')
@@ -20,5 +20,14 @@ router.register('disputes', views.DisputeViewSet, basename='dispute')
 app_name = 'loan'
 
 urlpatterns = [
+    path('search/', views.LineItemSearchView.as_view(), name='line-item-search'),
+    path('reports/portfolio/', views.PortfolioReportView.as_view(), name='portfolio-report'),
+    path('export/applications/', views.ApplicationExportView.as_view(), name='application-export'),
+    path('import/<str:kind>/', views.ImportView.as_view(), name='import'),
+    path('async/applications/', async_views.application_list, name='async-application-list'),
+    path('async/applications/<int:pk>/', async_views.application_detail, name='async-application-detail'),
+    path('async/estates/', async_views.estate_list, name='async-estate-list'),
+    path('async/estates/<int:pk>/', async_views.estate_detail, name='async-estate-detail'),
+    path('async/agencies/', async_views.agency_list, name='async-agency-list'),
     path('', include(router.urls)),
 ]
@@ -1,19 +1,34 @@
 """
 Views ro loan API
 """
+from datetime import timezone
+from decimal import Decimal
 
-from django.http import JsonResponse
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import CharField, Count, DateField, F, Prefetch, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 
-from rest_framework import viewsets, mixins
-from rest_framework.authentication import TokenAuthentication
+from rest_framework import viewsets, mixins, generics, renderers, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import UnsupportedMediaType, ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from loan import serializers
-from core.models import (Solicitor, Agency, Application, Estate, Asset, Expense, Dispute, )
+from loan.cache import CachedListMixin
+from loan.fragments import CACHE_FRAGMENTS, fragment_cache
+from user.authentication import CachedTokenAuthentication
+from loan import pagination
+from loan import filters
+from loan import importer
+from loan import export
+from core import audit
+from core.models import (Solicitor, Agency, Application, Estate, Asset, Expense, Dispute, PortfolioSummary, )
 
 
-class SolicitorViewSet(mixins.ListModelMixin,
+class SolicitorViewSet(CachedListMixin,
+                       mixins.ListModelMixin,
                        mixins.CreateModelMixin,
                        mixins.DestroyModelMixin,
                        mixins.UpdateModelMixin,
@@ -21,15 +36,18 @@ class SolicitorViewSet(mixins.ListModelMixin,
                        viewsets.GenericViewSet):
     """ViewSet for listing Solicitors"""
     serializer_class = serializers.SolicitorSerializer
+    pagination_class = pagination.SolicitorPagination
     queryset = Solicitor.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    list_cache_models = (Solicitor,)
 
     def get_queryset(self):
-        return self.queryset.order_by('last_name')
+        return self.queryset.order_by('last_name', 'id')
 
 
-class AgencyViewSet(mixins.ListModelMixin,
+class AgencyViewSet(CachedListMixin,
+                    mixins.ListModelMixin,
                     mixins.CreateModelMixin,
                     mixins.DestroyModelMixin,
                     mixins.UpdateModelMixin,
@@ -37,23 +55,55 @@ class AgencyViewSet(mixins.ListModelMixin,
                     viewsets.GenericViewSet):
     """ViewSet for listing Agencies"""
     serializer_class = serializers.AgencySerializer
+    pagination_class = pagination.AgencyPagination
     queryset = Agency.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    # the list nests the solicitors of each agency
+    list_cache_models = (Agency, Solicitor)
 
     def get_queryset(self):
-        return self.queryset.order_by('name')
+        queryset = self.queryset.order_by('name', 'id')
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.prefetch_related(Prefetch('solicitors', queryset=Solicitor.objects.order_by('id')))
+        return queryset
 
 
 class ApplicationViewSet(viewsets.ModelViewSet):
     """ViewSet for manage Applications APIs"""
     serializer_class = serializers.ApplicationDetailSerializer
+    pagination_class = pagination.ApplicationPagination
+    filter_backends = (filters.ApplicationFilter, filters.EstateTotalsFilter, filters.StableOrderingFilter)
+    ordering_fields = ('id', 'amount', 'term', 'date_submitted',
+                       'estate_total_assets', 'estate_total_expenses', 'estate_net_value', 'estate_surplus')
+    ordering = ('-id',)
     queryset = Application.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
-        return self.queryset.order_by('-id')
+        queryset = self.queryset.order_by('-id')
+        if self.action in ('list', 'retrieve'):
+            fields, expand = self.get_representation_options()
+            queryset = serializers.ApplicationSerializer.setup_eager_loading(queryset, fields, expand,
+                                                                             line_items=not self.cache_fragments)
+        return queryset
+
+    def get_serializer_context(self):
+        """Pass the requested ?fields= and ?expand= on to the serializer for reads."""
+        context = super().get_serializer_context()
+        if self.action in ('list', 'retrieve'):
+            context['fields'], context['expand'] = self.get_representation_options()
+            context[CACHE_FRAGMENTS] = self.cache_fragments
+        return context
+
+    @property
+    def cache_fragments(self):
+        """Reads render the applications from the fragment cache, see loan.fragments"""
+        return fragment_cache.enabled and self.action in ('list', 'retrieve')
+
+    def get_representation_options(self):
+        return serializers.ApplicationSerializer.get_representation_options(self.request.query_params)
 
     def get_serializer_class(self):
         """Return the serializer class for request."""
@@ -71,19 +121,95 @@ class ApplicationViewSet(viewsets.ModelViewSet):
         serializer.save(last_updated_by=self.request.user)
 
 
+class ApplicationExportView(generics.GenericAPIView):
+    """
+    Every application matching the list filters with its estate totals, as CSV (?format=csv, the default)
+    or JSON lines (?format=jsonl). Rows are streamed from a server-side cursor, see loan.export.
+    """
+    filter_backends = ApplicationViewSet.filter_backends
+    ordering_fields = ApplicationViewSet.ordering_fields
+    ordering = ApplicationViewSet.ordering
+    renderer_classes = (export.CSVRenderer, export.JSONLinesRenderer)
+    queryset = Application.objects.all()
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        # every row carries the totals, whether or not they are filtered on
+        return filters.annotate_estate_totals(super().get_queryset())
+
+    def get(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        rows = export.read_rows(self.filter_queryset(self.get_queryset()))
+        response = StreamingHttpResponse(export.STREAMS[renderer.format](rows),
+                                         content_type=f'{renderer.media_type}; charset={renderer.charset}')
+        response['Content-Disposition'] = f'attachment; filename="applications.{renderer.format}"'
+        return response
+
+    def handle_exception(self, exc):
+        # errors are answered in JSON, whichever format the export was asked in
+        self.request.accepted_renderer = renderers.JSONRenderer()
+        self.request.accepted_media_type = renderers.JSONRenderer.media_type
+        return super().handle_exception(exc)
+
+
 class EstateViewSet(mixins.CreateModelMixin,
                     mixins.ListModelMixin,
                     mixins.RetrieveModelMixin,
+                    mixins.UpdateModelMixin,
                     mixins.DestroyModelMixin,
                     viewsets.GenericViewSet):
     """ViewSet for manage Estates APIs"""
     serializer_class = serializers.EstateSerializer
+    pagination_class = pagination.EstatePagination
     queryset = Estate.objects.all().order_by('-id')
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
+    # line item sets that can be appended to in bulk, by url segment
+    line_item_kinds = {
+        'assets': (Asset, serializers.AssetSerializer),
+        'expenses': (Expense, serializers.ExpensesSerializer),
+        'disputes': (Dispute, serializers.DisputeSerializer),
+    }
+    max_bulk_items = 10000
+
     def get_queryset(self):
-        return self.queryset.order_by('-id')
+        queryset = self.queryset.order_by('-id')
+        if self.action in ('list', 'retrieve') and not self.cache_fragments:
+            queryset = queryset.prefetch_related('asset_set', 'expense_set', 'dispute_set')
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ('list', 'retrieve'):
+            context[CACHE_FRAGMENTS] = self.cache_fragments
+        return context
+
+    @property
+    def cache_fragments(self):
+        """Reads render the estates from the fragment cache, which loads the line items of its misses only"""
+        return fragment_cache.enabled and self.action in ('list', 'retrieve')
+
+    def perform_destroy(self, instance):
+        # the line items are deleted with the estate, their deletion entries are inserted together
+        with audit.buffered_audit():
+            instance.delete()
+
+    @action(detail=True, methods=['post'], url_path=r'(?P<kind>assets|expenses|disputes)/bulk',
+            url_name='line-items-bulk')
+    def bulk_line_items(self, request, pk=None, kind=None):
+        """Add a list of assets, expenses or disputes to the estate, validated together and inserted in batches"""
+        estate = self.get_object()
+        model, serializer_class = self.line_item_kinds[kind]
+        if not isinstance(request.data, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of items.']})
+        if len(request.data) > self.max_bulk_items:
+            raise ValidationError({'non_field_errors': [f'At most {self.max_bulk_items} items can be added at once.']})
+        serializer = serializer_class(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        items = serializers.EstateSerializer.append_line_items(estate, model, serializer.validated_data)
+        return Response({'ids': [item.pk for item in items]}, status=status.HTTP_201_CREATED)
 
 
 class AssetViewSet(mixins.RetrieveModelMixin,
@@ -93,7 +219,7 @@ class AssetViewSet(mixins.RetrieveModelMixin,
                    ):
     serializer_class = serializers.AssetSerializer
     queryset = Asset.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
 
@@ -104,7 +230,7 @@ class ExpenseViewSet(mixins.RetrieveModelMixin,
                      ):
     serializer_class = serializers.ExpensesSerializer
     queryset = Expense.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
 
@@ -115,5 +241,148 @@ class DisputeViewSet(mixins.RetrieveModelMixin,
                      ):
     serializer_class = serializers.DisputeSerializer
     queryset = Dispute.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+
+class LineItemSearchView(generics.ListAPIView):
+    """Ranked full text search over asset, expense and dispute titles and descriptions"""
+    serializer_class = serializers.LineItemSearchResultSerializer
+    pagination_class = pagination.SearchPagination
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    line_item_models = {'asset': Asset, 'expense': Expense, 'dispute': Dispute}
+
+    def get_queryset(self):
+        terms = self.request.query_params.get('q', '').strip()
+        if not terms:
+            raise ValidationError({'q': ['This query parameter is required.']})
+        types = [name for name in self.request.query_params.get('type', '').split(',') if name]
+        unknown_types = [name for name in types if name not in self.line_item_models]
+        if unknown_types:
+            raise ValidationError({'type': [f"Unknown type: {name}" for name in unknown_types]})
+
+        query = SearchQuery(terms, config='english', search_type='websearch')
+        querysets = [
+            self.search(name, self.line_item_models[name], query)
+            for name in types or self.line_item_models
+        ]
+        return querysets[0].union(*querysets[1:], all=True).order_by('-rank', 'result_type', 'result_id')
+
+    @staticmethod
+    def search(name, model, query):
+        """Return the matches of one line item table, in the column layout shared by all of them"""
+        title = F('title') if name != 'dispute' else Value(None, output_field=CharField())
+        return model.objects.filter(search_vector=query).values(
+            result_type=Value(name, output_field=CharField()),
+            result_id=F('id'),
+            result_estate=F('estate_id'),
+            result_application=F('estate__application_id'),
+            result_title=title,
+            result_description=F('description'),
+            rank=SearchRank(F('search_vector'), query),
+        )
+
+
+class PortfolioReportView(generics.GenericAPIView):
+    """
+    Application count, amount, average term and estate value totals, read from the precomputed PortfolioSummary.
+
+    ?group_by= takes a comma separated list of application_status, agency, user and month,
+    without it the totals of every matching application are returned as a single group.
+    A report grouped or filtered by one of application_status, agency and user reads the rollup of that dimension,
+    one combining several of them has no rollup to read and aggregates the applications instead.
+    """
+    serializer_class = serializers.PortfolioReportRowSerializer
+    filter_backends = (filters.PortfolioSummaryFilter,)
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    group_columns = {'application_status': 'status_key', 'agency': 'agency_key', 'user': 'user_key', 'month': 'month'}
+    totals = {
+        'application_count': Sum('application_count'),
+        'total_amount': Sum('total_amount'),
+        'total_term': Sum('total_term'),
+        'total_estate_value': Sum('total_estate_value'),
+    }
+    application_totals = {
+        'application_count': Count('id'),
+        'total_amount': Sum('amount'),
+        'total_term': Sum('term'),
+        'total_estate_value': Coalesce(Sum('estate__net_value'), Value(Decimal('0.00'))),
+    }
+
+    def get_group_by(self):
+        group_by = [name for name in self.request.query_params.get('group_by', '').split(',') if name]
+        unknown = [name for name in group_by if name not in self.group_columns]
+        if unknown:
+            raise ValidationError({'group_by': [f"Unknown group: {name}" for name in unknown]})
+        return list(dict.fromkeys(group_by))
+
+    def get_rollup(self):
+        """Return the PortfolioSummary dimension the report can be read from, None when it needs several"""
+        dimensions = {name for name in [*self.get_group_by(), *self.request.query_params]
+                      if name in PortfolioSummary.DIMENSIONS}
+        if len(dimensions) > 1:
+            return None
+        # every application is counted once in each rollup, the status one has the fewest rows
+        return dimensions.pop() if dimensions else 'application_status'
+
+    def get_queryset(self):
+        rollup = self.get_rollup()
+        if rollup is None:
+            none_key = Value(PortfolioSummary.NONE_KEY)
+            return Application.objects.annotate(
+                status_key=Coalesce('application_status_id', none_key),
+                agency_key=Coalesce('agency_id', none_key),
+                user_key=Coalesce('user_id', none_key),
+                month=TruncMonth('date_submitted', output_field=DateField(), tzinfo=timezone.utc),
+            )
+        return PortfolioSummary.objects.filter(dimension=rollup).annotate(**{self.group_columns[rollup]: F('key')})
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'group_by': self.get_group_by()}
+
+    def get(self, request, *args, **kwargs):
+        columns = [self.group_columns[name] for name in self.get_group_by()]
+        queryset = self.filter_queryset(self.get_queryset())
+        totals = self.application_totals if queryset.model is Application else self.totals
+        if columns:
+            rows = (queryset.values(*columns).annotate(**totals)
+                    .filter(application_count__gt=0).order_by(*columns))
+        else:
+            rows = [queryset.aggregate(**totals)]
+            if not rows[0]['application_count']:
+                rows = []
+        serializer = self.get_serializer(rows, many=True)
+        return Response({'results': serializer.data})
+
+
+class ImportView(generics.GenericAPIView):
+    """
+    Bulk import of applications or estates, posted as CSV (text/csv) or JSON lines (application/x-ndjson).
+
+    The body is read and written a chunk at a time while the response streams one JSON line per invalid record and
+    per committed chunk, see loan.importer. A CSV header is checked before the response starts, an import stopped
+    later ends with an {"error": ...} line. ?skip= resumes an import after the records it reported committed.
+    """
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, kind):
+        importer_class = importer.IMPORTERS.get(kind)
+        if importer_class is None:
+            raise Http404
+        file_format = importer.FORMATS.get(request.content_type.partition(';')[0].strip().lower())
+        if file_format is None:
+            raise UnsupportedMediaType(request.content_type)
+        skip = request.query_params.get('skip', '0')
+        if not skip.isdigit():
+            raise ValidationError({'skip': ['A non negative integer is required.']})
+
+        # the header is checked before the response starts, the records are read from the request as the response
+        # is sent, after the view and its middleware are done
+        records_importer = importer_class(request.user)
+        lines = records_importer.check_header(importer.decode_lines(request.stream or ()), file_format)
+        records = records_importer.parse(lines, file_format)
+        reports = importer.report_lines(records_importer.run(records, skip=int(skip)), committed=int(skip))
+        return StreamingHttpResponse(reports, content_type='application/x-ndjson')
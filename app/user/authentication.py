@@ -0,0 +1,197 @@
+"""
+Token authentication with a cache in front of the token and user lookup
+"""
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from core import metrics
+from core.cache import invalidations_reach_every_worker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'TIMEOUT': 60,
+    'MAX_ENTRIES': 10000,
+    # alias of a Django cache shared by all workers, None keeps the cache process local
+    'SHARED_CACHE': None,
+}
+
+
+class TokenCache:
+    """
+    LRU cache of token key -> (user, token) with a time to live.
+
+    Entries are kept in process and optionally mirrored to a shared Django cache. With a shared cache each user
+    also has a generation counter there, so an invalidation in one worker is seen by the others on their next hit.
+    Without it other workers would keep a stale entry until it times out, so from_settings() leaves the cache off
+    when gunicorn runs several workers and no shared cache is configured.
+    """
+
+    def __init__(self, timeout=60, max_entries=10000, shared_cache=None, enabled=True):
+        self.enabled = enabled
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.shared_cache = caches[shared_cache] if shared_cache else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULT_SETTINGS, **getattr(settings, 'TOKEN_AUTH_CACHE', {})}
+        enabled = invalidations_reach_every_worker(options['SHARED_CACHE'])
+        if not enabled:
+            logger.warning('Token authentication cache disabled: several workers and no shared cache, a revoked '
+                           'token would keep authenticating on the other workers. Set TOKEN_AUTH_CACHE SHARED_CACHE.')
+        return cls(timeout=options['TIMEOUT'], max_entries=options['MAX_ENTRIES'],
+                   shared_cache=options['SHARED_CACHE'], enabled=enabled)
+
+    def get(self, key):
+        """Return a copy of the cached (user, token) for the key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            credentials, expires, generation = entry
+            if expires > time.monotonic() and generation == self._generation(credentials[0].pk):
+                self.hits += 1
+                metrics.token_cache_lookups.labels('hit').inc()
+                return copy.deepcopy(credentials)
+            self._discard(key)
+
+        if self.shared_cache is not None:
+            shared = self.shared_cache.get(self._shared_key(key))
+            if shared is not None:
+                credentials, generation = shared
+                if generation == self._generation(credentials[0].pk):
+                    self._store(key, credentials, generation)
+                    self.hits += 1
+                    metrics.token_cache_lookups.labels('hit').inc()
+                    return copy.deepcopy(credentials)
+
+        self.misses += 1
+        metrics.token_cache_lookups.labels('miss').inc()
+        return None
+
+    def set(self, key, user, token):
+        generation = self._generation(user.pk)
+        credentials = copy.deepcopy((user, token))
+        self._store(key, credentials, generation)
+        if self.shared_cache is not None:
+            self.shared_cache.set(self._shared_key(key), (credentials, generation), self.timeout)
+
+    def invalidate_key(self, key):
+        self._discard(key)
+        if self.shared_cache is not None:
+            self.shared_cache.delete(self._shared_key(key))
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry[0][0].pk == user_id]
+            for key in keys:
+                del self._entries[key]
+        if self.shared_cache is not None:
+            generation_key = self._generation_key(user_id)
+            try:
+                self.shared_cache.incr(generation_key)
+            except ValueError:
+                self.shared_cache.set(generation_key, 1, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self._entries),
+        }
+
+    def _store(self, key, credentials, generation):
+        with self._lock:
+            self._entries[key] = (credentials, time.monotonic() + self.timeout, generation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _generation(self, user_id):
+        if self.shared_cache is None:
+            return 0
+        return self.shared_cache.get(self._generation_key(user_id), 0)
+
+    @staticmethod
+    def _shared_key(key):
+        return f'auth-token:{key}'
+
+    @staticmethod
+    def _generation_key(user_id):
+        return f'auth-token-generation:{user_id}'
+
+
+token_cache = TokenCache.from_settings()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Drop-in TokenAuthentication that serves repeated tokens from token_cache instead of the database"""
+
+    def authenticate_credentials(self, key):
+        if not token_cache.enabled:
+            return super().authenticate_credentials(key)
+        credentials = token_cache.get(key)
+        if credentials is not None:
+            return credentials
+
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token)
+        return user, token
+
+
+def _invalidate(invalidate):
+    invalidate()
+    # invalidated again once the write is committed, a request that authenticated while it was not yet visible
+    # cached the credentials as they were before it
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """Drop the deleted token, and the user's generation so other workers drop their own copies of it"""
+    key, user_id = instance.key, instance.user_id
+
+    def invalidate():
+        token_cache.invalidate_key(key)
+        token_cache.invalidate_user(user_id)
+
+    _invalidate(invalidate)
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_changed_user(sender, instance, **kwargs):
+    """Drop cached credentials on any user write, this covers deactivation and password changes"""
+    user_id = instance.pk
+    _invalidate(lambda: token_cache.invalidate_user(user_id))
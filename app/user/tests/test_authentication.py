@@ -0,0 +1,185 @@
+"""
+Tests for the cached token authentication
+"""
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from user.authentication import TokenCache, token_cache
+
+ME_URL = reverse("user:me")
+
+SHARED_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'token-auth-tests'},
+}
+
+MEMCACHED_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache', 'LOCATION': 'memcached:11211'},
+}
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Test requests authenticated with a token"""
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = get_user_model().objects.create_user(email="test@example.com", password="testpass123")
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def test_repeated_requests_skip_the_token_query(self):
+        """Test the second request is authenticated from the cache"""
+        self.assertEqual(self.client.get(ME_URL).status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(ME_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['email'], self.user.email)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+        self.assertEqual(token_cache.stats()['misses'], 1)
+
+    def test_invalid_token_is_rejected(self):
+        """Test an unknown token still fails"""
+        self.client.credentials(HTTP_AUTHORIZATION="Token not-a-token")
+        self.assertEqual(self.client.get(ME_URL).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_token_is_rejected(self):
+        """Test deleting the token invalidates the cached entry"""
+        self.client.get(ME_URL)
+        self.token.delete()
+
+        self.assertEqual(self.client.get(ME_URL).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_is_rejected(self):
+        """Test deactivating the user invalidates the cached entry"""
+        self.client.get(ME_URL)
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.client.get(ME_URL).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_invalidates_cache(self):
+        """Test changing the password drops the cached user"""
+        self.client.get(ME_URL)
+        self.client.patch(ME_URL, {'password': 'newpass123'})
+
+        self.assertEqual(len(token_cache._entries), 0)
+
+    def test_invalidation_is_repeated_on_commit(self):
+        """Test a user cached while the write was not yet committed is dropped once it is"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+            # another request authenticates before the commit, and caches the user as it was
+            token_cache.set(self.token.key, get_user_model().objects.get(pk=self.user.pk), self.token)
+
+        self.assertIsNone(token_cache.get(self.token.key))
+
+    def test_cached_user_is_not_shared_between_requests(self):
+        """Test each hit gets its own copy of the user"""
+        token_cache.set(self.token.key, self.user, self.token)
+        first, _ = token_cache.get(self.token.key)
+        first.name = "Changed"
+
+        second, _ = token_cache.get(self.token.key)
+        self.assertNotEqual(second.name, "Changed")
+
+
+class TokenCacheTests(TestCase):
+    """Test the token cache itself"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email="test@example.com", password="testpass123")
+        self.token = Token.objects.create(user=self.user)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """Test the cache keeps at most max_entries"""
+        cache = TokenCache(max_entries=2)
+        cache.set('a', self.user, self.token)
+        cache.set('b', self.user, self.token)
+        cache.get('a')
+        cache.set('c', self.user, self.token)
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_entries_expire(self):
+        """Test entries older than the timeout are misses"""
+        cache = TokenCache(timeout=60)
+        with mock.patch('user.authentication.time.monotonic', return_value=1000):
+            cache.set('a', self.user, self.token)
+        with mock.patch('user.authentication.time.monotonic', return_value=1061):
+            self.assertIsNone(cache.get('a'))
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_invalidation_reaches_other_workers_through_shared_cache(self):
+        """Test a user invalidated in one worker is dropped by another"""
+        this_worker = TokenCache(shared_cache='shared')
+        other_worker = TokenCache(shared_cache='shared')
+        other_worker.set(self.token.key, self.user, self.token)
+        self.assertIsNotNone(this_worker.get(self.token.key))
+
+        this_worker.invalidate_user(self.user.pk)
+
+        self.assertIsNone(other_worker.get(self.token.key))
+        self.assertIsNone(this_worker.get(self.token.key))
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_deleted_token_is_dropped_by_other_workers(self):
+        """Test deleting a token in one worker drops the copy another worker keeps in process"""
+        this_worker = TokenCache(shared_cache='shared')
+        other_worker = TokenCache(shared_cache='shared')
+        other_worker.set(self.token.key, self.user, self.token)
+
+        with mock.patch('user.authentication.token_cache', this_worker):
+            self.token.delete()
+
+        self.assertIsNone(other_worker.get(self.token.key))
+
+    @mock.patch.dict('os.environ', {'GUNICORN_WORKERS': '4'})
+    @override_settings(TOKEN_AUTH_CACHE={'SHARED_CACHE': None})
+    def test_disabled_with_several_workers_and_no_shared_cache(self):
+        """Test the cache stays off when other workers could not see its invalidations"""
+        with self.assertLogs('user.authentication', level='WARNING'):
+            self.assertFalse(TokenCache.from_settings().enabled)
+
+    @mock.patch.dict('os.environ', {'GUNICORN_WORKERS': '4'})
+    @override_settings(TOKEN_AUTH_CACHE={'SHARED_CACHE': 'default'})
+    def test_disabled_with_several_workers_and_a_process_local_cache(self):
+        """Test a LocMem cache does not count as shared between workers"""
+        with self.assertLogs('user.authentication', level='WARNING'):
+            self.assertFalse(TokenCache.from_settings().enabled)
+
+    @mock.patch.dict('os.environ', {'GUNICORN_WORKERS': '4'})
+    @override_settings(CACHES=MEMCACHED_CACHES, TOKEN_AUTH_CACHE={'SHARED_CACHE': 'default'})
+    def test_enabled_with_several_workers_and_a_shared_cache(self):
+        """Test memcached shared by the workers enables the cache"""
+        self.assertTrue(TokenCache.from_settings().enabled)
+
+    @mock.patch.dict('os.environ', {'GUNICORN_WORKERS': '1'})
+    @override_settings(TOKEN_AUTH_CACHE={'SHARED_CACHE': None})
+    def test_enabled_with_a_single_worker(self):
+        """Test a single process needs no shared cache"""
+        self.assertTrue(TokenCache.from_settings().enabled)
+
+    def test_disabled_cache_is_bypassed(self):
+        """Test requests are authenticated from the database when the cache is off"""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        with mock.patch('user.authentication.token_cache', TokenCache(enabled=False)) as disabled:
+            client.get(ME_URL)
+            with self.assertNumQueries(1):
+                response = client.get(ME_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(disabled.stats()['misses'], 0)
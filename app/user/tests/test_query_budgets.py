@@ -0,0 +1,56 @@
+"""
+Query budgets of the user api: every route and method declares the most queries it may run
+"""
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.query_budget import QueryBudget, QueryBudgetTestMixin, route_names
+from user import urls
+from user.authentication import token_cache
+
+# users in the list, enough for a query per row to go over a budget without one
+ROWS = 3
+
+BUDGETS = {
+    # the default team is looked up, and created the first time, for every new user
+    'user:create': {'POST': QueryBudget(11)},
+    'user:token': {'POST': QueryBudget(4)},
+    'user:me': {'GET': QueryBudget(1), 'PATCH': QueryBudget(6)},
+    'user:list': {'GET': QueryBudget(2)},
+}
+
+
+class QueryBudgetTestCase(QueryBudgetTestMixin, TestCase):
+    """Test each route of the user api stays within its query budget"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@example.com', password='testpass')
+        for i in range(ROWS - 1):
+            get_user_model().objects.create_user(email=f'user{i}@example.com', password='testpass')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+
+    def request(self, method, route, rows=0, data=None):
+        """Send a request with a cold token cache and assert it stays within the budget of its route"""
+        token_cache.clear()
+        with self.assertQueryBudget(BUDGETS[route][method], rows, f'{method} {route}'):
+            response = getattr(self.client, method.lower())(reverse(route), data)
+        self.assertLess(response.status_code, 400, response.content)
+        return response
+
+    def test_every_route_has_a_budget(self):
+        """Test a route added to user/urls.py can not go without a budget"""
+        self.assertEqual(route_names(urls.urlpatterns, 'user'), set(BUDGETS))
+
+    def test_routes(self):
+        self.request('POST', 'user:create', data={'email': 'new@example.com', 'password': 'testpass123',
+                                                  'name': 'New'})
+        self.request('POST', 'user:token', data={'email': 'test@example.com', 'password': 'testpass'})
+        self.request('GET', 'user:me')
+        self.request('PATCH', 'user:me', data={'name': 'Changed'})
+        response = self.request('GET', 'user:list', rows=ROWS + 1)
+        self.assertEqual(len(response.json()), ROWS + 1)
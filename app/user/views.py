@@ -2,11 +2,12 @@
 Views for the user Api
 """
 
-from rest_framework import generics, authentication, permissions
+from rest_framework import generics, permissions
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
 
 from core.models import User
+from user.authentication import CachedTokenAuthentication
 from user.serializers import (UserSerializer,
                               AuthTokenSerializer, UserListSerializer
                               )
@@ -16,7 +17,7 @@ class UserList(generics.ListAPIView):
     """View for listing all users in the system"""
     queryset = User.objects.all()
     serializer_class = UserListSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
 
@@ -34,7 +35,7 @@ class CreateTokenView(ObtainAuthToken):
 class ManageUserView(generics.RetrieveUpdateAPIView):
     """Manage the authenticated user"""
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):